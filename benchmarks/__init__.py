@@ -0,0 +1,45 @@
+"""
+Ad-hoc benchmarks. Each module is runnable on its own, e.g.:
+
+    python -m benchmarks.auth_user_cache
+
+They use the configured database settings but run against a throwaway
+test database, so they never touch real data.
+"""
+import os
+import time
+from contextlib import contextmanager
+
+
+def setup_django():
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+
+    import django
+    django.setup()
+
+
+@contextmanager
+def test_database():
+    from django.db import connection
+    from django.test.utils import setup_test_environment, teardown_test_environment
+
+    setup_test_environment()
+    old_name = connection.settings_dict['NAME']
+    connection.creation.create_test_db(verbosity=0, autoclobber=True)
+
+    try:
+        yield
+    finally:
+        connection.creation.destroy_test_db(old_name, verbosity=0)
+        teardown_test_environment()
+
+
+@contextmanager
+def timer():
+    result = {}
+    start = time.perf_counter()
+
+    try:
+        yield result
+    finally:
+        result['elapsed'] = time.perf_counter() - start
@@ -0,0 +1,150 @@
+"""
+Throughput and latency of the OTP and login endpoints under concurrent load,
+served by gunicorn (WSGI, one worker with a thread per request) and uvicorn
+(ASGI, one worker).
+
+    python -m benchmarks.asgi_vs_wsgi [concurrency] [seconds]
+
+The servers run in subprocesses against the throwaway test database, which
+therefore has to be one they can reach (i.e. not an in-memory SQLite one).
+Twilio lookups are replaced by a stand-in with a fixed latency, see
+benchmarks/load_app.py.
+"""
+import asyncio
+import os
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import time
+
+from benchmarks import setup_django, test_database
+
+EMAIL = 'bench@example.com'
+PASSWORD = 'bench-password'
+
+endpoints = {
+    'otp/send': lambda: ('/users/otp/send/', {'phone': f'+1555{random.randrange(10 ** 7):07d}'}),
+    'login/email': lambda: ('/users/login/email/', {'email': EMAIL, 'password': PASSWORD}),
+}
+
+
+def servers(port, concurrency):
+    return {
+        'wsgi': [
+            'gunicorn', 'benchmarks.load_app:wsgi_application',
+            '--bind', f'127.0.0.1:{port}',
+            '--workers', '1',
+            '--threads', str(concurrency),
+        ],
+        'asgi': [
+            'uvicorn', 'benchmarks.load_app:asgi_application',
+            '--host', '127.0.0.1',
+            '--port', str(port),
+            '--workers', '1',
+            '--no-access-log',
+        ],
+    }
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def wait_for_port(port, timeout=30):
+    deadline = time.monotonic() + timeout
+
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection(('127.0.0.1', port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+
+    raise RuntimeError(f'server did not start listening on port {port}')
+
+
+async def load(port, endpoint, concurrency, seconds):
+    import aiohttp
+
+    latencies = []
+    errors = 0
+    deadline = time.monotonic() + seconds
+
+    async def worker(session):
+        nonlocal errors
+
+        while time.monotonic() < deadline:
+            path, body = endpoints[endpoint]()
+            start = time.perf_counter()
+
+            try:
+                async with session.post(f'http://127.0.0.1:{port}{path}', json=body) as response:
+                    await response.read()
+                    ok = response.status == 200
+            except aiohttp.ClientError:
+                ok = False
+
+            if ok:
+                latencies.append(time.perf_counter() - start)
+            else:
+                errors += 1
+
+    connector = aiohttp.TCPConnector(limit=concurrency)
+
+    async with aiohttp.ClientSession(connector=connector) as session:
+        await asyncio.gather(*(worker(session) for _ in range(concurrency)))
+
+    return latencies, errors
+
+
+def percentile(values, percent):
+    if not values:
+        return 0.0
+
+    return sorted(values)[min(len(values) - 1, int(len(values) * percent / 100))]
+
+
+def main(concurrency=100, seconds=10):
+    setup_django()
+
+    from django.db import connection
+
+    from users.models import User
+
+    with test_database():
+        User.objects.create_user(email=EMAIL, password=PASSWORD)
+
+        env = dict(os.environ, DB_NAME=connection.settings_dict['NAME'])
+
+        print(f'concurrency {concurrency}, {seconds}s per run\n')
+        print(f'{"server":<8}{"endpoint":<14}{"req/s":>10}{"p50 ms":>10}{"p99 ms":>10}{"errors":>8}')
+
+        port = free_port()
+
+        for server, command in servers(port, concurrency).items():
+            process = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+            try:
+                wait_for_port(port)
+
+                for endpoint in endpoints:
+                    latencies, errors = asyncio.run(load(port, endpoint, concurrency, seconds))
+
+                    print(
+                        f'{server:<8}{endpoint:<14}'
+                        f'{len(latencies) / seconds:>10.1f}'
+                        f'{statistics.median(latencies) * 1000 if latencies else 0:>10.1f}'
+                        f'{percentile(latencies, 99) * 1000:>10.1f}'
+                        f'{errors:>8}'
+                    )
+            finally:
+                process.terminate()
+                process.wait()
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,55 @@
+"""
+DB round-trips and latency per authenticated request, comparing simplejwt's
+JWTAuthentication with CachedJWTAuthentication.
+
+    python -m benchmarks.auth_user_cache [requests]
+"""
+import sys
+
+from benchmarks import setup_django, test_database, timer
+
+
+def run(authentication, request, requests):
+    from django.db import connection
+    from django.test.utils import CaptureQueriesContext
+
+    with CaptureQueriesContext(connection) as queries, timer() as elapsed:
+        for _ in range(requests):
+            authentication.authenticate(request)
+
+    return len(queries), elapsed['elapsed']
+
+
+def main(requests=1000):
+    setup_django()
+
+    from django.core.cache import cache
+    from rest_framework.test import APIRequestFactory
+    from rest_framework_simplejwt.authentication import JWTAuthentication
+    from rest_framework_simplejwt.tokens import AccessToken
+
+    from core.utils.authentication import CachedJWTAuthentication, local_users
+    from users.models import User
+
+    with test_database():
+        user = User.objects.create_user(email='bench@example.com', password='bench-password')
+        token = AccessToken.for_user(user)
+
+        request = APIRequestFactory().get('/', HTTP_AUTHORIZATION=f'Bearer {token}')
+
+        cache.clear()
+        local_users.clear()
+
+        print(f'{"authentication":<28}{"queries/request":>18}{"us/request":>14}')
+
+        for authentication in (JWTAuthentication(), CachedJWTAuthentication()):
+            queries, elapsed = run(authentication, request, requests)
+            print(
+                f'{type(authentication).__name__:<28}'
+                f'{queries / requests:>18.3f}'
+                f'{elapsed / requests * 1e6:>14.1f}'
+            )
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,73 @@
+"""
+Access token verification throughput per signing algorithm, both through
+the simplejwt backend used by this app and through the JWKSVerifier used by
+downstream services.
+
+    python -m benchmarks.jwt_verify [iterations]
+"""
+import json
+import sys
+from datetime import timedelta
+
+from benchmarks import setup_django, timer
+
+
+def throughput(function, token, iterations):
+    with timer() as elapsed:
+        for _ in range(iterations):
+            function(token)
+
+    return iterations / elapsed['elapsed']
+
+
+def main(iterations=5000):
+    setup_django()
+
+    from django.utils import timezone
+    from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+
+    from core.utils.jwt_verifier import JWKSVerifier
+    from core.utils.keyring import KeyRing, SigningKey
+    from core.utils.tokens import KeyRingTokenBackend
+    from rest_framework_simplejwt.state import token_backend as symmetric_backend
+
+    payload = {
+        'token_type': 'access',
+        'exp': int((timezone.now() + timedelta(hours=1)).timestamp()),
+        'jti': 'c9bf9e5716854c89bafbff5af830be8a',
+        'user_id': 1,
+    }
+
+    private_keys = {
+        'RS256': rsa.generate_private_key(public_exponent=65537, key_size=2048),
+        'ES256': ec.generate_private_key(ec.SECP256R1()),
+        'EdDSA': ed25519.Ed25519PrivateKey.generate(),
+    }
+
+    print(f'{"algorithm":<12}{"sign/s":>12}{"backend verify/s":>20}{"JWKS verify/s":>18}')
+
+    token = symmetric_backend.encode(payload)
+    print(
+        f'{symmetric_backend.algorithm:<12}'
+        f'{throughput(lambda _: symmetric_backend.encode(payload), None, iterations):>12.0f}'
+        f'{throughput(symmetric_backend.decode, token, iterations):>20.0f}'
+        f'{"n/a":>18}'
+    )
+
+    for algorithm, private_key in private_keys.items():
+        keyring = KeyRing([SigningKey('bench', private_key=private_key)])
+        backend = KeyRingTokenBackend(keyring)
+        verifier = JWKSVerifier(jwks=json.loads(keyring.jwks()))
+
+        token = backend.encode(payload)
+
+        print(
+            f'{algorithm:<12}'
+            f'{throughput(lambda _: backend.encode(payload), None, iterations):>12.0f}'
+            f'{throughput(backend.decode, token, iterations):>20.0f}'
+            f'{throughput(verifier.verify, token, iterations):>18.0f}'
+        )
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,39 @@
+"""
+The project's WSGI and ASGI applications for benchmarks/asgi_vs_wsgi.py,
+with the Twilio gateway's phone number lookups replaced by a stand-in that
+answers after LOOKUP_LATENCY seconds (0.05 by default), so no requests leave the machine.
+
+    gunicorn benchmarks.load_app:wsgi_application
+    uvicorn benchmarks.load_app:asgi_application
+"""
+import asyncio
+import os
+from types import SimpleNamespace
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'core.settings')
+
+from django.core.asgi import get_asgi_application  # noqa: E402
+from django.core.wsgi import get_wsgi_application  # noqa: E402
+
+wsgi_application = get_wsgi_application()
+asgi_application = get_asgi_application()
+
+from core.utils.twilio_gateway import gateway  # noqa: E402
+
+LOOKUP_LATENCY = float(os.environ.get('LOOKUP_LATENCY', 0.05))
+
+
+class PhoneNumberLookup:
+    def __init__(self, phone):
+        self.phone = phone
+
+    async def fetch_async(self):
+        await asyncio.sleep(LOOKUP_LATENCY)
+
+        return SimpleNamespace(valid=True, phone_number=self.phone)
+
+
+gateway._start()
+gateway.client = SimpleNamespace(
+    lookups=SimpleNamespace(v2=SimpleNamespace(phone_numbers=PhoneNumberLookup)),
+)
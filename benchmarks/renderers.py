@@ -0,0 +1,81 @@
+"""
+Render time per response size: the previous renderer (copy the envelope into
+a second dict, then JSONRenderer) against CustomJSONRenderer, with and
+without orjson, and with the data pre-encoded as a JSONFragment.
+
+    python -m benchmarks.renderers [iterations]
+"""
+import sys
+from unittest import mock
+
+from benchmarks import setup_django, timer
+
+
+def per_render(function, body, iterations):
+    with timer() as elapsed:
+        for _ in range(iterations):
+            function(body)
+
+    return elapsed['elapsed'] / iterations * 1e6
+
+
+def main(iterations=200):
+    setup_django()
+
+    from django.utils import timezone
+    from rest_framework.renderers import JSONRenderer
+
+    import users.api  # noqa: F401 - settles the renderer import order
+    from core.utils.renderers import CustomJSONRenderer, Envelope, JSONFragment
+
+    json_renderer = JSONRenderer()
+    renderer = CustomJSONRenderer()
+
+    def legacy(body):
+        response_data = {'data': {}, 'status': 500, 'errors': [], 'message': ''}
+
+        for key in response_data:
+            if body.get(key) is not None:
+                response_data[key] = body.get(key)
+
+        return json_renderer.render(response_data)
+
+    now = timezone.now()
+
+    print(f'{"users":>8}{"bytes":>12}{"legacy us":>12}{"json us":>12}{"orjson us":>12}{"fragment us":>14}')
+
+    for size in (1, 10, 100, 1000, 10000):
+        users = [{
+            'id': n,
+            'email': f'user{n}@example.com',
+            'first_name': 'Zoë',
+            'last_name': 'Example',
+            'phone': f'+1555{n:07d}',
+            'country_code': '+1',
+            'date_joined': now,
+            'last_login': now,
+            'is_verified': True,
+        } for n in range(size)]
+
+        body = Envelope(data={'results': users, 'next': None}, status=200, errors=[], message='')
+        fragment = Envelope(data=JSONFragment(renderer.encode(body['data'])), status=200, errors=[], message='')
+
+        assert legacy(body) == renderer.render(body) == renderer.render(fragment)
+
+        rounds = max(1, iterations * 100 // (size + 100))
+
+        with mock.patch('core.utils.renderers.orjson', None):
+            stdlib = per_render(renderer.render, body, rounds)
+
+        print(
+            f'{size:>8}'
+            f'{len(legacy(body)):>12}'
+            f'{per_render(legacy, body, rounds):>12.1f}'
+            f'{stdlib:>12.1f}'
+            f'{per_render(renderer.render, body, rounds):>12.1f}'
+            f'{per_render(renderer.render, fragment, rounds):>14.1f}'
+        )
+
+
+if __name__ == '__main__':
+    main(*map(int, sys.argv[1:]))
@@ -0,0 +1,123 @@
+"""
+Messages per second sending through a fresh SMTP connection per message
+(what `send_mail` does by default) and through the pooled backend, against
+a local stand-in SMTP server that adds a fixed delay to each new connection
+in place of the TCP, TLS and login round-trips of a real provider.
+
+    python -m benchmarks.smtp_pool [messages] [threads] [handshake ms]
+"""
+import asyncio
+import sys
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from benchmarks import setup_django, timer
+
+
+class StandInSMTPServer:
+    """
+    Just enough of SMTP for smtplib: accepts and discards every message.
+    """
+
+    def __init__(self, handshake=0.05):
+        self.handshake = handshake
+        self.connections = 0
+        self.messages = 0
+        self.loop = asyncio.new_event_loop()
+        self.port = None
+
+    def start(self):
+        started = threading.Event()
+
+        def run():
+            asyncio.set_event_loop(self.loop)
+            server = self.loop.run_until_complete(asyncio.start_server(self.handle, '127.0.0.1', 0))
+            self.port = server.sockets[0].getsockname()[1]
+            started.set()
+            self.loop.run_forever()
+
+        threading.Thread(target=run, daemon=True).start()
+        started.wait()
+
+    def stop(self):
+        self.loop.call_soon_threadsafe(self.loop.stop)
+
+    async def handle(self, reader, writer):
+        self.connections += 1
+        await asyncio.sleep(self.handshake)
+        writer.write(b'220 localhost ESMTP stand-in\r\n')
+
+        while line := await reader.readline():
+            command = line[:4].upper()
+
+            if command == b'EHLO':
+                writer.write(b'250-localhost\r\n250 8BITMIME\r\n')
+            elif command == b'DATA':
+                writer.write(b'354 End data with <CR><LF>.<CR><LF>\r\n')
+
+                while await reader.readline() not in (b'.\r\n', b''):
+                    pass
+
+                self.messages += 1
+                writer.write(b'250 OK\r\n')
+            elif command == b'QUIT':
+                writer.write(b'221 Bye\r\n')
+                break
+            else:
+                # HELO, MAIL, RCPT, RSET, NOOP
+                writer.write(b'250 OK\r\n')
+
+            await writer.drain()
+
+        writer.close()
+
+
+def run(send, messages, threads):
+    with ThreadPoolExecutor(threads) as executor, timer() as elapsed:
+        list(executor.map(send, range(messages)))
+
+    return elapsed['elapsed']
+
+
+def main(messages=500, threads=4, handshake=50):
+    setup_django()
+
+    from django.core.mail import EmailMessage, get_connection
+    from django.test.utils import override_settings
+
+    from core.utils.mail import SMTPConnectionPool
+
+    server = StandInSMTPServer(handshake / 1000)
+    server.start()
+
+    def message(i):
+        return EmailMessage('Verify your email', 'Body', 'bench@example.com', [f'user{i}@example.com'])
+
+    def per_message(i):
+        get_connection('django.core.mail.backends.smtp.EmailBackend').send_messages([message(i)])
+
+    print(f'{messages} messages, {threads} threads, {handshake}ms handshake')
+    print(f'{"":<12} {"msgs/sec":>10} {"connections":>12}')
+
+    with override_settings(EMAIL_HOST='127.0.0.1', EMAIL_PORT=server.port, EMAIL_USE_TLS=False, EMAIL_USE_SSL=False,
+                           EMAIL_HOST_USER='', EMAIL_HOST_PASSWORD=''):
+        pool = SMTPConnectionPool(
+            size=threads,
+            max_idle=30,
+            max_messages=100,
+            backend='django.core.mail.backends.smtp.EmailBackend',
+            timeout=10,
+        )
+
+        for name, send in (('per message', per_message), ('pooled', lambda i: pool.send_messages([message(i)]))):
+            server.connections = 0
+            elapsed = run(send, messages, threads)
+            print(f'{name:<12} {messages / elapsed:>10.0f} {server.connections:>12}')
+
+        pool.close()
+
+    server.stop()
+
+
+if __name__ == '__main__':
+    main(*(int(arg) for arg in sys.argv[1:]))
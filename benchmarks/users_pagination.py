@@ -0,0 +1,146 @@
+"""
+Peak RSS and latency of listing users, at 10k, 100k and 1M users:
+serializing the whole table into one response (what GetAllUsers used to
+do) against keyset pages of USERS_MAX_PAGE_SIZE users.
+
+    python -m benchmarks.users_pagination [sizes...]
+
+Each measurement runs in a fresh subprocess so that its peak RSS is its own,
+against the throwaway test database, which therefore has to be one they can
+reach (i.e. not an in-memory SQLite one).
+"""
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import time
+
+from benchmarks import setup_django, test_database, timer
+
+BATCH_SIZE = 10_000
+
+
+def populate(size):
+    from users.models import User
+
+    count = User.objects.count()
+
+    while count < size:
+        batch = min(BATCH_SIZE, size - count)
+        User.objects.bulk_create(
+            User(email=f'user{n}@example.com', first_name='Bench', last_name=f'User {n}', password='!')
+            for n in range(count, count + batch)
+        )
+        count += batch
+
+
+def peak_rss_mb() -> float:
+    # kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+
+def measure_full():
+    from users.api import GetAllUsers
+    from users.models import User
+    from users.schemas.serializers import UserSerializer
+
+    renderer = GetAllUsers.renderer_classes[0]()
+
+    with timer() as elapsed:
+        data = UserSerializer(User.objects.all(), many=True).data
+        body = renderer.render({'data': data, 'status': 200})
+
+    return {'seconds': elapsed['elapsed'], 'first_page_seconds': elapsed['elapsed'], 'bytes': len(body)}
+
+
+def measure_keyset():
+    from django.conf import settings
+    from rest_framework.request import Request
+    from rest_framework.test import APIRequestFactory
+
+    from core.utils.serializers import compile_serializer
+    from users.api import GetAllUsers, users_pagination
+    from users.models import User
+    from users.schemas.serializers import UserSerializer
+
+    renderer = GetAllUsers.renderer_classes[0]()
+    user_serializer = compile_serializer(UserSerializer)
+    factory = APIRequestFactory()
+    params = {'page_size': settings.USERS_MAX_PAGE_SIZE}
+    pages = []
+    size = 0
+
+    with timer() as elapsed:
+        while True:
+            start = time.perf_counter()
+
+            rows, cursor = users_pagination.paginate(
+                User.objects.values(*user_serializer.fields),
+                Request(factory.get('/users/users/', params)),
+            )
+            body = renderer.render({'data': {'results': user_serializer.rows(rows), 'next': cursor}, 'status': 200})
+
+            pages.append(time.perf_counter() - start)
+            size += len(body)
+
+            if not cursor:
+                break
+
+            params['cursor'] = cursor
+
+    return {
+        'seconds': elapsed['elapsed'],
+        'first_page_seconds': pages[0],
+        'median_page_seconds': statistics.median(pages),
+        'pages': len(pages),
+        'bytes': size,
+    }
+
+
+def child(mode):
+    setup_django()
+
+    result = {'full': measure_full, 'keyset': measure_keyset}[mode]()
+    result['peak_rss_mb'] = peak_rss_mb()
+
+    print(json.dumps(result))
+
+
+def main(*sizes):
+    sizes = sizes or (10_000, 100_000, 1_000_000)
+
+    setup_django()
+
+    from django.db import connection
+
+    with test_database():
+        env = dict(os.environ, DB_NAME=connection.settings_dict['NAME'])
+
+        print(f'{"users":>9} {"mode":<8}{"first page ms":>15}{"total s":>10}{"pages":>7}{"peak RSS MB":>13}')
+
+        for size in sizes:
+            populate(size)
+
+            for mode in ('full', 'keyset'):
+                output = subprocess.run(
+                    [sys.executable, '-m', 'benchmarks.users_pagination', '--child', mode],
+                    env=env, check=True, capture_output=True, text=True,
+                ).stdout
+                result = json.loads(output.strip().splitlines()[-1])
+
+                print(
+                    f'{size:>9} {mode:<8}'
+                    f'{result["first_page_seconds"] * 1000:>15.1f}'
+                    f'{result["seconds"]:>10.2f}'
+                    f'{result.get("pages", 1):>7}'
+                    f'{result["peak_rss_mb"]:>13.1f}'
+                )
+
+
+if __name__ == '__main__':
+    if sys.argv[1:2] == ['--child']:
+        child(sys.argv[2])
+    else:
+        main(*map(int, sys.argv[1:]))
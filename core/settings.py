@@ -115,6 +115,39 @@ DATABASES = {
 }
 
 
+# Caches
+#
+# "default" is shared by all processes: Redis when REDIS_URL is set, else a
+# per-process stand-in fit for development and tests only. "tiered" keeps a
+# bounded LRU in each process in front of it, for values that may be up to
+# CACHE_L1_TIMEOUT seconds stale or whose keys change when they do (see
+# core/utils/cache.py).
+
+REDIS_URL = env('REDIS_URL', default='')
+
+CACHES = {
+    'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': REDIS_URL,
+    } if REDIS_URL else {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        'LOCATION': 'default',
+        'OPTIONS': {
+            'MAX_ENTRIES': env.int('CACHE_MAX_ENTRIES', default=100_000),
+        },
+    },
+    'tiered': {
+        'BACKEND': 'core.utils.cache.TieredCache',
+        'LOCATION': 'tiered',
+        'OPTIONS': {
+            'L2': 'default',
+            'L1_MAX_ENTRIES': env.int('CACHE_L1_MAX_ENTRIES', default=10_000),
+            'L1_TIMEOUT': env.int('CACHE_L1_TIMEOUT', default=60),
+        },
+    },
+}
+
+
 # Password validation
 # https://docs.djangoproject.com/en/1.11/ref/settings/#auth-password-validators
 
@@ -169,7 +202,7 @@ SITE_ID = 1
 
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework_simplejwt.authentication.JWTAuthentication',
+        'core.utils.authentication.CachedJWTAuthentication',
     ],
 
     "DEFAULT_RENDERER_CLASSES": [
@@ -194,14 +227,71 @@ SILKY_IGNORE_PATHS = [
     r'^/admin/',
 ]
 
+# Argon2 cost parameters, tune with `python manage.py calibrate_hashers`
+
+PASSWORD_ARGON2_PROFILE = {
+    'TIME_COST': env.int('PASSWORD_ARGON2_TIME_COST', default=2),
+    'MEMORY_COST': env.int('PASSWORD_ARGON2_MEMORY_COST', default=102400),
+    'PARALLELISM': env.int('PASSWORD_ARGON2_PARALLELISM', default=8),
+}
+
 PASSWORD_HASHERS = [
+    "core.utils.hashers.TunedArgon2PasswordHasher",
     "django.contrib.auth.hashers.PBKDF2PasswordHasher",
     "django.contrib.auth.hashers.PBKDF2SHA1PasswordHasher",
-    "django.contrib.auth.hashers.Argon2PasswordHasher",
     "django.contrib.auth.hashers.BCryptSHA256PasswordHasher",
     "django.contrib.auth.hashers.ScryptPasswordHasher",
 ]
 
+# Password hashing pool (see core/utils/passwords.py)
+#
+# Login and registration hash passwords on this many worker processes (0
+# hashes inline). Once MAX_PENDING jobs are waiting for a worker, further
+# requests get a 503 with a Retry-After header.
+
+PASSWORD_HASHING_WORKERS = env.int('PASSWORD_HASHING_WORKERS', default=os.cpu_count() or 1)
+PASSWORD_HASHING_MAX_PENDING = env.int('PASSWORD_HASHING_MAX_PENDING', default=32)
+PASSWORD_HASHING_TIMEOUT = env.int('PASSWORD_HASHING_TIMEOUT', default=10)
+PASSWORD_HASHING_RETRY_AFTER = env.int('PASSWORD_HASHING_RETRY_AFTER', default=1)
+PASSWORD_HASHING_START_METHOD = env('PASSWORD_HASHING_START_METHOD', default='spawn')
+
+# Outbound email, SMS and voice sends (see core/utils/dispatch.py). When the
+# queue is full, "block" waits up to DISPATCH_BLOCK_TIMEOUT seconds for room
+# (holding the request's thread, or the event loop in async views), "drop"
+# skips the send and "reject" answers 503.
+
+DISPATCH_WORKERS = env.int('DISPATCH_WORKERS', default=8)
+DISPATCH_MAX_QUEUE = env.int('DISPATCH_MAX_QUEUE', default=1000)
+DISPATCH_QUEUE_FULL_POLICY = env('DISPATCH_QUEUE_FULL_POLICY', default='reject')
+DISPATCH_BLOCK_TIMEOUT = env.float('DISPATCH_BLOCK_TIMEOUT', default=5)
+DISPATCH_RETRY_AFTER = env.int('DISPATCH_RETRY_AFTER', default=5)
+DISPATCH_DRAIN_TIMEOUT = env.float('DISPATCH_DRAIN_TIMEOUT', default=30)
+DISPATCH_CHANNEL_LIMITS = env.dict(
+    'DISPATCH_CHANNEL_LIMITS',
+    cast={'value': int},
+    default={'email': 4, 'sms': 4, 'voice': 2},
+)
+
+# Transactional outbox (see users/outbox.py), drained by dispatch_outbox.
+# Failed sends are retried after OUTBOX_BACKOFF_BASE * 2^(attempts - 1)
+# seconds, capped at OUTBOX_BACKOFF_MAX. A message's lease is renewed right
+# before it is sent, so OUTBOX_LEASE_SECONDS only has to outlast one send
+# (EMAIL_TIMEOUT, TWILIO_DEADLINE).
+
+OUTBOX_BATCH_SIZE = env.int('OUTBOX_BATCH_SIZE', default=100)
+OUTBOX_LEASE_SECONDS = env.int('OUTBOX_LEASE_SECONDS', default=60)
+OUTBOX_MAX_ATTEMPTS = env.int('OUTBOX_MAX_ATTEMPTS', default=10)
+OUTBOX_BACKOFF_BASE = env.int('OUTBOX_BACKOFF_BASE', default=5)
+OUTBOX_BACKOFF_MAX = env.int('OUTBOX_BACKOFF_MAX', default=60 * 60)
+OUTBOX_POLL_INTERVAL = env.float('OUTBOX_POLL_INTERVAL', default=1)
+
+# Expired token purging (see users/purge.py). With an interval set, every
+# web process also purges on a background thread.
+
+TOKEN_PURGE_BATCH_SIZE = env.int('TOKEN_PURGE_BATCH_SIZE', default=1000)
+TOKEN_PURGE_SLEEP = env.float('TOKEN_PURGE_SLEEP', default=0.1)
+TOKEN_PURGE_INTERVAL = env.int('TOKEN_PURGE_INTERVAL', default=0)
+
 # SMS
 
 SEND_SMS_TEXT = env('SEND_SMS_TEXT', default=False)
@@ -209,6 +299,10 @@ SMS_CODE_LENGTH = env('SMS_CODE_LENGTH', default=6)
 SMS_CODE_EXPIRY = timedelta(minutes=10)
 SMS_CODE_MAXIMUM_ATTEMPTS = env('SMS_CODE_MAXIMUM_ATTEMPTS', default=5)
 
+# Where codes are kept between sending and verifying (see core/utils/otp.py).
+# The cache store needs a cache shared by all processes.
+OTP_STORE = env('OTP_STORE', default='core.utils.otp.CacheOTPStore')
+
 SEND_SMS_CALL = env('SEND_SMS_CALL', default=False)
 
 ## Twilio
@@ -216,6 +310,33 @@ SEND_SMS_CALL = env('SEND_SMS_CALL', default=False)
 TWILIO_ACCOUNT_SID = env('TWILIO_ACCOUNT_SID')
 TWILIO_AUTH_TOKEN = env('TWILIO_AUTH_TOKEN')
 TWILIO_PHONE_NUMBER = env('TWILIO_PHONE_NUMBER')
+TWILIO_VERIFIED_NUMBER = env('TWILIO_VERIFIED_NUMBER', default='')
+
+# Twilio HTTP client (see core/utils/twilio_gateway.py). Timeouts are in
+# seconds; a call gives up after TWILIO_DEADLINE seconds, retries included.
+
+TWILIO_CONNECT_TIMEOUT = env.float('TWILIO_CONNECT_TIMEOUT', default=3)
+TWILIO_READ_TIMEOUT = env.float('TWILIO_READ_TIMEOUT', default=10)
+TWILIO_MAX_RETRIES = env.int('TWILIO_MAX_RETRIES', default=2)
+TWILIO_POOL_SIZE = env.int('TWILIO_POOL_SIZE', default=20)
+TWILIO_KEEPALIVE = env.float('TWILIO_KEEPALIVE', default=30)
+TWILIO_DEADLINE = env.float('TWILIO_DEADLINE', default=20)
+
+# Phone numbers (see core/utils/phones.py). Numbers without a calling code
+# are read as numbers of PHONE_DEFAULT_COUNTRY_CODE (or the user's
+# country_code). Numbers that parse are also checked with Twilio Lookup when
+# PHONE_LOOKUP_VERIFY is set.
+
+PHONE_DEFAULT_COUNTRY_CODE = env('PHONE_DEFAULT_COUNTRY_CODE', default='+1')
+PHONE_LOOKUP_VERIFY = env.bool('PHONE_LOOKUP_VERIFY', default=False)
+
+# Twilio Lookup results cache (see core/utils/lookups.py), in seconds. Set
+# PHONE_LOOKUP_MODEL to '' to keep results in the caches only.
+
+PHONE_LOOKUP_VALID_TIMEOUT = env.int('PHONE_LOOKUP_VALID_TIMEOUT', default=60 * 60 * 24 * 30)
+PHONE_LOOKUP_INVALID_TIMEOUT = env.int('PHONE_LOOKUP_INVALID_TIMEOUT', default=60 * 60)
+PHONE_LOOKUP_LOCAL_SIZE = env.int('PHONE_LOOKUP_LOCAL_SIZE', default=10_000)
+PHONE_LOOKUP_MODEL = env('PHONE_LOOKUP_MODEL', default='users.PhoneLookup')
 
 # Email
 
@@ -224,7 +345,16 @@ EMAIL_PORT = env('SMTP_PORT', default=587)
 EMAIL_HOST_USER = env('SMTP_USER')
 EMAIL_HOST_PASSWORD = env('SMTP_PASS')
 EMAIL_USE_TLS = env('SMTP_TLS', default=True)
-EMAIL_BACKEND = env('EMAIL_BACKEND', default='django.core.mail.backends.smtp.EmailBackend')
+EMAIL_BACKEND = env('EMAIL_BACKEND', default='core.utils.mail.PooledEmailBackend')
+EMAIL_TIMEOUT = env.float('EMAIL_TIMEOUT', default=30)
+
+# Pooled SMTP connections (core/utils/mail.py). EMAIL_POOL_BACKEND is the
+# backend each pooled connection is made with.
+
+EMAIL_POOL_BACKEND = env('EMAIL_POOL_BACKEND', default='django.core.mail.backends.smtp.EmailBackend')
+EMAIL_POOL_SIZE = env.int('EMAIL_POOL_SIZE', default=4)
+EMAIL_POOL_MAX_IDLE = env.float('EMAIL_POOL_MAX_IDLE', default=30)
+EMAIL_POOL_MAX_MESSAGES = env.int('EMAIL_POOL_MAX_MESSAGES', default=100)
 
 EMAIL_VERIFICATION_TOKEN_EXPIRY = timedelta(days=1)
 
@@ -240,17 +370,73 @@ SIMPLE_JWT = {
     "REFRESH_TOKEN_LIFETIME": timedelta(days=1),
     "ACCESS_TOKEN_LIFETIME": timedelta(minutes=1),
     "ROTATE_REFRESH_TOKENS": True,
-    "BLACKLIST_AFTER_ROTATION": False,
+    "BLACKLIST_AFTER_ROTATION": True,
     "ALGORITHM": "HS256",
     "SIGNING_KEY": SECRET_KEY,
     "VERIFYING_KEY": None,
     "AUTH_HEADER_TYPES": ("Bearer",),
     "USER_ID_FIELD": "id",
     "USER_ID_CLAIM": "user_id",
-    "AUTH_TOKEN_CLASSES": ("rest_framework_simplejwt.tokens.AccessToken",),
+    "AUTH_TOKEN_CLASSES": ("core.utils.tokens.AccessToken",),
     "TOKEN_TYPE_CLAIM": "token_type",
+    "TOKEN_REFRESH_SERIALIZER": "users.serializers.TokenRefreshSerializer",
 }
 
+# GetAllUsers pages (see core/utils/pagination.py), clients may ask for up
+# to USERS_MAX_PAGE_SIZE users with ?page_size=
+
+USERS_PAGE_SIZE = env.int('USERS_PAGE_SIZE', default=100)
+USERS_MAX_PAGE_SIZE = env.int('USERS_MAX_PAGE_SIZE', default=1000)
+
+# Rendered GetAllUsers pages are cached in the 'tiered' cache under the users
+# table version (see core/utils/conditional.py), so they never go stale and
+# only age out after USERS_PAGE_CACHE_TIMEOUT seconds
+
+USERS_PAGE_CACHE_TIMEOUT = env.int('USERS_PAGE_CACHE_TIMEOUT', default=60 * 60 * 2)
+
+# Rows read from the database per batch by user exports (see users/export.py)
+
+USER_EXPORT_CHUNK_SIZE = env.int('USER_EXPORT_CHUNK_SIZE', default=2000)
+
+# Users created per transaction by the import_users command (see users/imports.py)
+
+USER_IMPORT_BATCH_SIZE = env.int('USER_IMPORT_BATCH_SIZE', default=1000)
+
+# Idempotency-Key handling for POST endpoints (see core/utils/idempotency.py).
+# The first response to a key is replayed to retries for IDEMPOTENCY_TIMEOUT
+# seconds. The cache must be shared by all processes.
+
+IDEMPOTENCY_HEADER = env('IDEMPOTENCY_HEADER', default='Idempotency-Key')
+IDEMPOTENCY_CACHE = env('IDEMPOTENCY_CACHE', default='default')
+IDEMPOTENCY_TIMEOUT = env.int('IDEMPOTENCY_TIMEOUT', default=60 * 60 * 24)
+IDEMPOTENCY_LOCK_TIMEOUT = env.int('IDEMPOTENCY_LOCK_TIMEOUT', default=60)
+
+# Refresh token revocation index (see core/utils/revocation.py)
+
+REVOCATION_INDEX_SYNC_INTERVAL = env.int('REVOCATION_INDEX_SYNC_INTERVAL', default=60)
+REVOCATION_INDEX_REBUILD_INTERVAL = env.int('REVOCATION_INDEX_REBUILD_INTERVAL', default=60 * 60)
+
+# Email/phone existence index (see core/utils/existence.py)
+
+EXISTENCE_INDEX_SYNC_INTERVAL = env.int('EXISTENCE_INDEX_SYNC_INTERVAL', default=60)
+EXISTENCE_INDEX_REBUILD_INTERVAL = env.int('EXISTENCE_INDEX_REBUILD_INTERVAL', default=60 * 60)
+
+# Asymmetric signing keys (see core/utils/keyring.py)
+#
+# Comma separated "<kid>=<path to pem>" entries, newest first. The first
+# private key signs new tokens; every listed key (private or public) keeps
+# verifying tokens with its kid. Generate keys with
+# `python manage.py generate_signing_key`. When empty, tokens are signed
+# with the symmetric ALGORITHM/SIGNING_KEY above.
+
+JWT_SIGNING_KEYS = env.list('JWT_SIGNING_KEYS', default=[])
+JWT_ACCEPT_SYMMETRIC_TOKENS = env.bool('JWT_ACCEPT_SYMMETRIC_TOKENS', default=True)
+JWT_JWKS_MAX_AGE = env.int('JWT_JWKS_MAX_AGE', default=60 * 15)
+
+# Authenticated user cache (see core/utils/authentication.py)
+
+AUTH_USER_CACHE_TIMEOUT = env.int('AUTH_USER_CACHE_TIMEOUT', default=300)
+
 # Allauth
 
 ACCOUNT_EMAIL_REQUIRED = True
@@ -284,7 +470,8 @@ REST_AUTH = {
     "USE_JWT": True,
     "JWT_AUTH_HTTPONLY": False,
 
-    'REGISTER_SERIALIZER': 'users.schemas.serializers.UserRegistrationSerializer'
+    'REGISTER_SERIALIZER': 'users.schemas.serializers.UserRegistrationSerializer',
+    'JWT_TOKEN_CLAIMS_SERIALIZER': 'users.serializers.TokenObtainPairSerializer',
 
 }
 
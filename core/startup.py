@@ -0,0 +1,31 @@
+"""
+Per-process startup work, shared by core/wsgi.py and core/asgi.py.
+"""
+
+from django.conf import settings
+from django.db import DatabaseError, connections
+
+
+def warm_up():
+    from core.utils.existence import existence_index
+    from core.utils.revocation import revocation_index
+
+    # Warm the in-memory indexes before the first request. If the database
+    # is not reachable yet they are built on first use instead.
+
+    try:
+        revocation_index.build()
+        existence_index.build()
+    except DatabaseError:
+        pass
+    finally:
+        # don't hand a connection opened at import time to forked workers
+        connections.close_all()
+
+    # Purge expired tokens from here when nothing runs purge_expired_tokens
+    # on a schedule.
+
+    if settings.TOKEN_PURGE_INTERVAL:
+        from users.purge import start_periodic_purge
+
+        start_periodic_purge()
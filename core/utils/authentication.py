@@ -0,0 +1,85 @@
+import copy
+from uuid import uuid4
+
+from django.conf import settings
+from django.core.cache import cache, caches
+from django.utils.translation import gettext_lazy as _
+
+from rest_framework_simplejwt.authentication import JWTAuthentication
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, InvalidToken
+from rest_framework_simplejwt.settings import api_settings
+
+# Users resolved from access tokens are cached in the "tiered" cache (a
+# per-process LRU in front of the shared cache), keyed by user id and auth
+# version.
+#
+# The auth version is a random token stored in the shared cache. Saving or
+# deleting a user replaces it (see users/signals.py), which orphans every
+# cached copy of that user in every process at once.
+
+user_cache = caches['tiered']
+
+# this process's copies, shared by all threads
+local_users = user_cache.local
+
+
+def _version_key(user_id) -> str:
+    return f'auth:version:{user_id}'
+
+
+def _user_key(user_id, version) -> str:
+    return f'auth:user:{user_id}:{version}'
+
+
+def get_auth_version(user_id) -> str:
+    key = _version_key(user_id)
+    version = cache.get(key)
+
+    if version is None:
+        version = uuid4().hex
+
+        # another process may have raced us to it, in which case theirs wins
+        if not cache.add(key, version, timeout=None):
+            version = cache.get(key) or version
+
+    return version
+
+
+def bump_auth_version(user_id):
+    """
+    Invalidate every cached copy of the given user.
+    """
+    cache.set(_version_key(user_id), uuid4().hex, timeout=None)
+
+
+class CachedJWTAuthentication(JWTAuthentication):
+    """
+    JWTAuthentication that resolves the user id claim through the local LRU
+    and the shared cache before falling back to the database.
+    """
+
+    def get_user(self, validated_token):
+        try:
+            user_id = validated_token[api_settings.USER_ID_CLAIM]
+        except KeyError:
+            raise InvalidToken(_("Token contained no recognizable user identification"))
+
+        version = get_auth_version(user_id)
+        user = user_cache.get_or_compute(
+            _user_key(user_id, version),
+            lambda: self.load_user(user_id),
+            timeout=settings.AUTH_USER_CACHE_TIMEOUT,
+        )
+
+        if not user.is_active:
+            raise AuthenticationFailed(_("User is inactive"), code="user_inactive")
+
+        # hand out a copy so per-request state (permission caches etc.)
+        # never leaks between requests sharing the cached instance
+        return copy.copy(user)
+
+    def load_user(self, user_id):
+        try:
+            return self.user_model.objects.get(**{api_settings.USER_ID_FIELD: user_id})
+        except self.user_model.DoesNotExist:
+            raise AuthenticationFailed(_("User not found"), code="user_not_found")
@@ -0,0 +1,66 @@
+import math
+from hashlib import blake2b
+
+
+class BloomFilter:
+    """
+    Fixed-size Bloom filter over strings.
+
+    `item in bloom` never has false negatives: False means the item was
+    definitely never added. True means it probably was, with a false positive
+    rate of about `error_rate` as long as no more than `capacity` items are
+    added.
+    """
+
+    def __init__(self, capacity=1000, error_rate=0.001):
+        capacity = max(capacity, 1)
+
+        self.capacity = capacity
+        self.error_rate = error_rate
+
+        self.size = max(8, int(-capacity * math.log(error_rate) / math.log(2) ** 2))
+        self.hashes = max(1, round(self.size / capacity * math.log(2)))
+        self.count = 0
+
+        self._bits = bytearray((self.size + 7) // 8)
+
+    def _positions(self, item):
+        # double hashing: derive every position from two 64 bit hashes
+        digest = blake2b(item.encode(), digest_size=16).digest()
+        h1 = int.from_bytes(digest[:8], 'little')
+        h2 = int.from_bytes(digest[8:], 'little') | 1
+
+        return [(h1 + i * h2) % self.size for i in range(self.hashes)]
+
+    def add(self, item):
+        for position in self._positions(item):
+            self._bits[position >> 3] |= 1 << (position & 7)
+
+        self.count += 1
+
+    def update(self, items):
+        for item in items:
+            self.add(item)
+
+    def __contains__(self, item):
+        bits = self._bits
+
+        return all(bits[position >> 3] & (1 << (position & 7)) for position in self._positions(item))
+
+    def __len__(self):
+        return self.count
+
+    @property
+    def size_bytes(self) -> int:
+        return len(self._bits)
+
+    @property
+    def false_positive_rate(self) -> float:
+        """
+        Estimated false positive rate for the number of items added so far.
+        """
+        return (1 - math.exp(-self.hashes * self.count / self.size)) ** self.hashes
+
+    @property
+    def is_saturated(self) -> bool:
+        return self.count > self.capacity
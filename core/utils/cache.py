@@ -0,0 +1,321 @@
+import math
+import random
+import time
+import uuid
+from collections import OrderedDict
+from threading import Lock
+
+from django.core.cache import cache, caches
+from django.core.cache.backends.base import DEFAULT_TIMEOUT, BaseCache
+
+from .metrics import metrics
+
+_MISSING = object()
+
+
+class LRUCache:
+    """
+    Small thread-safe, per-process LRU cache with an optional per-entry TTL.
+    """
+
+    def __init__(self, maxsize=1024, timeout=None):
+        self.maxsize = maxsize
+        self.timeout = timeout
+        self._data = OrderedDict()
+        self._lock = Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key, _MISSING)
+
+            if entry is _MISSING:
+                return default
+
+            value, expires_at = entry
+
+            if expires_at is not None and expires_at <= time.monotonic():
+                del self._data[key]
+                return default
+
+            self._data.move_to_end(key)
+            return value
+
+    def set(self, key, value, timeout=_MISSING):
+        if timeout is _MISSING:
+            timeout = self.timeout
+
+        expires_at = time.monotonic() + timeout if timeout is not None else None
+
+        with self._lock:
+            self._data[key] = (value, expires_at)
+            self._data.move_to_end(key)
+
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def delete(self, key) -> bool:
+        with self._lock:
+            return self._data.pop(key, _MISSING) is not _MISSING
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
+    def __contains__(self, key):
+        return self.get(key, _MISSING) is not _MISSING
+
+
+class SequenceLog:
+    """
+    Numbered log of entries in the shared cache. Processes append the changes
+    they make to their in-memory indexes, and the others replay them instead
+    of going back to the database.
+    """
+
+    def __init__(self, prefix, timeout, max_replay=1000):
+        self.prefix = prefix
+        self.timeout = timeout
+        # how far behind a reader may fall before it should go back to the
+        # database instead of replaying the log
+        self.max_replay = max_replay
+
+        self.sequence_key = f'{prefix}:sequence'
+
+    def _key(self, sequence) -> str:
+        return f'{self.prefix}:log:{sequence}'
+
+    def current(self) -> int:
+        return cache.get(self.sequence_key, 0)
+
+    def append(self, entry) -> int:
+        cache.add(self.sequence_key, 0, timeout=None)
+        sequence = cache.incr(self.sequence_key)
+        cache.set(self._key(sequence), entry, timeout=self.timeout)
+
+        return sequence
+
+    def read(self, after, upto):
+        """
+        Entries after `after` up to and including `upto`, or None if they
+        can't all be replayed because the cache was flushed, entries expired
+        or the reader is too far behind.
+        """
+        if upto < after or upto - after > self.max_replay:
+            return None
+
+        keys = [self._key(n) for n in range(after + 1, upto + 1)]
+        entries = cache.get_many(keys)
+
+        if len(entries) < len(keys):
+            return None
+
+        return [entries[key] for key in keys]
+
+
+# L1 caches by location, shared by every thread's instance of the backend
+# (Django creates one backend instance per thread)
+_local_caches = {}
+_local_caches_lock = Lock()
+
+
+class TieredCache(BaseCache):
+    """
+    Cache backend with a bounded per-process LRU (L1) in front of another
+    configured cache (L2), which is shared by all processes.
+
+    Reads are answered from L1 when they can be, so an entry can be up to
+    L1_TIMEOUT seconds stale in processes other than the one that changed
+    it. Use it for values that may be that stale, or whose key changes
+    when they do. Atomic operations (add, incr, decr) go to L2.
+
+        'tiered': {
+            'BACKEND': 'core.utils.cache.TieredCache',
+            'LOCATION': 'tiered',
+            'OPTIONS': {'L2': 'default', 'L1_MAX_ENTRIES': 10000, 'L1_TIMEOUT': 60},
+        }
+    """
+
+    # striped locks that keep a process's threads from computing the same
+    # key at the same time, see get_or_compute
+    LOCK_STRIPES = 64
+
+    def __init__(self, location, params):
+        super().__init__(params)
+
+        options = params.get('OPTIONS', {})
+        self.l2_alias = options.get('L2', 'default')
+        self.l1_timeout = options.get('L1_TIMEOUT', 60)
+        self.lock_timeout = options.get('LOCK_TIMEOUT', 10)
+
+        with _local_caches_lock:
+            if location not in _local_caches:
+                _local_caches[location] = (
+                    LRUCache(maxsize=options.get('L1_MAX_ENTRIES', 10000)),
+                    [Lock() for _ in range(self.LOCK_STRIPES)],
+                )
+
+        self.local, self._locks = _local_caches[location]
+
+    @property
+    def l2(self):
+        return caches[self.l2_alias]
+
+    def _l1_timeout(self, timeout):
+        if timeout is None:
+            return self.l1_timeout
+
+        return min(timeout, self.l1_timeout)
+
+    def get(self, key, default=None, version=None):
+        local_key = self.make_and_validate_key(key, version=version)
+        value = self.local.get(local_key, _MISSING)
+
+        if value is not _MISSING:
+            return value
+
+        value = self.l2.get(key, _MISSING, version=version)
+
+        if value is _MISSING:
+            return default
+
+        self.local.set(local_key, value, self.l1_timeout)
+
+        return value
+
+    def set(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        timeout = self.get_backend_timeout(timeout)
+        timeout = None if timeout is None else max(0, timeout - time.time())
+
+        self.l2.set(key, value, timeout, version=version)
+
+        local_key = self.make_and_validate_key(key, version=version)
+
+        if timeout == 0:
+            self.local.delete(local_key)
+        else:
+            self.local.set(local_key, value, self._l1_timeout(timeout))
+
+    def add(self, key, value, timeout=DEFAULT_TIMEOUT, version=None):
+        timeout = self.get_backend_timeout(timeout)
+        timeout = None if timeout is None else max(0, timeout - time.time())
+
+        return self.l2.add(key, value, timeout, version=version)
+
+    def touch(self, key, timeout=DEFAULT_TIMEOUT, version=None):
+        timeout = self.get_backend_timeout(timeout)
+        timeout = None if timeout is None else max(0, timeout - time.time())
+
+        return self.l2.touch(key, timeout, version=version)
+
+    def delete(self, key, version=None):
+        self.local.delete(self.make_and_validate_key(key, version=version))
+        return self.l2.delete(key, version=version)
+
+    def incr(self, key, delta=1, version=None):
+        self.local.delete(self.make_and_validate_key(key, version=version))
+        return self.l2.incr(key, delta, version=version)
+
+    def has_key(self, key, version=None):
+        return self.get(key, _MISSING, version=version) is not _MISSING
+
+    def clear(self):
+        self.local.clear()
+        self.l2.clear()
+
+    def _should_refresh(self, entry, beta) -> bool:
+        """
+        XFetch: recompute ahead of expiry with a probability that grows as
+        expiry nears and with how long computing takes, so one caller
+        refreshes a hot key before it expires instead of all of them after.
+        """
+        _, delta, expires_at = entry
+
+        if expires_at is None:
+            return False
+
+        return time.time() - delta * beta * math.log(random.random() or 1e-12) >= expires_at
+
+    def get_or_compute(self, key, compute, timeout=DEFAULT_TIMEOUT, beta=1.0, version=None):
+        """
+        The cached value of `key`, computed with `compute()` and cached for
+        `timeout` seconds when missing or due for an early refresh.
+
+        Only one thread per process, and while it holds the lock one process
+        overall, computes a given key. Others waiting on a missing key wait
+        for it for up to LOCK_TIMEOUT seconds before computing it themselves;
+        others asking for a key being refreshed get the current value.
+        """
+        entry = self.get(key, version=version)
+
+        if entry is not None and not self._should_refresh(entry, beta):
+            return entry[0]
+
+        local_key = self.make_and_validate_key(key, version=version)
+        stripe = self._locks[hash(local_key) % self.LOCK_STRIPES]
+        lock_key = f'{key}:compute'
+
+        with stripe:
+            entry = self.get(key, version=version)
+
+            # another thread may have just computed it
+            if entry is not None and not self._should_refresh(entry, beta):
+                return entry[0]
+
+            token = uuid.uuid4().hex
+
+            if self.l2.add(lock_key, token, self.lock_timeout, version=version):
+                return self._compute(key, compute, timeout, version, lock_key, token)
+
+            metrics.counter('cache.get_or_compute.waited').inc()
+
+            if entry is not None:
+                return entry[0]
+
+        # waited for without the stripe lock, which other keys share
+        entry = self._wait(key, version)
+
+        if entry is not None:
+            return entry[0]
+
+        with stripe:
+            entry = self.get(key, version=version)
+
+            if entry is not None:
+                return entry[0]
+
+            # the other process's lock is only released by that process
+            if not self.l2.add(lock_key, token, self.lock_timeout, version=version):
+                token = None
+
+            return self._compute(key, compute, timeout, version, lock_key, token)
+
+    def _compute(self, key, compute, timeout, version, lock_key, token):
+        try:
+            start = time.monotonic()
+            value = compute()
+            delta = time.monotonic() - start
+
+            backend_timeout = self.get_backend_timeout(timeout)
+            self.set(key, (value, delta, backend_timeout), timeout, version=version)
+            metrics.counter('cache.get_or_compute.computed').inc()
+        finally:
+            # not if it timed out and another process holds it now
+            if token is not None and self.l2.get(lock_key, version=version) == token:
+                self.l2.delete(lock_key, version=version)
+
+        return value
+
+    def _wait(self, key, version):
+        deadline = time.monotonic() + self.lock_timeout
+
+        while time.monotonic() < deadline:
+            time.sleep(0.05)
+            entry = self.l2.get(key, version=version)
+
+            if entry is not None:
+                return entry
+
+        return None
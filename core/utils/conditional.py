@@ -0,0 +1,108 @@
+import asyncio
+import time
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.core.cache import cache
+from django.db import transaction
+from django.utils.cache import get_conditional_response
+from django.utils.http import quote_etag
+
+from .metrics import metrics
+
+
+class TableVersions:
+    """
+    A change counter per model in the shared cache, for cheap validators:
+    anything derived from a table is unchanged for as long as its counter is.
+
+    Counters are bumped from post_save/post_delete signals once the
+    transaction commits (see users/signals.py), so a reader never sees a new
+    counter with old rows. Bulk writes send no signals and must call `bump`
+    themselves. A missing counter (new or flushed cache) starts from the
+    clock, so it never repeats a value handed out before.
+    """
+
+    def __init__(self, prefix='table_version'):
+        self.prefix = prefix
+
+    def _key(self, model) -> str:
+        return f'{self.prefix}:{model._meta.label_lower}'
+
+    def get(self, model) -> int:
+        key = self._key(model)
+        version = cache.get(key)
+
+        if version is None:
+            cache.add(key, time.time_ns(), timeout=None)
+            version = cache.get(key)
+
+        return version
+
+    def bump(self, model):
+        key = self._key(model)
+
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.add(key, time.time_ns(), timeout=None)
+
+    def bump_on_commit(self, model):
+        transaction.on_commit(lambda: self.bump(model))
+
+
+table_versions = TableVersions()
+
+not_modified = metrics.counter('conditional.not_modified')
+
+
+def _precondition_response(request, etag):
+    response = get_conditional_response(request, etag=etag)
+
+    if response is not None and response.status_code == 304:
+        not_modified.inc()
+        response['ETag'] = etag
+
+    return response
+
+
+def _tag(response, etag):
+    if response.status_code == 200 and not response.has_header('ETag'):
+        response['ETag'] = etag
+
+    return response
+
+
+def conditional(etag_func):
+    """
+    Make a GET handler (sync or async) answer If-None-Match with 304 Not
+    Modified, before the handler runs, when `etag_func(request, *args,
+    **kwargs)` matches. Successful responses carry the ETag.
+
+    etag_func must be cheap: it runs on every request, hit or miss.
+    """
+    def decorator(handler):
+        if asyncio.iscoroutinefunction(handler):
+            @wraps(handler)
+            async def wrapper(self, request, *args, **kwargs):
+                etag = quote_etag(str(await sync_to_async(etag_func)(request, *args, **kwargs)))
+                response = _precondition_response(request, etag)
+
+                if response is None:
+                    response = _tag(await handler(self, request, *args, **kwargs), etag)
+
+                return response
+        else:
+            @wraps(handler)
+            def wrapper(self, request, *args, **kwargs):
+                etag = quote_etag(str(etag_func(request, *args, **kwargs)))
+                response = _precondition_response(request, etag)
+
+                if response is None:
+                    response = _tag(handler(self, request, *args, **kwargs), etag)
+
+                return response
+
+        return wrapper
+
+    return decorator
@@ -0,0 +1,208 @@
+import atexit
+import logging
+import os
+import time
+from collections import deque
+from threading import Condition, Thread
+
+from django.conf import settings
+from django.utils.translation import gettext_lazy as _
+
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# What submit does when the queue is full
+BLOCK = 'block'
+DROP = 'drop'
+REJECT = 'reject'
+
+
+class DispatchUnavailable(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = _('Too many messages are waiting to be sent, please retry shortly.')
+    default_code = 'dispatch_unavailable'
+
+    def __init__(self, detail=None, code=None, wait=None):
+        super().__init__(detail, code)
+
+        # DRF's exception handler turns this into a Retry-After header
+        self.wait = wait or settings.DISPATCH_RETRY_AFTER
+
+
+class Dispatcher:
+    """
+    Runs outbound sends (email, SMS, voice calls) on a fixed pool of
+    `workers` threads, with at most `max_queue` sends waiting.
+
+    Each channel can be limited to fewer concurrent sends than there are
+    workers, so a slow provider can't hold up the others: workers skip over
+    the queued sends of a channel that is at its limit. When the queue is
+    full, `policy` decides whether submit blocks for up to `block_timeout`
+    seconds, drops the send, or raises DispatchUnavailable (a 503).
+
+    With no workers, sends run inline in the calling thread.
+    """
+
+    def __init__(self, workers, max_queue, policy=REJECT, channel_limits=None, block_timeout=5):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.policy = policy
+        self.channel_limits = channel_limits or {}
+        self.block_timeout = block_timeout
+
+        self._queues = {}
+        self._running = {}
+        self._queued = 0
+        self._closed = False
+        self._condition = Condition()
+
+        self._threads = []
+        self._pid = None
+
+        self.dropped = metrics.counter('dispatch.dropped')
+        self.rejected = metrics.counter('dispatch.rejected')
+
+    def _channel(self, channel):
+        if channel not in self._queues:
+            self._queues[channel] = deque()
+            self._running[channel] = 0
+
+        return self._queues[channel]
+
+    def _ensure_workers(self):
+        # threads don't survive a fork, start them in the process that uses them
+        if self._pid == os.getpid():
+            return
+
+        with self._condition:
+            if self._pid == os.getpid():
+                return
+
+            self._threads = [
+                Thread(target=self._work, name=f'dispatch-{n}', daemon=True)
+                for n in range(self.workers)
+            ]
+
+            for thread in self._threads:
+                thread.start()
+
+            self._pid = os.getpid()
+
+    def submit(self, channel, function, *args) -> bool:
+        """
+        Queue `function(*args)` on `channel`. Returns False if the send was
+        dropped because the queue is full.
+        """
+        if not self.workers:
+            self._run(channel, function, args, time.monotonic())
+            return True
+
+        self._ensure_workers()
+
+        with self._condition:
+            if self._closed:
+                raise DispatchUnavailable()
+
+            if self._queued >= self.max_queue:
+                if self.policy == DROP:
+                    self.dropped.inc()
+                    logger.warning('Dropped a %s send, the dispatch queue is full', channel)
+                    return False
+
+                if self.policy == REJECT or not self._condition.wait_for(
+                    lambda: self._queued < self.max_queue,
+                    self.block_timeout,
+                ):
+                    self.rejected.inc()
+                    raise DispatchUnavailable()
+
+            self._channel(channel).append((function, args, time.monotonic()))
+            self._queued += 1
+            self._condition.notify_all()
+
+        return True
+
+    def _next(self):
+        for channel, queue in self._queues.items():
+            if queue and self._running[channel] < self.channel_limits.get(channel, self.workers):
+                return channel, queue.popleft()
+
+        return None
+
+    def _work(self):
+        while True:
+            with self._condition:
+                while (job := self._next()) is None:
+                    if self._closed and not self._queued:
+                        return
+
+                    self._condition.wait()
+
+                channel, (function, args, queued_at) = job
+                self._queued -= 1
+                self._running[channel] += 1
+
+                # wake up submitters waiting for room
+                self._condition.notify_all()
+
+            try:
+                self._run(channel, function, args, queued_at)
+            finally:
+                with self._condition:
+                    self._running[channel] -= 1
+                    self._condition.notify_all()
+
+    def _run(self, channel, function, args, queued_at):
+        start = time.monotonic()
+        metrics.summary(f'dispatch.{channel}.queue_wait_seconds').observe(start - queued_at)
+
+        try:
+            function(*args)
+        except Exception:
+            metrics.counter(f'dispatch.{channel}.failed').inc()
+            logger.exception('A %s send failed', channel)
+        finally:
+            metrics.summary(f'dispatch.{channel}.send_seconds').observe(time.monotonic() - start)
+
+    def shutdown(self, timeout=None):
+        """
+        Stop taking sends and wait up to `timeout` seconds for the queued ones
+        to finish.
+        """
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+
+        deadline = time.monotonic() + (settings.DISPATCH_DRAIN_TIMEOUT if timeout is None else timeout)
+
+        for thread in self._threads:
+            thread.join(max(0.0, deadline - time.monotonic()))
+
+        if self._queued:
+            logger.warning('Shut down with %d sends still queued', self._queued)
+
+    def snapshot(self) -> dict:
+        with self._condition:
+            return {
+                'queue_depth': self._queued,
+                'running': dict(self._running),
+                'queued': {channel: len(queue) for channel, queue in self._queues.items()},
+            }
+
+
+dispatcher = Dispatcher(
+    workers=settings.DISPATCH_WORKERS,
+    max_queue=settings.DISPATCH_MAX_QUEUE,
+    policy=settings.DISPATCH_QUEUE_FULL_POLICY,
+    channel_limits=settings.DISPATCH_CHANNEL_LIMITS,
+    block_timeout=settings.DISPATCH_BLOCK_TIMEOUT,
+)
+
+metrics.register('dispatch', dispatcher.snapshot)
+
+# finish queued sends when the server stops a worker process gracefully
+atexit.register(dispatcher.shutdown)
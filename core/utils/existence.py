@@ -0,0 +1,201 @@
+import time
+from threading import Lock
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db.models import Max
+
+from .bloom import BloomFilter
+from .cache import SequenceLog
+from .metrics import metrics
+from .users import normalize_email_lookup, normalize_phone_lookup
+
+
+def _keys(email_normalized, phone_normalized) -> list:
+    keys = []
+
+    if email_normalized:
+        keys.append(f'email:{email_normalized}')
+    if phone_normalized:
+        keys.append(f'phone:{phone_normalized}')
+
+    return keys
+
+
+class ExistenceIndex:
+    """
+    In-memory index of the normalized emails and phones of all users.
+
+    `email_exists` and `phone_exists` answer "definitely not registered"
+    from a Bloom filter and only ask the database about probable hits, so
+    checking an unused email or phone costs no queries.
+
+    The filter is loaded from the users table on first use and kept current
+    the same way as the revocation index (see core/utils/revocation.py):
+    users saved in any process are logged to the shared cache, new rows are
+    picked up by id every EXISTENCE_INDEX_SYNC_INTERVAL seconds, and the
+    filter is rebuilt every EXISTENCE_INDEX_REBUILD_INTERVAL seconds, which
+    also drops deleted users. Unlike revocations, changes to existing rows
+    can't be found by id, so a gap in the log triggers a rebuild.
+    """
+
+    def __init__(self, error_rate=0.001, min_capacity=10000):
+        self.error_rate = error_rate
+        self.min_capacity = min_capacity
+
+        self.bloom = None
+        self.last_id = 0
+        self.sequence = 0
+        self.synced_at = 0
+        self.built_at = 0
+
+        self.log = SequenceLog('existence', timeout=settings.EXISTENCE_INDEX_REBUILD_INTERVAL)
+        self._lock = Lock()
+
+        self.rebuild_time = metrics.summary('existence_index.rebuild_seconds')
+        self.index_answers = metrics.counter('existence_index.answered_from_index')
+        self.database_checks = metrics.counter('existence_index.database_checks')
+
+    def build(self):
+        start = time.perf_counter()
+        User = get_user_model()
+
+        # read the sequence first, anything logged after it gets replayed
+        sequence = self.log.current()
+        last_id = User.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+
+        rows = User.objects.filter(id__lte=last_id).values_list('email_normalized', 'phone_normalized')
+
+        # up to two keys per user, with room to grow until the next rebuild
+        bloom = BloomFilter(max(rows.count() * 4, self.min_capacity), self.error_rate)
+
+        for email_normalized, phone_normalized in rows.iterator(chunk_size=10000):
+            bloom.update(_keys(email_normalized, phone_normalized))
+
+        with self._lock:
+            self.bloom = bloom
+            self.last_id = last_id
+            self.sequence = sequence
+            self.synced_at = self.built_at = time.monotonic()
+
+        self.rebuild_time.observe(time.perf_counter() - start)
+
+    def sync(self):
+        """
+        Add users created since the last build or sync.
+        """
+        sequence = self.log.current()
+
+        rows = get_user_model().objects.filter(
+            id__gt=self.last_id,
+        ).order_by('id').values_list('id', 'email_normalized', 'phone_normalized')
+
+        with self._lock:
+            for id, email_normalized, phone_normalized in rows:
+                self.bloom.update(_keys(email_normalized, phone_normalized))
+                self.last_id = id
+
+            self.sequence = max(self.sequence, sequence)
+            self.synced_at = time.monotonic()
+
+    def replay(self):
+        """
+        Add users other processes logged to the shared cache.
+        """
+        sequence = self.log.current()
+
+        if sequence == self.sequence:
+            return
+
+        entries = self.log.read(self.sequence, sequence)
+
+        if entries is None:
+            return self.build()
+
+        with self._lock:
+            for keys in entries:
+                self.bloom.update(keys)
+
+            self.sequence = max(self.sequence, sequence)
+
+    def ensure_fresh(self):
+        now = time.monotonic()
+
+        if (
+            self.bloom is None
+            or self.bloom.is_saturated
+            or now - self.built_at >= settings.EXISTENCE_INDEX_REBUILD_INTERVAL
+        ):
+            self.build()
+        elif now - self.synced_at >= settings.EXISTENCE_INDEX_SYNC_INTERVAL:
+            self.sync()
+        else:
+            self.replay()
+
+    def add(self, email_normalized, phone_normalized):
+        """
+        Record a user's email and phone in this process and log them for the
+        others.
+        """
+        self.add_many([(email_normalized, phone_normalized)])
+
+    def add_many(self, identities):
+        """
+        `add` for many (email_normalized, phone_normalized) pairs at once,
+        logged as a single entry, e.g. for users created with bulk_create.
+        """
+        keys = [key for email_normalized, phone_normalized in identities for key in _keys(email_normalized, phone_normalized)]
+
+        if not keys:
+            return
+
+        sequence = self.log.append(keys)
+
+        if self.bloom is not None:
+            with self._lock:
+                self.bloom.update(keys)
+
+                # no need to replay our own entry
+                if sequence == self.sequence + 1:
+                    self.sequence = sequence
+
+    def _exists(self, key, **lookup) -> bool:
+        self.ensure_fresh()
+
+        if key not in self.bloom:
+            self.index_answers.inc()
+            return False
+
+        self.database_checks.inc()
+
+        return get_user_model().objects.filter(**lookup).exists()
+
+    def email_exists(self, email) -> bool:
+        email_normalized = normalize_email_lookup(email)
+
+        if not email_normalized:
+            return False
+
+        return self._exists(f'email:{email_normalized}', email_normalized=email_normalized)
+
+    def phone_exists(self, phone) -> bool:
+        phone_normalized = normalize_phone_lookup(phone)
+
+        if not phone_normalized:
+            return False
+
+        return self._exists(f'phone:{phone_normalized}', phone_normalized=phone_normalized)
+
+    def snapshot(self) -> dict:
+        bloom = self.bloom
+
+        return {
+            'items': len(bloom) if bloom else 0,
+            'size_bytes': bloom.size_bytes if bloom else 0,
+            'false_positive_rate': bloom.false_positive_rate if bloom else 0.0,
+        }
+
+
+existence_index = ExistenceIndex()
+
+metrics.register('existence_index', existence_index.snapshot)
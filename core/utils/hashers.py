@@ -0,0 +1,17 @@
+from django.conf import settings
+from django.contrib.auth.hashers import Argon2PasswordHasher
+
+
+class TunedArgon2PasswordHasher(Argon2PasswordHasher):
+    """
+    Argon2 with the cost parameters from PASSWORD_ARGON2_PROFILE, as
+    proposed by `python manage.py calibrate_hashers`.
+
+    It keeps the "argon2" algorithm name, so hashes made by Django's stock
+    Argon2 hasher still verify. Hashes with different parameters are
+    reported by `must_update` and rehashed after the next successful login.
+    """
+
+    time_cost = settings.PASSWORD_ARGON2_PROFILE['TIME_COST']
+    memory_cost = settings.PASSWORD_ARGON2_PROFILE['MEMORY_COST']
+    parallelism = settings.PASSWORD_ARGON2_PROFILE['PARALLELISM']
@@ -11,6 +11,8 @@ from rest_framework.status import (
 
 from uuid import UUID
 
+from .renderers import Envelope
+
 response_types = TypedDict(
     'response_types',
    {
@@ -56,20 +58,20 @@ http_status_codes = {
 }
 
 def generate_error_response(info: response_types) -> Response:
-    return Response({
-        "data": info.get('data'),
-        "status": info.get('status'),
-        "errors": info.get('errors'),
-        "message": info.get('message'),
-    }, status=http_status_codes.get(info.get('status')) or HTTP_500_INTERNAL_SERVER_ERROR)
+    return Response(Envelope(
+        data=info.get('data'),
+        status=info.get('status'),
+        errors=info.get('errors'),
+        message=info.get('message'),
+    ), status=http_status_codes.get(info.get('status')) or HTTP_500_INTERNAL_SERVER_ERROR)
 
 def generate_success_response(info: response_types) -> Response:
-    return Response({
-        "data": info.get('data'),
-        "message": info.get('message'),
-        "errors": [],
-        "status": info.get('status') or 200,
-    }, status=HTTP_200_OK)
+    return Response(Envelope(
+        data=info.get('data'),
+        status=info.get('status') or 200,
+        errors=[],
+        message=info.get('message'),
+    ), status=HTTP_200_OK)
 
 def validate_uuid4(uuid_string) -> bool:
     try:
@@ -0,0 +1,169 @@
+import asyncio
+import hashlib
+import json
+from functools import partial, wraps
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.crypto import salted_hmac
+from django.utils.translation import gettext_lazy as _
+from rest_framework import status
+from rest_framework.exceptions import APIException, ValidationError
+from rest_framework.response import Response
+
+from .metrics import metrics
+
+# Header telling clients a response is a stored one
+REPLAYED_HEADER = 'Idempotent-Replayed'
+
+MAX_KEY_LENGTH = 255
+
+
+class IdempotencyKeyInUse(APIException):
+    status_code = status.HTTP_409_CONFLICT
+    default_detail = _('A request with this Idempotency-Key is still in progress.')
+    default_code = 'idempotency_key_in_use'
+
+
+class IdempotencyKeyReused(APIException):
+    status_code = status.HTTP_422_UNPROCESSABLE_ENTITY
+    default_detail = _('This Idempotency-Key was already used for a different request.')
+    default_code = 'idempotency_key_reused'
+
+
+class IdempotencyStore:
+    """
+    First responses to requests that carried an Idempotency-Key header, so a
+    retry of the same request gets the same response without the work (and
+    side effects) being done twice.
+
+    Keys are scoped to the route and the user, and remembered for `timeout`
+    seconds. A key sent with a different body, or again while the first
+    request is still running, is refused. Server errors aren't stored, so
+    the client can retry them.
+    """
+
+    def __init__(self, alias, timeout, lock_timeout, header, prefix='idempotency'):
+        self.alias = alias
+        self.timeout = timeout
+        self.lock_timeout = lock_timeout
+        self.header = header
+        self.prefix = prefix
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def request_key(self, request):
+        key = request.headers.get(self.header)
+
+        if not key:
+            return None
+
+        if len(key) > MAX_KEY_LENGTH:
+            raise ValidationError({self.header: _('Must be at most %d characters.') % MAX_KEY_LENGTH})
+
+        user = request.user.pk if request.user and request.user.is_authenticated else 'anonymous'
+        digest = hashlib.sha256(f'{request.method}:{request.path}:{user}:{key}'.encode()).hexdigest()
+
+        return f'{self.prefix}:{digest}'
+
+    def fingerprint(self, request) -> str:
+        # keyed, as bodies may hold passwords or codes
+        body = json.dumps(request.data, sort_keys=True, default=str)
+        return salted_hmac(f'{self.prefix}.fingerprint', body, algorithm='sha256').hexdigest()
+
+    def _replay(self, stored, fingerprint):
+        if stored['fingerprint'] != fingerprint:
+            raise IdempotencyKeyReused()
+
+        metrics.counter('idempotency.replayed').inc()
+        return Response(stored['data'], status=stored['status'], headers={REPLAYED_HEADER: 'true'})
+
+    def _stored(self, response, fingerprint):
+        if response.status_code >= 500:
+            return None
+
+        return {'fingerprint': fingerprint, 'status': response.status_code, 'data': response.data}
+
+    def run(self, request, handler, *args, **kwargs):
+        key = self.request_key(request)
+
+        if key is None:
+            return handler(request, *args, **kwargs)
+
+        fingerprint = self.fingerprint(request)
+        stored = self.cache.get(key)
+
+        if stored is not None:
+            return self._replay(stored, fingerprint)
+
+        if not self.cache.add(f'{key}:lock', True, self.lock_timeout):
+            metrics.counter('idempotency.in_use').inc()
+            raise IdempotencyKeyInUse()
+
+        try:
+            response = handler(request, *args, **kwargs)
+            stored = self._stored(response, fingerprint)
+
+            if stored is not None:
+                self.cache.set(key, stored, self.timeout)
+        finally:
+            self.cache.delete(f'{key}:lock')
+
+        return response
+
+    async def arun(self, request, handler, *args, **kwargs):
+        key = self.request_key(request)
+
+        if key is None:
+            return await handler(request, *args, **kwargs)
+
+        fingerprint = self.fingerprint(request)
+        stored = await self.cache.aget(key)
+
+        if stored is not None:
+            return self._replay(stored, fingerprint)
+
+        if not await self.cache.aadd(f'{key}:lock', True, self.lock_timeout):
+            metrics.counter('idempotency.in_use').inc()
+            raise IdempotencyKeyInUse()
+
+        try:
+            response = await handler(request, *args, **kwargs)
+            stored = self._stored(response, fingerprint)
+
+            if stored is not None:
+                await self.cache.aset(key, stored, self.timeout)
+        finally:
+            await self.cache.adelete(f'{key}:lock')
+
+        return response
+
+
+idempotency_store = IdempotencyStore(
+    alias=settings.IDEMPOTENCY_CACHE,
+    timeout=settings.IDEMPOTENCY_TIMEOUT,
+    lock_timeout=settings.IDEMPOTENCY_LOCK_TIMEOUT,
+    header=settings.IDEMPOTENCY_HEADER,
+)
+
+
+def idempotent(handler):
+    """
+    Make a view handler (sync or async) honour the Idempotency-Key header.
+
+    Not for handlers that issue tokens or other credentials: those would sit
+    in the shared cache and be replayed long after they expired or were
+    rotated.
+    """
+    if asyncio.iscoroutinefunction(handler):
+        @wraps(handler)
+        async def wrapper(self, request, *args, **kwargs):
+            return await idempotency_store.arun(request, partial(handler, self), *args, **kwargs)
+    else:
+        @wraps(handler)
+        def wrapper(self, request, *args, **kwargs):
+            return idempotency_store.run(request, partial(handler, self), *args, **kwargs)
+
+    return wrapper
@@ -0,0 +1,168 @@
+"""
+Local verification of access tokens for services other than this one.
+
+Only depends on PyJWT (with cryptography) and the standard library, so it
+can be copied into downstream services as is:
+
+    verifier = JWKSVerifier('https://auth.example.com/users/.well-known/jwks.json')
+    payload = verifier.verify(token)
+
+Public keys are fetched from the JWKS endpoint once, parsed, and kept in
+memory until `cache_timeout` passes. A token carrying an unknown kid (i.e.
+after a key rotation) triggers at most one refetch per
+`min_refresh_interval`, so garbage tokens cannot be used to hammer the
+auth service. While the JWKS endpoint can't be reached the keys fetched
+last keep being used, and it is tried again every `min_refresh_interval`.
+"""
+import json
+import time
+import urllib.request
+from threading import Lock
+
+import jwt
+
+# algorithm to assume for keys published without an "alg" member
+_default_algorithms = {
+    'RSA': 'RS256',
+    'EC': 'ES256',
+    'OKP': 'EdDSA',
+}
+
+
+class JWKSVerifier:
+    def __init__(
+        self,
+        jwks_url=None,
+        jwks=None,
+        audience=None,
+        issuer=None,
+        leeway=0,
+        cache_timeout=300,
+        min_refresh_interval=30,
+        request_timeout=5,
+    ):
+        if jwks_url is None and jwks is None:
+            raise ValueError('Either jwks_url or jwks is required.')
+
+        self.jwks_url = jwks_url
+        self.audience = audience
+        self.issuer = issuer
+        self.leeway = leeway
+        self.cache_timeout = cache_timeout
+        self.min_refresh_interval = min_refresh_interval
+        self.request_timeout = request_timeout
+
+        self._keys = {}
+        self._fetched_at = None
+        self._failed_at = None
+        self._lock = Lock()
+
+        if jwks is not None:
+            self._load(jwks)
+
+            # a static key set never expires
+            if jwks_url is None:
+                self.cache_timeout = None
+
+    def _load(self, jwks):
+        keys = {}
+
+        for data in jwks.get('keys', []):
+            if data.get('use', 'sig') != 'sig' or 'kid' not in data:
+                continue
+
+            algorithm = data.get('alg') or _default_algorithms.get(data.get('kty'))
+
+            try:
+                keys[data['kid']] = (jwt.PyJWK(data, algorithm).key, algorithm)
+            except jwt.PyJWTError:
+                continue
+
+        self._keys = keys
+        self._fetched_at = time.monotonic()
+
+    def _fetch(self):
+        request = urllib.request.Request(self.jwks_url, headers={'Accept': 'application/json'})
+
+        with urllib.request.urlopen(request, timeout=self.request_timeout) as response:
+            jwks = json.load(response)
+
+        if not isinstance(jwks, dict):
+            raise ValueError('The JWKS endpoint did not return a key set.')
+
+        return jwks
+
+    def _is_stale(self) -> bool:
+        return (
+            self.cache_timeout is not None
+            and time.monotonic() - self._fetched_at >= self.cache_timeout
+        )
+
+    def refresh(self, force=False):
+        """
+        Refetch the key set, at most once per `min_refresh_interval`, or with
+        `force` whenever it is stale.
+        """
+        if self.jwks_url is None:
+            return
+
+        with self._lock:
+            now = time.monotonic()
+
+            if force:
+                # another thread may have refetched it while this one waited
+                if self._fetched_at is not None and not self._is_stale():
+                    return
+            elif self._fetched_at is not None and now - self._fetched_at < self.min_refresh_interval:
+                return
+
+            if self._failed_at is not None and now - self._failed_at < self.min_refresh_interval:
+                return
+
+            try:
+                jwks = self._fetch()
+            except (OSError, ValueError):
+                # URLError, timeouts and bad JSON: keep the keys we have
+                self._failed_at = now
+                return
+
+            self._failed_at = None
+            self._load(jwks)
+
+    def get_key(self, kid):
+        """
+        Returns a `(parsed public key, algorithm)` pair, or None.
+        """
+        if self._fetched_at is None or self._is_stale():
+            self.refresh(force=True)
+
+        key = self._keys.get(kid)
+
+        if key is None:
+            # the key set may have been rotated since we last looked
+            self.refresh()
+            key = self._keys.get(kid)
+
+        return key
+
+    def verify(self, token) -> dict:
+        """
+        Returns the token payload, or raises `jwt.InvalidTokenError`.
+        """
+        kid = jwt.get_unverified_header(token).get('kid')
+        entry = self.get_key(kid) if kid is not None else None
+
+        if entry is None:
+            raise jwt.InvalidTokenError(f'No verifying key for kid {kid!r}')
+
+        key, algorithm = entry
+
+        return jwt.decode(
+            token,
+            key,
+            algorithms=[algorithm],
+            audience=self.audience,
+            issuer=self.issuer,
+            leeway=self.leeway,
+            options={'verify_aud': self.audience is not None},
+        )
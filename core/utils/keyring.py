@@ -0,0 +1,112 @@
+import json
+from hashlib import sha256
+
+from django.conf import settings
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+from jwt.algorithms import ECAlgorithm, OKPAlgorithm, RSAAlgorithm
+
+
+def _algorithm_for(public_key) -> str:
+    if isinstance(public_key, rsa.RSAPublicKey):
+        return 'RS256'
+
+    if isinstance(public_key, ed25519.Ed25519PublicKey):
+        return 'EdDSA'
+
+    if isinstance(public_key, ec.EllipticCurvePublicKey) and public_key.curve.name == 'secp256r1':
+        return 'ES256'
+
+    raise ValueError(f'Unsupported signing key type: {type(public_key).__name__}')
+
+
+_jwk_exporters = {
+    'RS256': RSAAlgorithm,
+    'ES256': ECAlgorithm,
+    'EdDSA': OKPAlgorithm,
+}
+
+
+class SigningKey:
+    """
+    An asymmetric key identified by its `kid`. Keys loaded from a public PEM
+    can only verify; keys loaded from a private PEM can also sign.
+    """
+
+    def __init__(self, kid, private_key=None, public_key=None):
+        if private_key is None and public_key is None:
+            raise ValueError('A signing key needs a private or a public key.')
+
+        self.kid = kid
+        self.private_key = private_key
+        self.public_key = public_key or private_key.public_key()
+        self.algorithm = _algorithm_for(self.public_key)
+
+    @classmethod
+    def from_pem(cls, kid, pem: bytes):
+        if b'PRIVATE KEY' in pem:
+            return cls(kid, private_key=serialization.load_pem_private_key(pem, password=None))
+
+        return cls(kid, public_key=serialization.load_pem_public_key(pem))
+
+    @property
+    def can_sign(self) -> bool:
+        return self.private_key is not None
+
+    def jwk(self) -> dict:
+        jwk = _jwk_exporters[self.algorithm].to_jwk(self.public_key, as_dict=True)
+        jwk.update({
+            'kid': self.kid,
+            'alg': self.algorithm,
+            'use': 'sig',
+        })
+        return jwk
+
+
+class KeyRing:
+    """
+    The set of keys tokens may be signed with. The first key that holds a
+    private key signs new tokens; every key verifies tokens carrying its kid.
+
+    To rotate, put the new key first and keep the old one in the ring until
+    the last token it signed has expired (REFRESH_TOKEN_LIFETIME).
+    """
+
+    def __init__(self, keys=()):
+        self.keys = {key.kid: key for key in keys}
+        self.active = next((key for key in keys if key.can_sign), None)
+        self._jwks = None
+
+    @classmethod
+    def from_settings(cls):
+        # JWT_SIGNING_KEYS entries look like "<kid>=<path to pem>"
+        keys = []
+
+        for entry in settings.JWT_SIGNING_KEYS:
+            kid, _, path = entry.partition('=')
+
+            with open(path, 'rb') as pem:
+                keys.append(SigningKey.from_pem(kid.strip(), pem.read()))
+
+        return cls(keys)
+
+    def get(self, kid):
+        return self.keys.get(kid)
+
+    def __bool__(self):
+        return bool(self.keys)
+
+    def jwks(self) -> bytes:
+        """
+        The serialized JSON Web Key Set for every key in the ring.
+        """
+        if self._jwks is None:
+            self._jwks = json.dumps({
+                'keys': [key.jwk() for key in self.keys.values()],
+            }).encode()
+
+        return self._jwks
+
+    def jwks_etag(self) -> str:
+        return '"%s"' % sha256(self.jwks()).hexdigest()[:32]
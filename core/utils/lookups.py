@@ -0,0 +1,151 @@
+import time
+from concurrent.futures import Future
+from datetime import timedelta
+from threading import Lock
+
+from django.apps import apps
+from django.conf import settings
+from django.core.cache import cache
+from django.utils import timezone
+
+from .cache import LRUCache
+from .metrics import metrics
+from .twilio_gateway import gateway
+from .users import normalize_phone_lookup
+
+
+class PhoneLookupCache:
+    """
+    Twilio Lookup results, kept in a per-process LRU, the shared cache and
+    optionally a database table, so the verify step after a send, and
+    repeated sends, don't go back to Twilio.
+
+    Valid and invalid numbers are kept for `valid_timeout` and
+    `invalid_timeout` seconds. Threads looking up the same number at the same
+    time share one trip through the tiers and to Twilio.
+    """
+
+    def __init__(self, valid_timeout, invalid_timeout, maxsize=10_000, model=None, prefix='phone_lookup'):
+        self.valid_timeout = valid_timeout
+        self.invalid_timeout = invalid_timeout
+        self.model = model
+        self.prefix = prefix
+
+        self.local = LRUCache(maxsize=maxsize)
+        self._in_flight = {}
+        self._lock = Lock()
+
+        self.lookup_time = metrics.summary('phone_lookup.twilio_seconds')
+
+    def _cache_key(self, phone) -> str:
+        return f'{self.prefix}:{phone}'
+
+    def _timeout(self, result) -> int:
+        return self.valid_timeout if result[0] else self.invalid_timeout
+
+    def get_model(self):
+        return apps.get_model(self.model) if self.model else None
+
+    def lookup(self, phone) -> (bool, str):
+        """
+        Returns (valid, phone_number) like `phone_number_is_valid`.
+        """
+        key = normalize_phone_lookup(phone)
+        result = self.local.get(key)
+
+        if result is not None:
+            metrics.counter('phone_lookup.hits.local').inc()
+            return result
+
+        with self._lock:
+            future = self._in_flight.get(key)
+            leader = future is None
+
+            if leader:
+                future = self._in_flight[key] = Future()
+
+        if not leader:
+            metrics.counter('phone_lookup.coalesced').inc()
+            return future.result()
+
+        try:
+            result = self._fetch(key)
+        except BaseException as exc:
+            future.set_exception(exc)
+            raise
+        else:
+            future.set_result(result)
+        finally:
+            with self._lock:
+                del self._in_flight[key]
+
+        return result
+
+    def _fetch(self, key) -> (bool, str):
+        result = cache.get(self._cache_key(key))
+
+        if result is not None:
+            result = tuple(result)
+            metrics.counter('phone_lookup.hits.shared').inc()
+            self.local.set(key, result, self._timeout(result))
+            return result
+
+        model = self.get_model()
+
+        if model is not None:
+            row = model.objects.filter(phone=key, expires_at__gt=timezone.now()).first()
+
+            if row is not None:
+                result = (row.valid, row.phone_number)
+                metrics.counter('phone_lookup.hits.database').inc()
+                remaining = max(1, int((row.expires_at - timezone.now()).total_seconds()))
+
+                self.local.set(key, result, remaining)
+                cache.set(self._cache_key(key), result, remaining)
+
+                return result
+
+        metrics.counter('phone_lookup.misses').inc()
+        start = time.monotonic()
+        look_up = gateway.lookup(key)
+        self.lookup_time.observe(time.monotonic() - start)
+
+        result = (bool(look_up.valid), look_up.phone_number)
+        self.set(key, result)
+
+        return result
+
+    def set(self, phone, result):
+        key = normalize_phone_lookup(phone)
+        timeout = self._timeout(result)
+
+        self.local.set(key, result, timeout)
+        cache.set(self._cache_key(key), result, timeout)
+
+        model = self.get_model()
+
+        if model is not None:
+            model.objects.update_or_create(phone=key, defaults={
+                'valid': result[0],
+                'phone_number': result[1],
+                'expires_at': timezone.now() + timedelta(seconds=timeout),
+            })
+
+    def forget(self, phone):
+        key = normalize_phone_lookup(phone)
+
+        self.local.delete(key)
+        cache.delete(self._cache_key(key))
+
+        model = self.get_model()
+
+        if model is not None:
+            model.objects.filter(phone=key).delete()
+
+
+phone_lookups = PhoneLookupCache(
+    valid_timeout=settings.PHONE_LOOKUP_VALID_TIMEOUT,
+    invalid_timeout=settings.PHONE_LOOKUP_INVALID_TIMEOUT,
+    maxsize=settings.PHONE_LOOKUP_LOCAL_SIZE,
+    model=settings.PHONE_LOOKUP_MODEL,
+)
@@ -0,0 +1,240 @@
+import logging
+import os
+import smtplib
+import time
+from contextlib import contextmanager
+from threading import BoundedSemaphore, Lock
+
+from django.conf import settings
+from django.core.mail import get_connection
+from django.core.mail.backends.base import BaseEmailBackend
+
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Errors after which a connection is thrown away and the send retried once
+# on a fresh one.
+CONNECTION_ERRORS = (smtplib.SMTPServerDisconnected, smtplib.SMTPConnectError, OSError)
+
+# Errors about the message itself, which smtplib raises after resetting the
+# session. They are not retried, and the connection stays in the pool. All
+# SMTP errors are OSErrors, so these are checked first.
+MESSAGE_ERRORS = (smtplib.SMTPRecipientsRefused, smtplib.SMTPSenderRefused, smtplib.SMTPDataError)
+
+
+class PooledConnection:
+    def __init__(self, backend):
+        self.backend = backend
+        self.sent = 0
+        self.last_used = time.monotonic()
+
+    def open(self):
+        if self.backend.open():
+            metrics.counter('mail.connections_opened').inc()
+
+    def close(self):
+        try:
+            self.backend.close()
+        except Exception:
+            pass
+
+    def is_healthy(self) -> bool:
+        try:
+            return self.backend.connection.noop()[0] == 250
+        except CONNECTION_ERRORS + (smtplib.SMTPException,):
+            return False
+
+
+class SMTPConnectionPool:
+    """
+    Up to `size` long-lived connections to the mail server, shared by all
+    threads of a process, so sends don't pay for a TCP and TLS handshake
+    and a login each time.
+
+    A connection idle for more than `max_idle` seconds is checked with a
+    NOOP before it is reused, and one that has sent `max_messages` messages
+    is replaced, since providers cap messages per session.
+    """
+
+    def __init__(self, size, max_idle, max_messages, backend, timeout=None):
+        self.size = size
+        self.max_idle = max_idle
+        self.max_messages = max_messages
+        self.backend = backend
+        self.timeout = timeout
+
+        self._idle = []
+        self._lock = Lock()
+        self._slots = BoundedSemaphore(size)
+        self._pid = os.getpid()
+
+        self.in_use = metrics.gauge('mail.connections_in_use')
+        self.reconnects = metrics.counter('mail.reconnects')
+        self.send_time = metrics.summary('mail.send_seconds')
+
+    def _new_connection(self) -> PooledConnection:
+        return PooledConnection(get_connection(self.backend, timeout=self.timeout))
+
+    def _check_fork(self):
+        # connections must not be shared with a forked child
+        if self._pid != os.getpid():
+            with self._lock:
+                self._idle = []
+                self._pid = os.getpid()
+
+    def acquire(self) -> PooledConnection:
+        self._check_fork()
+
+        if not self._slots.acquire(timeout=self.timeout):
+            raise smtplib.SMTPException('No mail server connection became available')
+
+        self.in_use.inc()
+
+        with self._lock:
+            connection = self._idle.pop() if self._idle else None
+
+        if connection and time.monotonic() - connection.last_used > self.max_idle and not connection.is_healthy():
+            connection.close()
+            connection = None
+
+        connection = connection or self._new_connection()
+
+        try:
+            connection.open()
+        except BaseException:
+            self._release_slot()
+            raise
+
+        return connection
+
+    def release(self, connection, broken=False):
+        connection.last_used = time.monotonic()
+
+        if broken or connection.sent >= self.max_messages:
+            connection.close()
+        else:
+            with self._lock:
+                self._idle.append(connection)
+
+        self._release_slot()
+
+    def _release_slot(self):
+        self.in_use.dec()
+        self._slots.release()
+
+    @contextmanager
+    def connection(self):
+        connection = self.acquire()
+
+        try:
+            yield connection
+        except MESSAGE_ERRORS:
+            self.release(connection)
+            raise
+        except BaseException:
+            self.release(connection, broken=True)
+            raise
+        else:
+            self.release(connection)
+
+    def send(self, connection, email_messages) -> int:
+        """
+        Send messages one after another over `connection`, reconnecting once
+        if the server drops it.
+        """
+        sent = 0
+
+        for message in email_messages:
+            if connection.sent >= self.max_messages:
+                connection.close()
+                connection.sent = 0
+                connection.open()
+
+            start = time.monotonic()
+
+            try:
+                ok = connection.backend._send(message)
+            except MESSAGE_ERRORS:
+                raise
+            except CONNECTION_ERRORS:
+                self.reconnects.inc()
+                connection.close()
+                connection.open()
+
+                ok = connection.backend._send(message)
+
+            connection.sent += 1
+            sent += bool(ok)
+            self.send_time.observe(time.monotonic() - start)
+
+        return sent
+
+    def send_messages(self, email_messages) -> int:
+        with self.connection() as connection:
+            return self.send(connection, email_messages)
+
+    def close(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+
+        for connection in idle:
+            connection.close()
+
+
+pool = SMTPConnectionPool(
+    size=settings.EMAIL_POOL_SIZE,
+    max_idle=settings.EMAIL_POOL_MAX_IDLE,
+    max_messages=settings.EMAIL_POOL_MAX_MESSAGES,
+    backend=settings.EMAIL_POOL_BACKEND,
+    timeout=settings.EMAIL_TIMEOUT,
+)
+
+
+class PooledEmailBackend(BaseEmailBackend):
+    """
+    Email backend that sends over the process-wide SMTP connection pool.
+
+    Between `open` and `close` the backend holds on to one pooled
+    connection, so a batch sent with `with get_connection() as connection:`
+    goes out over a single session. Otherwise every `send_messages` call
+    borrows a connection for as long as it takes.
+    """
+
+    def __init__(self, fail_silently=False, **kwargs):
+        super().__init__(fail_silently=fail_silently)
+        self.connection = None
+
+    def open(self):
+        if self.connection is None:
+            self.connection = pool.acquire()
+            return True
+
+        return False
+
+    def close(self):
+        if self.connection is not None:
+            connection, self.connection = self.connection, None
+            pool.release(connection)
+
+    def send_messages(self, email_messages):
+        if not email_messages:
+            return 0
+
+        try:
+            if self.connection is None:
+                return pool.send_messages(email_messages)
+
+            try:
+                return pool.send(self.connection, email_messages)
+            except MESSAGE_ERRORS:
+                raise
+            except BaseException:
+                connection, self.connection = self.connection, None
+                pool.release(connection, broken=True)
+                raise
+        except Exception:
+            if not self.fail_silently:
+                raise
+
+            return 0
@@ -0,0 +1,118 @@
+from collections import deque
+from threading import Lock
+
+
+class Counter:
+    def __init__(self):
+        self.value = 0
+        self._lock = Lock()
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def snapshot(self):
+        return self.value
+
+
+class Gauge:
+    def __init__(self):
+        self.value = 0
+        self._lock = Lock()
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+    def snapshot(self):
+        return self.value
+
+
+class Summary:
+    """
+    Count, sum and max of all observations, plus percentiles over the most
+    recent `window` of them.
+    """
+
+    def __init__(self, window=1024):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self._recent = deque(maxlen=window)
+        self._lock = Lock()
+
+    def observe(self, value):
+        with self._lock:
+            self.count += 1
+            self.total += value
+            self.max = max(self.max, value)
+            self._recent.append(value)
+
+    def percentile(self, percent):
+        with self._lock:
+            recent = sorted(self._recent)
+
+        if not recent:
+            return 0.0
+
+        return recent[min(len(recent) - 1, int(len(recent) * percent / 100))]
+
+    def snapshot(self):
+        return {
+            'count': self.count,
+            'sum': self.total,
+            'max': self.max,
+            'p50': self.percentile(50),
+            'p95': self.percentile(95),
+            'p99': self.percentile(99),
+        }
+
+
+class MetricsRegistry:
+    """
+    Per-process registry of named metrics, exposed through MetricsView.
+    """
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = Lock()
+
+    def _get(self, name, metric_class):
+        metric = self._metrics.get(name)
+
+        if metric is None:
+            with self._lock:
+                metric = self._metrics.setdefault(name, metric_class())
+
+        return metric
+
+    def counter(self, name) -> Counter:
+        return self._get(name, Counter)
+
+    def gauge(self, name) -> Gauge:
+        return self._get(name, Gauge)
+
+    def summary(self, name) -> Summary:
+        return self._get(name, Summary)
+
+    def register(self, name, function):
+        """
+        Register a callable that is evaluated when a snapshot is taken.
+        """
+        with self._lock:
+            self._metrics[name] = function
+
+    def snapshot(self) -> dict:
+        return {
+            name: metric() if callable(metric) else metric.snapshot()
+            for name, metric in sorted(self._metrics.items())
+        }
+
+
+metrics = MetricsRegistry()
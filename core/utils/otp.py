@@ -0,0 +1,153 @@
+import time
+from threading import Lock
+
+from asgiref.sync import sync_to_async
+
+from django.conf import settings
+from django.core.cache import caches
+from django.utils.crypto import constant_time_compare
+from django.utils.module_loading import import_string
+
+# Outcomes of BaseOTPStore.verify
+VALID = 'valid'
+INVALID = 'invalid'
+ATTEMPTS_EXCEEDED = 'attempts_exceeded'
+
+
+class BaseOTPStore:
+    """
+    Storage for one-time passcodes, keyed by phone number.
+
+    Each phone has at most one live code. Every verification attempt counts
+    towards `max_attempts`, whether it matches or not; the code is discarded
+    once it has been used or the attempts run out.
+    """
+
+    def __init__(self, timeout=None, max_attempts=None):
+        self.timeout = timeout or settings.SMS_CODE_EXPIRY.total_seconds()
+        self.max_attempts = int(max_attempts or settings.SMS_CODE_MAXIMUM_ATTEMPTS)
+
+    def issue(self, phone, code):
+        """
+        Store `code` for `phone`, replacing any previous code.
+        """
+        raise NotImplementedError
+
+    def verify(self, phone, code) -> str:
+        """
+        Check `code` against the live code for `phone`, returning VALID,
+        INVALID or ATTEMPTS_EXCEEDED.
+        """
+        raise NotImplementedError
+
+    def discard(self, phone):
+        raise NotImplementedError
+
+    async def aissue(self, phone, code):
+        return await sync_to_async(self.issue, thread_sensitive=False)(phone, code)
+
+    async def averify(self, phone, code) -> str:
+        return await sync_to_async(self.verify, thread_sensitive=False)(phone, code)
+
+
+class CacheOTPStore(BaseOTPStore):
+    """
+    Keeps codes in a Django cache, relying on its TTLs for expiry and on
+    `incr` for race-free attempt counting. Use a shared backend such as Redis
+    when running more than one process.
+    """
+
+    def __init__(self, alias='default', prefix='otp', **kwargs):
+        super().__init__(**kwargs)
+
+        self.alias = alias
+        self.prefix = prefix
+
+    @property
+    def cache(self):
+        return caches[self.alias]
+
+    def _keys(self, phone):
+        return f'{self.prefix}:{phone}:code', f'{self.prefix}:{phone}:attempts'
+
+    def issue(self, phone, code):
+        code_key, attempts_key = self._keys(phone)
+
+        self.cache.set_many({code_key: code, attempts_key: 0}, timeout=self.timeout)
+
+    def verify(self, phone, code) -> str:
+        code_key, attempts_key = self._keys(phone)
+
+        try:
+            # count the attempt before comparing, so concurrent guesses can't
+            # get past max_attempts
+            attempts = self.cache.incr(attempts_key)
+        except ValueError:
+            # no live code
+            return INVALID
+
+        stored = self.cache.get(code_key)
+
+        if stored is None:
+            return INVALID
+
+        if attempts <= self.max_attempts and constant_time_compare(stored, code):
+            # only the request that actually removes the code may use it
+            return VALID if self.cache.delete(code_key) else INVALID
+
+        if attempts >= self.max_attempts:
+            self.discard(phone)
+            return ATTEMPTS_EXCEEDED
+
+        return INVALID
+
+    def discard(self, phone):
+        self.cache.delete_many(self._keys(phone))
+
+
+class InMemoryOTPStore(BaseOTPStore):
+    """
+    Keeps codes in a dict in this process. For tests and single-process
+    deployments.
+    """
+
+    def __init__(self, **kwargs):
+        super().__init__(**kwargs)
+
+        # phone -> [code, attempts, expires_at]
+        self._codes = {}
+        self._lock = Lock()
+
+    def issue(self, phone, code):
+        with self._lock:
+            self._codes[phone] = [code, 0, time.monotonic() + self.timeout]
+
+    def verify(self, phone, code) -> str:
+        with self._lock:
+            entry = self._codes.get(phone)
+
+            if entry is None:
+                return INVALID
+
+            if entry[2] <= time.monotonic():
+                del self._codes[phone]
+                return INVALID
+
+            entry[1] += 1
+
+            if constant_time_compare(entry[0], code):
+                del self._codes[phone]
+                return VALID
+
+            if entry[1] >= self.max_attempts:
+                del self._codes[phone]
+                return ATTEMPTS_EXCEEDED
+
+            return INVALID
+
+    def discard(self, phone):
+        with self._lock:
+            self._codes.pop(phone, None)
+
+
+otp_store = import_string(settings.OTP_STORE)()
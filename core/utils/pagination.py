@@ -0,0 +1,76 @@
+import base64
+import json
+
+from django.utils.translation import gettext_lazy as _
+from rest_framework.exceptions import ValidationError
+
+
+class KeysetPagination:
+    """
+    Pages through a queryset by the value of a unique, indexed field instead
+    of by offset, so page 1000 costs as much as page 1 and rows added or
+    removed between requests don't shift pages.
+
+    Cursors are opaque to clients: base64 encoded JSON holding the field
+    value of the last row of the previous page.
+    """
+
+    def __init__(self, page_size, max_page_size, field='id', cursor_param='cursor', page_size_param='page_size'):
+        self.page_size = page_size
+        self.max_page_size = max_page_size
+        self.field = field
+        self.cursor_param = cursor_param
+        self.page_size_param = page_size_param
+
+    def encode_cursor(self, value) -> str:
+        return base64.urlsafe_b64encode(json.dumps([value]).encode()).decode().rstrip('=')
+
+    def decode_cursor(self, cursor):
+        try:
+            value, = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+        except (ValueError, TypeError):
+            raise ValidationError({self.cursor_param: _('Invalid cursor.')})
+
+        return value
+
+    def get_page_size(self, request) -> int:
+        page_size = request.query_params.get(self.page_size_param)
+
+        if page_size is None:
+            return self.page_size
+
+        try:
+            page_size = int(page_size)
+        except ValueError:
+            raise ValidationError({self.page_size_param: _('A whole number is required.')})
+
+        if page_size < 1:
+            raise ValidationError({self.page_size_param: _('Must be at least 1.')})
+
+        return min(page_size, self.max_page_size)
+
+    def paginate(self, queryset, request) -> (list, str):
+        """
+        The page of `queryset` (which should be a `.values()` queryset, so
+        no model instances are built) the request asks for, and the cursor
+        of the next page or None on the last one.
+        """
+        page_size = self.get_page_size(request)
+        cursor = request.query_params.get(self.cursor_param)
+        queryset = queryset.order_by(self.field)
+
+        if cursor:
+            try:
+                queryset = queryset.filter(**{f'{self.field}__gt': self.decode_cursor(cursor)})
+            except (ValueError, TypeError):
+                raise ValidationError({self.cursor_param: _('Invalid cursor.')})
+
+        # one extra row tells whether there is a next page
+        rows = list(queryset[:page_size + 1])
+        next_cursor = None
+
+        if len(rows) > page_size:
+            rows = rows[:page_size]
+            next_cursor = self.encode_cursor(rows[-1][self.field])
+
+        return rows, next_cursor
@@ -0,0 +1,290 @@
+import asyncio
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor, TimeoutError
+from contextvars import ContextVar
+from threading import BoundedSemaphore, Lock
+
+from asgiref.sync import sync_to_async
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.contrib.auth.hashers import check_password, make_password
+from django.utils.translation import gettext_lazy as _
+
+from rest_framework import status
+from rest_framework.exceptions import APIException
+
+from .authentication import bump_auth_version
+from .metrics import metrics
+
+# Password hashing is deliberately slow and holds the GIL for its whole
+# duration. Login and registration hand it to a pool of worker processes
+# instead, and refuse work with a 503 once too much of it is queued up.
+
+
+class PasswordHashingUnavailable(APIException):
+    status_code = status.HTTP_503_SERVICE_UNAVAILABLE
+    default_detail = _('Too many login attempts in progress, please retry shortly.')
+    default_code = 'password_hashing_unavailable'
+
+    def __init__(self, detail=None, code=None, wait=None):
+        super().__init__(detail, code)
+
+        # DRF's exception handler turns this into a Retry-After header
+        self.wait = wait or settings.PASSWORD_HASHING_RETRY_AFTER
+
+
+def _init_worker():
+    import django
+    from django.apps import apps
+
+    if not apps.ready:
+        django.setup()
+
+
+def _check(password, encoded):
+    start = time.perf_counter()
+    needs_update = []
+
+    is_correct = check_password(password, encoded, setter=needs_update.append)
+
+    return (is_correct, bool(needs_update)), time.perf_counter() - start
+
+
+def _make(password):
+    start = time.perf_counter()
+
+    return make_password(password), time.perf_counter() - start
+
+
+def _make_many(passwords):
+    return [make_password(password) for password in passwords]
+
+
+def hashing_executor(workers):
+    """A process pool for hashing, with Django set up in every worker."""
+    return ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context(settings.PASSWORD_HASHING_START_METHOD),
+        initializer=_init_worker,
+    )
+
+
+class PasswordHashingPool:
+    """
+    Runs password hashing jobs on `workers` processes, with at most
+    `max_pending` jobs waiting for a free worker. With no workers, jobs run
+    inline in the calling thread.
+    """
+
+    def __init__(self, workers, max_pending, timeout):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+
+        self._executor = None
+        self._executor_lock = Lock()
+        self._slots = BoundedSemaphore(workers + max_pending) if workers else None
+
+        self.in_flight = metrics.gauge('password_hashing.in_flight')
+        self.rejected = metrics.counter('password_hashing.rejected')
+        self.queue_wait = metrics.summary('password_hashing.queue_wait_seconds')
+        self.hash_time = metrics.summary('password_hashing.hash_seconds')
+
+    @property
+    def executor(self):
+        if self._executor is None:
+            with self._executor_lock:
+                if self._executor is None:
+                    self._executor = hashing_executor(self.workers)
+
+        return self._executor
+
+    def submit(self, function, *args):
+        """
+        Queue a job and return its future, or raise PasswordHashingUnavailable
+        when the queue is full.
+        """
+        if not self._slots.acquire(blocking=False):
+            self.rejected.inc()
+            raise PasswordHashingUnavailable()
+
+        self.in_flight.inc()
+
+        try:
+            future = self.executor.submit(function, *args)
+        except Exception:
+            self._release()
+            raise
+
+        future.add_done_callback(self._release)
+
+        return future
+
+    def _release(self, future=None):
+        self.in_flight.dec()
+        self._slots.release()
+
+    def run(self, function, *args):
+        start = time.perf_counter()
+
+        if not self.workers:
+            result, hash_time = function(*args)
+        else:
+            try:
+                result, hash_time = self.submit(function, *args).result(self.timeout)
+            except TimeoutError:
+                raise PasswordHashingUnavailable()
+
+        self._observe(start, hash_time)
+
+        return result
+
+    async def arun(self, function, *args):
+        """
+        `run` for async code, waits for the job without blocking the event loop.
+        """
+        start = time.perf_counter()
+
+        if not self.workers:
+            result, hash_time = await sync_to_async(function, thread_sensitive=False)(*args)
+        else:
+            try:
+                result, hash_time = await asyncio.wait_for(
+                    asyncio.wrap_future(self.submit(function, *args)),
+                    self.timeout,
+                )
+            except asyncio.TimeoutError:
+                raise PasswordHashingUnavailable()
+
+        self._observe(start, hash_time)
+
+        return result
+
+    def _observe(self, start, hash_time):
+        self.hash_time.observe(hash_time)
+        self.queue_wait.observe(max(0.0, time.perf_counter() - start - hash_time))
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=True)
+            self._executor = None
+
+
+pool = PasswordHashingPool(
+    workers=settings.PASSWORD_HASHING_WORKERS,
+    max_pending=settings.PASSWORD_HASHING_MAX_PENDING,
+    timeout=settings.PASSWORD_HASHING_TIMEOUT,
+)
+
+
+def hash_password(raw_password) -> str:
+    if raw_password is None:
+        # unusable password, nothing to hash
+        return make_password(None)
+
+    return pool.run(_make, raw_password)
+
+
+def hash_passwords(raw_passwords, executor=None, chunk_size=16) -> list:
+    """
+    Hash many passwords for bulk jobs such as imports, spread across the
+    processes of `executor` (see `hashing_executor`), or inline without one.
+    Unlike `hash_password` there is no queue limit or timeout.
+    """
+    if executor is None:
+        return _make_many(raw_passwords)
+
+    chunks = [raw_passwords[n:n + chunk_size] for n in range(0, len(raw_passwords), chunk_size)]
+
+    return [encoded for chunk in executor.map(_make_many, chunks) for encoded in chunk]
+
+
+def set_password(user, raw_password):
+    """
+    Pool-backed equivalent of `user.set_password`.
+    """
+    user.password = hash_password(raw_password)
+    user._password = raw_password
+
+
+def verify_password(user, raw_password) -> bool:
+    """
+    Pool-backed equivalent of `user.check_password`.
+
+    Hashes made with an outdated hasher or work factor are upgraded once
+    the response has been sent (see `run_deferred_rehashes`), so upgrading
+    never adds to login latency.
+    """
+    if raw_password is None or not user.has_usable_password():
+        return False
+
+    is_correct, must_update = pool.run(_check, raw_password, user.password)
+
+    if is_correct and must_update:
+        defer_rehash(user, raw_password)
+
+    return is_correct
+
+
+async def averify_password(user, raw_password) -> bool:
+    """
+    `verify_password` for async code.
+    """
+    if raw_password is None or not user.has_usable_password():
+        return False
+
+    is_correct, must_update = await pool.arun(_check, raw_password, user.password)
+
+    if is_correct and must_update:
+        defer_rehash(user, raw_password)
+
+    return is_correct
+
+
+# Rehashes queued by the current request. None outside of a request, in
+# which case rehashing happens right away.
+_deferred_rehashes = ContextVar('deferred_rehashes', default=None)
+
+
+def rehash(user_id, raw_password, old_password):
+    """
+    Replace the stored hash, unless the password changed in the meantime.
+    """
+    new_password = hash_password(raw_password)
+
+    updated = get_user_model().objects.filter(
+        pk=user_id,
+        password=old_password,
+    ).update(password=new_password)
+
+    if updated:
+        # update() sends no signals
+        bump_auth_version(user_id)
+        metrics.counter('password_hashing.rehashed').inc()
+
+
+def defer_rehash(user, raw_password):
+    pending = _deferred_rehashes.get()
+
+    if pending is None:
+        rehash(user.pk, raw_password, user.password)
+    else:
+        pending.append((user.pk, raw_password, user.password))
+
+
+def begin_deferred_rehashes():
+    _deferred_rehashes.set([])
+
+
+def run_deferred_rehashes():
+    pending = _deferred_rehashes.get()
+    _deferred_rehashes.set(None)
+
+    for user_id, raw_password, old_password in pending or ():
+        try:
+            rehash(user_id, raw_password, old_password)
+        except PasswordHashingUnavailable:
+            # the pool is busy, the next login will try again
+            metrics.counter('password_hashing.rehash_skipped').inc()
@@ -0,0 +1,223 @@
+"""
+Offline parsing and validation of phone numbers into E.164 form.
+
+Numbers are checked against per-country tables of calling code, trunk
+prefix and national number pattern, which cover the leading digits and
+lengths numbers can have but not whether a number is assigned. That is what
+the optional Twilio Lookup check (see core/utils/lookups.py) is for.
+Countries without a table only get their calling code and the E.164 length
+limits checked.
+"""
+import re
+from functools import lru_cache
+from typing import NamedTuple
+
+from django.conf import settings
+
+# region: (calling code, trunk prefix, national number pattern)
+METADATA = {
+    'US': ('1', '1', r'[2-9]\d{2}[2-9]\d{6}'),
+    'RU': ('7', '8', r'[3489]\d{9}'),
+    'KZ': ('7', '8', r'[67]\d{9}'),
+    'EG': ('20', '0', r'1\d{9}|[2-9]\d{7,8}'),
+    'ZA': ('27', '0', r'[1-8]\d{8}'),
+    'GR': ('30', '', r'[2-9]\d{9}'),
+    'NL': ('31', '0', r'[1-9]\d{8}'),
+    'BE': ('32', '0', r'4\d{8}|[1-9]\d{7}'),
+    'FR': ('33', '0', r'[1-9]\d{8}'),
+    'ES': ('34', '', r'[5-9]\d{8}'),
+    'HU': ('36', '06', r'[1-9]\d{7,8}'),
+    'IT': ('39', '', r'0\d{5,10}|3\d{8,9}'),
+    'RO': ('40', '0', r'[237]\d{8}'),
+    'CH': ('41', '0', r'[2-9]\d{8}'),
+    'AT': ('43', '0', r'[1-9]\d{3,12}'),
+    'GB': ('44', '0', r'[1-9]\d{8,9}'),
+    'DK': ('45', '', r'[2-9]\d{7}'),
+    'SE': ('46', '0', r'[1-9]\d{6,9}'),
+    'NO': ('47', '', r'[2-9]\d{7}'),
+    'PL': ('48', '', r'[1-9]\d{8}'),
+    'DE': ('49', '0', r'[1-9]\d{5,13}'),
+    'PE': ('51', '0', r'9\d{8}|[1-8]\d{7}'),
+    'MX': ('52', '', r'[1-9]\d{9}'),
+    'AR': ('54', '0', r'9?[1-9]\d{9}'),
+    'BR': ('55', '0', r'[1-9]{2}(?:9\d{8}|[2-5]\d{7})'),
+    'CL': ('56', '', r'[2-9]\d{8}'),
+    'CO': ('57', '', r'3\d{9}|60\d{8}'),
+    'VE': ('58', '0', r'[24589]\d{9}'),
+    'MY': ('60', '0', r'1\d{8,9}|[3-9]\d{7,8}'),
+    'AU': ('61', '0', r'[2-478]\d{8}'),
+    'ID': ('62', '0', r'8\d{8,11}|[2-7]\d{6,10}'),
+    'PH': ('63', '0', r'9\d{9}|[2-8]\d{7,9}'),
+    'NZ': ('64', '0', r'2\d{7,9}|[34679]\d{7}'),
+    'SG': ('65', '', r'[3689]\d{7}'),
+    'TH': ('66', '0', r'[2-9]\d{7,8}'),
+    'JP': ('81', '0', r'[1-9]\d{8,9}'),
+    'KR': ('82', '0', r'1\d{8,9}|[2-6]\d{7,9}'),
+    'VN': ('84', '0', r'[235789]\d{8}'),
+    'CN': ('86', '0', r'1[3-9]\d{9}|[2-9]\d{8,10}'),
+    'TR': ('90', '0', r'[2-589]\d{9}'),
+    'IN': ('91', '0', r'[1-9]\d{9}'),
+    'PK': ('92', '0', r'3\d{9}|[2-9]\d{7,9}'),
+    'IR': ('98', '0', r'[1-9]\d{9}'),
+    'MA': ('212', '0', r'[5-8]\d{8}'),
+    'GH': ('233', '0', r'[235]\d{8}'),
+    'NG': ('234', '0', r'[789][01]\d{8}|[1-9]\d{7}'),
+    'KE': ('254', '0', r'[1-9]\d{8}'),
+    'PT': ('351', '', r'[29]\d{8}'),
+    'IE': ('353', '0', r'[1-9]\d{6,9}'),
+    'FI': ('358', '0', r'[1-9]\d{4,11}'),
+    'UA': ('380', '0', r'[3-9]\d{8}'),
+    'CZ': ('420', '', r'[2-9]\d{8}'),
+    'HK': ('852', '', r'[2-9]\d{7}'),
+    'TW': ('886', '0', r'9\d{8}|[2-8]\d{7,8}'),
+    'AE': ('971', '0', r'5\d{8}|[2-9]\d{7}'),
+    'IL': ('972', '0', r'[2-9]\d{7,8}'),
+    'SA': ('966', '0', r'5\d{8}|1\d{7,8}'),
+}
+
+# Assigned country calling codes with no entry in METADATA.
+OTHER_CODES = frozenset((
+    '53', '93', '94', '95',
+    '211', '213', '216', '218', '220', '221', '222', '223', '224', '225', '226', '227', '228', '229',
+    '230', '231', '232', '235', '236', '237', '238', '239', '240', '241', '242', '243', '244', '245',
+    '246', '247', '248', '249', '250', '251', '252', '253', '255', '256', '257', '258', '260', '261',
+    '262', '263', '264', '265', '266', '267', '268', '269', '290', '291', '297', '298', '299',
+    '350', '352', '354', '355', '356', '357', '359', '370', '371', '372', '373', '374', '375', '376',
+    '377', '378', '379', '381', '382', '383', '385', '386', '387', '389', '421', '423',
+    '500', '501', '502', '503', '504', '505', '506', '507', '508', '509', '590', '591', '592', '593',
+    '594', '595', '596', '597', '598', '599',
+    '670', '672', '673', '674', '675', '676', '677', '678', '679', '680', '681', '682', '683', '685',
+    '686', '687', '688', '689', '690', '691', '692',
+    '850', '853', '855', '856', '880',
+    '960', '961', '962', '963', '964', '965', '967', '968', '970', '973', '974', '975', '976', '977',
+    '992', '993', '994', '995', '996', '998',
+))
+
+
+def _compile(metadata) -> dict:
+    """
+    Group the regions by calling code, with their patterns compiled.
+    """
+    by_code = {}
+
+    for region, (code, trunk, pattern) in metadata.items():
+        by_code.setdefault(code, []).append((region, trunk, re.compile(pattern)))
+
+    return by_code
+
+
+BY_CODE = _compile(METADATA)
+MAX_CODE_LENGTH = max(len(code) for code in BY_CODE.keys() | OTHER_CODES)
+
+# E.164 numbers are at most 15 digits, calling code included
+MAX_DIGITS = 15
+
+# the shortest national numbers in use, for countries without a table
+MIN_NATIONAL_DIGITS = 4
+
+_SEPARATORS = re.compile(r'[\s\-.()/]')
+
+
+class InvalidPhoneNumber(ValueError):
+    pass
+
+
+class PhoneNumber(NamedTuple):
+    country_code: str
+    national_number: str
+    # the first region of the calling code whose pattern matches, None for
+    # calling codes without a table
+    region: str
+
+    @property
+    def e164(self) -> str:
+        return f'+{self.country_code}{self.national_number}'
+
+
+def _match(code, national):
+    if code in OTHER_CODES:
+        return _match_length(code, national)
+
+    for region, trunk, pattern in BY_CODE.get(code, ()):
+        if pattern.fullmatch(national):
+            return PhoneNumber(code, national, region)
+
+    return None
+
+
+def _match_length(code, national):
+    if MIN_NATIONAL_DIGITS <= len(national) <= MAX_DIGITS - len(code):
+        return PhoneNumber(code, national, None)
+
+    return None
+
+
+def _match_national(code, national):
+    """
+    A number dialled without its calling code, possibly with the trunk prefix.
+    Without a table the trunk prefix is taken to be 0, the most common one.
+    """
+    if code in OTHER_CODES:
+        return _match_length(code, national[1:] if national.startswith('0') else national)
+
+    for region, trunk, pattern in BY_CODE.get(code, ()):
+        if trunk and national.startswith(trunk) and pattern.fullmatch(national[len(trunk):]):
+            return PhoneNumber(code, national[len(trunk):], region)
+
+        if pattern.fullmatch(national):
+            return PhoneNumber(code, national, region)
+
+    return None
+
+
+def parse(phone, country_code=None) -> PhoneNumber:
+    """
+    Parse `phone`, given with a leading + or 00 and its calling code, or in
+    national form for `country_code` (e.g. '+44', defaults to
+    PHONE_DEFAULT_COUNTRY_CODE).
+    """
+    if not phone:
+        raise InvalidPhoneNumber('Phone number is empty.')
+
+    return _parse(phone, (country_code or settings.PHONE_DEFAULT_COUNTRY_CODE).lstrip('+'))
+
+
+@lru_cache(maxsize=4096)
+def _parse(phone, country_code) -> PhoneNumber:
+    digits = _SEPARATORS.sub('', phone)
+    international = digits.startswith('+')
+
+    if international:
+        digits = digits[1:]
+    elif digits.startswith('00'):
+        digits, international = digits[2:], True
+
+    if not digits.isdigit() or len(digits) > MAX_DIGITS:
+        raise InvalidPhoneNumber(f'{phone!r} is not a phone number.')
+
+    if international:
+        for length in range(1, MAX_CODE_LENGTH + 1):
+            number = _match(digits[:length], digits[length:])
+
+            if number:
+                return number
+    else:
+        number = _match_national(country_code, digits)
+
+        if number:
+            return number
+
+    raise InvalidPhoneNumber(f'{phone!r} is not a valid phone number.')
+
+
+def to_e164(phone, country_code=None) -> str:
+    return parse(phone, country_code).e164
+
+
+def is_valid(phone, country_code=None) -> bool:
+    try:
+        parse(phone, country_code)
+    except InvalidPhoneNumber:
+        return False
+
+    return True
@@ -1,34 +1,150 @@
+import json
+
 from rest_framework.renderers import JSONRenderer
-from rest_framework.views import exception_handler
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover - orjson is optional
+    orjson = None
+
+# Responses are always wrapped in the same envelope. Views build it once via
+# generate_success_response/generate_error_response (see core/utils/http.py)
+# and the renderer writes the envelope bytes around the encoded fields
+# directly instead of copying them into a second dict for JSONRenderer.
+
+ENVELOPE_DEFAULTS = (
+    ('data', {}),
+    ('status', 500),
+    ('errors', []),
+    ('message', ''),
+)
+
+
+class Envelope(dict):
+    """
+    A response body that is already in envelope form.
+
+    Keys are always data, status, errors and message, in that order; a None
+    value means "use the default" exactly like a missing key does.
+    """
+
+    def __init__(self, data=None, status=None, errors=None, message=None):
+        super().__init__(data=data, status=status, errors=errors, message=message)
+
+
+class JSONFragment:
+    """
+    Already-encoded JSON written verbatim into a response, e.g. a cached
+    rendering of a large payload. Use it as an envelope's data.
+    """
+
+    __slots__ = ('content',)
+
+    def __init__(self, content):
+        self.content = content.encode() if isinstance(content, str) else bytes(content)
+
+    def __eq__(self, other):
+        return isinstance(other, JSONFragment) and other.content == self.content
+
+    def __hash__(self):
+        return hash(self.content)
+
+    def __repr__(self):
+        return f'<JSONFragment {len(self.content)} bytes>'
+
+
+def envelope(data):
+    """Normalize any response body into an Envelope."""
+    if isinstance(data, Envelope):
+        return data
+
+    # missing keys and None both fall back to the defaults at render time
+    return Envelope(
+        data=data.get('data', None),
+        status=data.get('status', None),
+        errors=data.get('errors', None),
+        message=data.get('message', None),
+    )
+
 
 class CustomJSONRenderer(JSONRenderer):
+    """
+    Renders the response envelope.
+
+    The compact (default) form is byte for byte what JSONRenderer produces
+    for the same envelope. orjson encodes the fields when it is installed;
+    values it does not know about go through DRF's encoder, and anything it
+    refuses (e.g. integers wider than 64 bits) falls back to json. The
+    visible differences are float exponents, which orjson spells 1e16 rather
+    than 1e+16, and UTC offsets with seconds, which it rounds to minutes.
+    """
+
+    orjson_options = (orjson.OPT_NON_STR_KEYS | orjson.OPT_UTC_Z) if orjson else 0
+
     def render(self, data, accepted_media_type=None, renderer_context=None):
-        
-        # check if there are any errors
-
-        response_data = {
-            'data': {},
-            'status': 500,
-            'errors': [],
-            'message': '',
-
-        }
-        if data.get('errors', None) is not None:
-            response_data['errors'] = data.get('errors')
-            response_data['data'] = {}
-
-        if data.get('message', None) is not None:
-            response_data['message'] = data.get('message')
-
-        if data.get('status', None) is not None:
-            response_data['status'] = data.get('status')
-
-        if data.get('data', None) is not None:
-            response_data['data'] = data.get('data')
-
-       # call super to render the response
-        response = super(CustomJSONRenderer, self).render(
-            response_data, accepted_media_type, renderer_context
-        )
-        
-        return response
\ No newline at end of file
+        body = envelope(data)
+
+        if not self.compact or self.get_indent(accepted_media_type, renderer_context or {}) is not None:
+            # pretty-printed output is for humans, not worth a fast path
+            return super().render(self.expand(body), accepted_media_type, renderer_context)
+
+        parts = []
+
+        for key, default in ENVELOPE_DEFAULTS:
+            value = body[key]
+            parts.append(self.encode(default if value is None else value))
+
+        return b'{"data":%b,"status":%b,"errors":%b,"message":%b}' % tuple(parts)
+
+    @staticmethod
+    def expand(body):
+        """The envelope as plain data, with defaults and fragments decoded."""
+        expanded = {}
+
+        for key, default in ENVELOPE_DEFAULTS:
+            value = body[key]
+
+            if value is None:
+                value = default
+            elif isinstance(value, JSONFragment):
+                value = json.loads(value.content)
+
+            expanded[key] = value
+
+        return expanded
+
+    def encode(self, value):
+        if isinstance(value, JSONFragment):
+            return value.content
+
+        if orjson is not None and not self.ensure_ascii:
+            try:
+                content = orjson.dumps(value, default=self.encoder_default, option=self.orjson_options)
+            except orjson.JSONEncodeError:
+                pass
+            else:
+                return self.escape(content)
+
+        content = json.dumps(
+            value, cls=self.encoder_class, ensure_ascii=self.ensure_ascii,
+            allow_nan=not self.strict, separators=(',', ':'),
+        ).encode()
+
+        return self.escape(content)
+
+    def encoder_default(self, value):
+        return self.encoder_class().default(value)
+
+    @staticmethod
+    def escape(content):
+        # same as JSONRenderer: keep the output safe to embed in <script>
+        if b'\xe2\x80\xa8' in content or b'\xe2\x80\xa9' in content:
+            content = content.replace(b'\xe2\x80\xa8', b'\\u2028').replace(b'\xe2\x80\xa9', b'\\u2029')
+
+        return content
+
+
+def fragment(value) -> JSONFragment:
+    """Encode `value` once, e.g. to cache it and render it many times."""
+    return JSONFragment(CustomJSONRenderer().encode(value))
+
@@ -0,0 +1,140 @@
+import time
+from threading import Lock
+
+from django.conf import settings
+from django.db.models import Max
+from django.utils import timezone
+
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+
+from .bloom import BloomFilter
+from .cache import SequenceLog
+
+
+class RevocationIndex:
+    """
+    In-memory index of blacklisted refresh token jtis.
+
+    `is_revoked` answers "definitely not revoked" from a Bloom filter and
+    only asks the database about probable hits, so checking a valid token
+    costs no queries.
+
+    The filter is loaded from the blacklist table on first use and kept
+    current by:
+
+    - `add`, called from the BlacklistedToken post_save signal, which also
+      appends the jti to a numbered log in the shared cache so every other
+      process picks it up on its next check without touching the database
+    - a delta sync of rows with a higher id than the last one seen, every
+      REVOCATION_INDEX_SYNC_INTERVAL seconds, or when the cache log has gaps
+    - a full rebuild every REVOCATION_INDEX_REBUILD_INTERVAL seconds, which
+      drops tokens that have expired anyway
+    """
+
+    def __init__(self, error_rate=0.001, min_capacity=10000):
+        self.error_rate = error_rate
+        self.min_capacity = min_capacity
+
+        self.bloom = None
+        self.last_id = 0
+        self.sequence = 0
+        self.synced_at = 0
+        self.built_at = 0
+
+        self.log = SequenceLog('revocation', timeout=settings.REVOCATION_INDEX_REBUILD_INTERVAL)
+        self._lock = Lock()
+
+    def build(self):
+        # read the sequence first, anything logged after it gets replayed
+        sequence = self.log.current()
+        last_id = BlacklistedToken.objects.aggregate(last_id=Max('id'))['last_id'] or 0
+
+        jtis = BlacklistedToken.objects.filter(
+            id__lte=last_id,
+            token__expires_at__gt=timezone.now(),
+        ).values_list('token__jti', flat=True)
+
+        count = jtis.count()
+        bloom = BloomFilter(max(count * 2, self.min_capacity), self.error_rate)
+        bloom.update(jtis.iterator(chunk_size=10000))
+
+        with self._lock:
+            self.bloom = bloom
+            self.last_id = last_id
+            self.sequence = sequence
+            self.synced_at = self.built_at = time.monotonic()
+
+    def sync(self):
+        """
+        Add rows blacklisted since the last build or sync.
+        """
+        sequence = self.log.current()
+
+        rows = BlacklistedToken.objects.filter(
+            id__gt=self.last_id,
+        ).order_by('id').values_list('id', 'token__jti')
+
+        with self._lock:
+            for id, jti in rows:
+                self.bloom.add(jti)
+                self.last_id = id
+
+            self.sequence = max(self.sequence, sequence)
+            self.synced_at = time.monotonic()
+
+    def replay(self):
+        """
+        Add revocations other processes logged to the shared cache.
+        """
+        sequence = self.log.current()
+
+        if sequence == self.sequence:
+            return
+
+        jtis = self.log.read(self.sequence, sequence)
+
+        if jtis is None:
+            return self.sync()
+
+        with self._lock:
+            self.bloom.update(jtis)
+            self.sequence = max(self.sequence, sequence)
+
+    def ensure_fresh(self):
+        now = time.monotonic()
+
+        if (
+            self.bloom is None
+            or self.bloom.is_saturated
+            or now - self.built_at >= settings.REVOCATION_INDEX_REBUILD_INTERVAL
+        ):
+            self.build()
+        elif now - self.synced_at >= settings.REVOCATION_INDEX_SYNC_INTERVAL:
+            self.sync()
+        else:
+            self.replay()
+
+    def add(self, jti):
+        """
+        Record a revocation in this process and log it for the others.
+        """
+        sequence = self.log.append(jti)
+
+        if self.bloom is not None:
+            with self._lock:
+                self.bloom.add(jti)
+
+                # no need to replay our own entry
+                if sequence == self.sequence + 1:
+                    self.sequence = sequence
+
+    def is_revoked(self, jti) -> bool:
+        self.ensure_fresh()
+
+        if jti not in self.bloom:
+            return False
+
+        return BlacklistedToken.objects.filter(token__jti=jti).exists()
+
+
+revocation_index = RevocationIndex()
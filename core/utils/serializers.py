@@ -0,0 +1,140 @@
+import datetime
+from functools import lru_cache
+from typing import Callable, NamedTuple
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+from django.utils import timezone
+from rest_framework import ISO_8601
+from rest_framework import fields as drf_fields
+from rest_framework.relations import ManyRelatedField, RelatedField
+from rest_framework.serializers import BaseSerializer
+from rest_framework.settings import api_settings
+
+# DRF's Serializer.to_representation walks every field of every object:
+# get_attribute, SkipField handling, the None check, then the field's own
+# to_representation. For read-only, flat serializers that is the same work
+# every time, so compile_serializer turns it into one generated function per
+# serializer class that builds the dict directly.
+
+# fields whose to_representation is exactly a builtin conversion
+CONVERSIONS = {
+    drf_fields.CharField.to_representation: str,
+    drf_fields.IntegerField.to_representation: int,
+}
+
+
+def iso_datetime(value, tz):
+    """DateTimeField.to_representation for ISO 8601, given the timezone."""
+    if not value:
+        return None
+
+    if isinstance(value, str):
+        return value
+
+    if tz is not None:
+        value = value.astimezone(tz) if timezone.is_aware(value) else timezone.make_aware(value, tz)
+    elif timezone.is_aware(value):
+        value = timezone.make_naive(value, datetime.timezone.utc)
+
+    value = value.isoformat()
+
+    return value[:-6] + 'Z' if value.endswith('+00:00') else value
+
+
+def current_timezone():
+    # what DateTimeField.default_timezone looks up for every single value
+    return timezone.get_current_timezone() if settings.USE_TZ else None
+
+
+class CompiledSerializer(NamedTuple):
+    # the attributes to read, e.g. for queryset.values(*compiled.fields)
+    fields: tuple
+    # (row, tz) -> data, and (instance, tz) -> data
+    row_function: Callable
+    instance_function: Callable
+
+    def from_row(self, row):
+        """A .values() row (dict) -> the serializer's data."""
+        return self.row_function(row, current_timezone())
+
+    def from_instance(self, instance):
+        """A model instance (or any object) -> the serializer's data."""
+        return self.instance_function(instance, current_timezone())
+
+    def rows(self, rows):
+        function, tz = self.row_function, current_timezone()
+        return [function(row, tz) for row in rows]
+
+    def instances(self, instances):
+        function, tz = self.instance_function, current_timezone()
+        return [function(instance, tz) for instance in instances]
+
+
+def _conversion(field):
+    """The field's to_representation, and whether it takes the timezone."""
+    if type(field).to_representation in CONVERSIONS:
+        return CONVERSIONS[type(field).to_representation], False
+
+    if (
+        isinstance(field, drf_fields.DateTimeField)
+        and type(field).to_representation is drf_fields.DateTimeField.to_representation
+        and type(field).enforce_timezone is drf_fields.DateTimeField.enforce_timezone
+        and not hasattr(field, 'timezone')
+        and (getattr(field, 'format', api_settings.DATETIME_FORMAT) or '').lower() == ISO_8601
+    ):
+        return iso_datetime, True
+
+    return field.to_representation, False
+
+
+@lru_cache(maxsize=None)
+def compile_serializer(serializer_class) -> CompiledSerializer:
+    """
+    Compile a serializer class into plain functions producing the same data
+    as serializer_class(obj).data, field for field and in the same order.
+
+    Only flat fields backed by one attribute are supported; nested
+    serializers, relations, method fields and dotted sources raise
+    ImproperlyConfigured. Write-only fields are left out, as DRF does.
+    """
+    serializer = serializer_class()
+    names, sources, conversions, calls = [], [], {}, []
+
+    for field in serializer.fields.values():
+        if field.write_only:
+            continue
+
+        if (
+            isinstance(field, (BaseSerializer, RelatedField, ManyRelatedField, drf_fields.SerializerMethodField))
+            or len(field.source_attrs) != 1
+            or not field.source.isidentifier()
+        ):
+            raise ImproperlyConfigured(
+                f'{serializer_class.__name__}.{field.field_name} cannot be compiled, '
+                f'only flat attribute fields are supported.'
+            )
+
+        conversion, takes_timezone = _conversion(field)
+        index = len(names)
+        conversions[f'c{index}'] = conversion
+        calls.append(f'c{index}(v, tz)' if takes_timezone else f'c{index}(v)')
+        names.append(field.field_name)
+        sources.append(field.source)
+
+    def generate(function, read):
+        items = ''.join(
+            f'        {name!r}: None if (v := {read(source)}) is None else {call},\n'
+            for name, source, call in zip(names, sources, calls)
+        )
+        code = f'def {function}(obj, tz):\n    return {{\n{items}    }}\n'
+        namespace = dict(conversions)
+        exec(compile(code, f'<{serializer_class.__qualname__}.{function}>', 'exec'), namespace)
+
+        return namespace[function]
+
+    return CompiledSerializer(
+        fields=tuple(sources),
+        row_function=generate('from_row', lambda source: f'obj[{source!r}]'),
+        instance_function=generate('from_instance', lambda source: f'obj.{source}'),
+    )
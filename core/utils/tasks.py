@@ -1,69 +1,43 @@
-from threading import Thread
-
 from django.conf import settings
 from django.core.mail import send_mail
 
-from twilio.rest import Client
-
-client = Client(
-    settings.TWILIO_ACCOUNT_SID,
-    settings.TWILIO_AUTH_TOKEN,
-)
+from .dispatch import dispatcher
+from .twilio_gateway import gateway
 
-class SendEmailThread(Thread):
-    def __init__(self, subject, html_content, recipient_list):
-        self.subject = subject
-        self.html_content = html_content
-        self.recipient_list = recipient_list
-        Thread.__init__(self)
+# Sends run on the shared dispatcher (see core/utils/dispatch.py), which
+# bounds how many run at once and how many may wait.
 
-    def run(self):
-        send_mail(
-            subject=self.subject,
-            message='',
-            html_message=self.html_content,
-            recipient_list=self.recipient_list,
-            from_email=settings.EMAIL_HOST_USER,
-        )
+def _send_email(subject, html_content, recipient_list, connection=None):
+    send_mail(
+        subject=subject,
+        message='',
+        html_message=html_content,
+        recipient_list=recipient_list,
+        from_email=settings.EMAIL_HOST_USER,
+        connection=connection,
+    )
 
 def send_email(subject, html_content, recipient_list):
-    SendEmailThread(subject, html_content, recipient_list).start()
+    dispatcher.submit('email', _send_email, subject, html_content, recipient_list)
 
-class SendPhoneCodeThread(Thread):
-    def __init__(self, phone, code):
-        self.phone = phone
-        self.code = code
-        Thread.__init__(self)
+def _send_phone_code(phone, code):
 
-    def run(self):
-        
-        if settings.SEND_SMS_TEXT:
-            client.messages.create(
-                body=f'Your code is {self.code}',
-                from_=settings.TWILIO_PHONE_NUMBER,
-                to=self.phone,
-            )
+    if settings.SEND_SMS_TEXT:
+        gateway.send_sms(to=phone, body=f'Your code is {code}')
 
 def send_phone_code(phone, code):
-    SendPhoneCodeThread(phone, code).start()
+    dispatcher.submit('sms', _send_phone_code, phone, code)
 
-class CallPhoneWithCodeThread(Thread):
-    def __init__(self, phone, code):
-        self.phone = phone
-        self.code = code
-        Thread.__init__(self)
+def _call_phone_with_code(phone, code):
 
-    def run(self):
-        
-        # format code with spaces between each number
-        self.code = '. '.join(self.code)
+    # format code with spaces between each number
+    code = '. '.join(code)
 
-        if settings.SEND_SMS_CALL:
-            client.calls.create(
-                twiml=f'<Response><Say>Your,, code, is. {self.code}</Say><Pause></Pause><Say>Again,, Your, code, is. {self.code}</Say><Pause></Pause><Say>Thank you, and stay cool. </Say></Response>',
-                from_=settings.TWILIO_PHONE_NUMBER,
-                to=self.phone,
-            )
+    if settings.SEND_SMS_CALL:
+        gateway.place_call(
+            to=phone,
+            twiml=f'<Response><Say>Your,, code, is. {code}</Say><Pause></Pause><Say>Again,, Your, code, is. {code}</Say><Pause></Pause><Say>Thank you, and stay cool. </Say></Response>',
+        )
 
 def call_phone_with_code(phone, code):
-    CallPhoneWithCodeThread(phone, code).start()
\ No newline at end of file
+    dispatcher.submit('voice', _call_phone_with_code, phone, code)
@@ -0,0 +1,116 @@
+import jwt
+
+from django.conf import settings
+from django.utils.translation import gettext_lazy as _
+
+from rest_framework_simplejwt import tokens
+from rest_framework_simplejwt.backends import TokenBackend
+from rest_framework_simplejwt.exceptions import TokenBackendError, TokenError
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.state import token_backend as symmetric_backend
+
+from .keyring import KeyRing
+from .revocation import revocation_index
+
+
+class KeyRingTokenBackend(TokenBackend):
+    """
+    simplejwt token backend that signs with the active key of a KeyRing and
+    puts its kid in the token header, so verifiers can pick the right public
+    key without trying every key.
+
+    Tokens without a kid were signed by the symmetric SIMPLE_JWT settings.
+    They are accepted while JWT_ACCEPT_SYMMETRIC_TOKENS is on, which keeps
+    existing sessions alive while moving to asymmetric keys.
+    """
+
+    def __init__(self, keyring, fallback=symmetric_backend, accept_fallback=True):
+        # skip TokenBackend.__init__, which only knows about a single algorithm
+        self.keyring = keyring
+        self.fallback = fallback
+        self.accept_fallback = accept_fallback
+
+        self.algorithm = keyring.active.algorithm if keyring.active else fallback.algorithm
+        self.audience = fallback.audience
+        self.issuer = fallback.issuer
+        self.leeway = fallback.leeway
+        self.json_encoder = fallback.json_encoder
+        self.jwks_client = None
+
+    def encode(self, payload):
+        key = self.keyring.active
+
+        if key is None:
+            return self.fallback.encode(payload)
+
+        jwt_payload = payload.copy()
+        if self.audience is not None:
+            jwt_payload['aud'] = self.audience
+        if self.issuer is not None:
+            jwt_payload['iss'] = self.issuer
+
+        return jwt.encode(
+            jwt_payload,
+            key.private_key,
+            algorithm=key.algorithm,
+            headers={'kid': key.kid},
+            json_encoder=self.json_encoder,
+        )
+
+    def decode(self, token, verify=True):
+        try:
+            kid = jwt.get_unverified_header(token).get('kid')
+        except jwt.InvalidTokenError as ex:
+            raise TokenBackendError(_('Token is invalid or expired')) from ex
+
+        if kid is None:
+            if not self.accept_fallback:
+                raise TokenBackendError(_('Token is invalid or expired'))
+
+            return self.fallback.decode(token, verify=verify)
+
+        key = self.keyring.get(kid)
+
+        if key is None:
+            raise TokenBackendError(_('Token is invalid or expired'))
+
+        try:
+            return jwt.decode(
+                token,
+                key.public_key,
+                algorithms=[key.algorithm],
+                audience=self.audience,
+                issuer=self.issuer,
+                leeway=self.get_leeway(),
+                options={
+                    'verify_aud': self.audience is not None,
+                    'verify_signature': verify,
+                },
+            )
+        except jwt.InvalidTokenError as ex:
+            raise TokenBackendError(_('Token is invalid or expired')) from ex
+
+
+token_backend = KeyRingTokenBackend(
+    KeyRing.from_settings(),
+    accept_fallback=settings.JWT_ACCEPT_SYMMETRIC_TOKENS,
+)
+
+
+class AccessToken(tokens.AccessToken):
+    @property
+    def token_backend(self):
+        return token_backend
+
+
+class RefreshToken(tokens.RefreshToken):
+    access_token_class = AccessToken
+
+    @property
+    def token_backend(self):
+        return token_backend
+
+    def check_blacklist(self):
+        # only tokens the revocation index can't rule out cost a query
+        if revocation_index.is_revoked(self.payload[api_settings.JTI_CLAIM]):
+            raise TokenError(_("Token is blacklisted"))
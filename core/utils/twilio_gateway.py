@@ -0,0 +1,228 @@
+import asyncio
+import logging
+import os
+import time
+from concurrent.futures import TimeoutError as FutureTimeoutError
+from threading import Lock, Thread
+
+from aiohttp import BasicAuth, ClientConnectorError, ClientSession, ClientTimeout, ServerDisconnectedError, TCPConnector
+from aiohttp_retry import ExponentialRetry, RetryClient
+from django.conf import settings
+from twilio.http.async_http_client import AsyncTwilioHttpClient
+from twilio.http.response import Response
+from twilio.rest import Client
+
+from .metrics import metrics
+
+logger = logging.getLogger(__name__)
+
+# Statuses Twilio answers without acting on the request, so retrying is safe
+# even for sends.
+RETRY_STATUSES = {429, 503}
+
+
+class TwilioHttpClient(AsyncTwilioHttpClient):
+    """
+    Twilio's aiohttp client, with a keep-alive connection pool, connect and
+    read timeouts and bounded retries.
+
+    Any request is retried when connecting fails. Lookups (GETs) are also
+    retried when the connection drops or times out mid-request; sends are
+    not, as Twilio may already have sent the message or placed the call.
+    """
+
+    def __init__(self, connect_timeout, read_timeout, max_retries, pool_size, keepalive):
+        super().__init__(pool_connections=False, timeout=read_timeout)
+
+        self.connect_timeout = connect_timeout
+        self.pool_size = pool_size
+        self.keepalive = keepalive
+
+        self.retry_options = {
+            'GET': ExponentialRetry(
+                attempts=max_retries + 1,
+                statuses=RETRY_STATUSES,
+                exceptions={ClientConnectorError, ServerDisconnectedError, asyncio.TimeoutError},
+                retry_all_server_errors=True,
+            ),
+            'POST': ExponentialRetry(
+                attempts=max_retries + 1,
+                statuses=RETRY_STATUSES,
+                exceptions={ClientConnectorError},
+                retry_all_server_errors=False,
+            ),
+        }
+
+        # made on first use, on the loop it is used from
+        self.session = None
+
+    def _client_timeout(self, read_timeout) -> ClientTimeout:
+        return ClientTimeout(connect=self.connect_timeout, sock_read=read_timeout)
+
+    def _session(self) -> RetryClient:
+        if self.session is None:
+            self.session = RetryClient(client_session=ClientSession(
+                connector=TCPConnector(limit=self.pool_size, keepalive_timeout=self.keepalive),
+                timeout=self._client_timeout(self.timeout),
+            ))
+
+        return self.session
+
+    async def request(self, method, url, params=None, data=None, headers=None, auth=None, timeout=None,
+                      allow_redirects=False) -> Response:
+        method = method.upper()
+        kwargs = {
+            'method': method,
+            'url': url,
+            'params': params,
+            'data': data,
+            'headers': headers,
+            'auth': BasicAuth(*auth) if auth else None,
+            'allow_redirects': allow_redirects,
+        }
+
+        self.log_request(kwargs)
+
+        if timeout is not None:
+            kwargs['timeout'] = self._client_timeout(timeout)
+
+        retry_options = self.retry_options.get(method, self.retry_options['POST'])
+
+        async with self._session().request(retry_options=retry_options, **kwargs) as response:
+            text = await response.text()
+
+        self.log_response(response.status, response)
+
+        return Response(response.status, text, response.headers)
+
+
+class TwilioGateway:
+    """
+    The one Twilio client of a process. Requests run on a private event loop
+    in a background thread, so sync code (views, dispatcher workers) and
+    async views share one pool of keep-alive connections.
+
+    Every call gives up after `deadline` seconds, retries included.
+    """
+
+    def __init__(self, account_sid, auth_token, connect_timeout, read_timeout, max_retries, pool_size, keepalive,
+                 deadline):
+        self.account_sid = account_sid
+        self.auth_token = auth_token
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.pool_size = pool_size
+        self.keepalive = keepalive
+        self.deadline = deadline
+
+        self.client = None
+        self._loop = None
+        self._pid = None
+        self._lock = Lock()
+
+    def _start(self):
+        # the loop thread doesn't survive a fork, so each process starts its own
+        with self._lock:
+            if self._pid == os.getpid():
+                return
+
+            http_client = TwilioHttpClient(
+                connect_timeout=self.connect_timeout,
+                read_timeout=self.read_timeout,
+                max_retries=self.max_retries,
+                pool_size=self.pool_size,
+                keepalive=self.keepalive,
+            )
+
+            self.client = Client(self.account_sid, self.auth_token, http_client=http_client)
+            self._loop = asyncio.new_event_loop()
+            Thread(target=self._loop.run_forever, name='twilio-gateway', daemon=True).start()
+            self._pid = os.getpid()
+
+    def submit(self, name, function, *args, **kwargs):
+        """
+        Start `function(client, *args, **kwargs)`, a coroutine function, on
+        the gateway's loop and return a concurrent.futures.Future.
+        """
+        if self._pid != os.getpid():
+            self._start()
+
+        return asyncio.run_coroutine_threadsafe(self._observe(name, function, *args, **kwargs), self._loop)
+
+    async def _observe(self, name, function, *args, **kwargs):
+        start = time.monotonic()
+
+        try:
+            return await asyncio.wait_for(function(self.client, *args, **kwargs), self.deadline)
+        except Exception:
+            metrics.counter(f'twilio.{name}.failed').inc()
+            raise
+        finally:
+            metrics.summary(f'twilio.{name}_seconds').observe(time.monotonic() - start)
+
+    def run(self, name, function, *args, **kwargs):
+        future = self.submit(name, function, *args, **kwargs)
+
+        try:
+            # the loop enforces the deadline, this only guards against a stuck loop
+            return future.result(self.deadline + 1)
+        except FutureTimeoutError:
+            future.cancel()
+            raise
+
+    async def arun(self, name, function, *args, **kwargs):
+        return await asyncio.wrap_future(self.submit(name, function, *args, **kwargs))
+
+    def close(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                return
+
+            if self.client.http_client.session is not None:
+                asyncio.run_coroutine_threadsafe(self.client.http_client.close(), self._loop).result(self.deadline)
+
+            self._loop.call_soon_threadsafe(self._loop.stop)
+            self._pid = None
+
+    def lookup(self, phone):
+        return self.run('lookup', _lookup, phone)
+
+    async def alookup(self, phone):
+        return await self.arun('lookup', _lookup, phone)
+
+    def send_sms(self, to, body):
+        return self.run('sms', _send_sms, to, body)
+
+    async def asend_sms(self, to, body):
+        return await self.arun('sms', _send_sms, to, body)
+
+    def place_call(self, to, twiml):
+        return self.run('voice', _place_call, to, twiml)
+
+    async def aplace_call(self, to, twiml):
+        return await self.arun('voice', _place_call, to, twiml)
+
+
+async def _lookup(client, phone):
+    return await client.lookups.v2.phone_numbers(phone).fetch_async()
+
+
+async def _send_sms(client, to, body):
+    return await client.messages.create_async(body=body, from_=settings.TWILIO_PHONE_NUMBER, to=to)
+
+
+async def _place_call(client, to, twiml):
+    return await client.calls.create_async(twiml=twiml, from_=settings.TWILIO_PHONE_NUMBER, to=to)
+
+
+gateway = TwilioGateway(
+    account_sid=settings.TWILIO_ACCOUNT_SID,
+    auth_token=settings.TWILIO_AUTH_TOKEN,
+    connect_timeout=settings.TWILIO_CONNECT_TIMEOUT,
+    read_timeout=settings.TWILIO_READ_TIMEOUT,
+    max_retries=settings.TWILIO_MAX_RETRIES,
+    pool_size=settings.TWILIO_POOL_SIZE,
+    keepalive=settings.TWILIO_KEEPALIVE,
+    deadline=settings.TWILIO_DEADLINE,
+)
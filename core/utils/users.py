@@ -2,21 +2,64 @@ import random
 import uuid
 from django.conf import settings
 
-from .tasks import client
+from .phones import InvalidPhoneNumber, to_e164
 
 def generate_sms_code () -> str:
     return ''.join([str(random.randint(0, 9)) for i in range(settings.SMS_CODE_LENGTH)])
 
 
-def normalize_phone_number (phone: str) -> str:
-    return phone.replace(' ', '').replace('-', '').replace('(', '').replace(')', '')
+def normalize_phone_number (phone: str, country_code: str = None) -> str:
+    """
+    `phone` in E.164 form, or None if it isn't a valid phone number. See
+    core/utils/phones.py for `country_code`.
+    """
+    try:
+        return to_e164(phone, country_code)
+    except InvalidPhoneNumber:
+        return None
+
+
+def normalize_email_lookup (email: str) -> str:
+    """
+    The form of an email address that lookups compare against, see
+    `User.email_normalized`.
+    """
+    if not email:
+        return None
+
+    return email.strip().lower() or None
+
+
+def normalize_phone_lookup (phone: str, country_code: str = None) -> str:
+    """
+    The form of a phone number that lookups compare against, see
+    `User.phone_normalized`. Numbers that don't parse, saved before phone
+    numbers were validated, keep their old form: stripped of formatting.
+    """
+    if not phone:
+        return None
+
+    return (
+        normalize_phone_number(phone, country_code)
+        or phone.strip().replace(' ', '').replace('-', '').replace('(', '').replace(')', '')
+        or None
+    )
 
 
 def generate_email_verification_token() -> str:
     return str(uuid.uuid4())
 
 
-def phone_number_is_valid(phone: str) -> (bool, str):
-    look_up = client.lookups.v2.phone_numbers(phone).fetch()
+def phone_number_is_valid(phone: str, country_code: str = None) -> (bool, str):
+    phone = normalize_phone_number(phone, country_code)
+
+    if not phone:
+        return (False, None)
+
+    if not settings.PHONE_LOOKUP_VERIFY:
+        return (True, phone)
+
+    # cached, see core/utils/lookups.py
+    from .lookups import phone_lookups
 
-    return (look_up.valid, look_up.phone_number)
\ No newline at end of file
+    return phone_lookups.lookup(phone)
\ No newline at end of file
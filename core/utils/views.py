@@ -0,0 +1,84 @@
+import asyncio
+import sys
+from functools import wraps
+
+from asgiref.sync import markcoroutinefunction, sync_to_async
+
+from rest_framework.views import APIView
+from silk.profiling.profiler import silk_profile
+
+
+class AsyncAPIView(APIView):
+    """
+    APIView for `async def` handlers.
+
+    DRF's dispatch is synchronous, so this one runs authentication,
+    permission and throttling checks on Django's sync thread and awaits the
+    handler on the event loop. Handlers must not use the sync ORM or other
+    blocking calls directly; use the async ORM or `sync_to_async` instead.
+
+    Sync handlers (such as the default `options`) still work.
+    """
+
+    @classmethod
+    def as_view(cls, **initkwargs):
+        view = super().as_view(**initkwargs)
+
+        # DRF wraps the view in csrf_exempt, which in Django 4.2 returns a
+        # plain function; make sure Django still awaits it
+        return markcoroutinefunction(view)
+
+    async def dispatch(self, request, *args, **kwargs):
+        self.args = args
+        self.kwargs = kwargs
+        request = self.initialize_request(request, *args, **kwargs)
+        self.request = request
+        self.headers = self.default_response_headers
+
+        try:
+            # authenticators and permissions may hit the database
+            await sync_to_async(self.initial)(request, *args, **kwargs)
+
+            if request.method.lower() in self.http_method_names:
+                handler = getattr(self, request.method.lower(), self.http_method_not_allowed)
+            else:
+                handler = self.http_method_not_allowed
+
+            response = handler(request, *args, **kwargs)
+
+            if asyncio.iscoroutine(response):
+                response = await response
+
+        except Exception as exc:
+            response = self.handle_exception(exc)
+
+        self.response = self.finalize_response(request, response, *args, **kwargs)
+        return self.response
+
+
+def silk_profile_async(name):
+    """
+    `silk_profile` for `async def` handlers, which it would otherwise time
+    only up to creating the coroutine. Silk keeps a request's profiles on
+    the thread its middleware runs on, so the profile is opened and closed
+    on that thread and the queries run through `sync_to_async` are counted.
+    """
+    def decorator(handler):
+        @wraps(handler)
+        async def wrapper(*args, **kwargs):
+            profile = silk_profile(name=name)
+            exc_info = (None, None, None)
+
+            await sync_to_async(profile.__enter__)()
+
+            try:
+                return await handler(*args, **kwargs)
+            except BaseException:
+                exc_info = sys.exc_info()
+                raise
+            finally:
+                await sync_to_async(profile.__exit__)(*exc_info)
+
+        return wrapper
+
+    return decorator
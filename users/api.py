@@ -1,4 +1,8 @@
+import hashlib
+import json
+
 from django.conf import settings
+from django.db import transaction
 from django.utils import timezone
 
 from rest_framework.views import APIView
@@ -11,14 +15,19 @@ from core.utils.http import (
 
 from rest_framework.permissions import (
     AllowAny,
+    IsAdminUser,
     IsAuthenticated,
 )
 
-import asyncio
+from asgiref.sync import sync_to_async
 
 from rest_framework.response import Response
 from rest_framework import status
-from django.views.decorators.cache import cache_page, never_cache
+from django.views.decorators.cache import never_cache
+from django.core.cache import caches
+from django.core.handlers.asgi import ASGIRequest
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import patch_cache_control
 from django.utils.decorators import method_decorator
 
 from dj_rest_auth.registration.views import SocialLoginView
@@ -28,35 +37,54 @@ from allauth.account.models import EmailAddress
 
 from silk.profiling.profiler import silk_profile
 
-from rest_framework_simplejwt.tokens import RefreshToken
+from core.utils.tokens import (
+    RefreshToken,
+    token_backend,
+)
+
+from core.utils.authentication import bump_auth_version
+from core.utils.conditional import conditional, table_versions
+from core.utils.existence import existence_index
+from core.utils.idempotency import idempotent
+from core.utils.metrics import metrics
+from core.utils.pagination import KeysetPagination
+from core.utils.renderers import CustomJSONRenderer, fragment
+from core.utils.serializers import compile_serializer
+from core.utils.otp import ATTEMPTS_EXCEEDED, VALID, otp_store
+
+from core.utils.dispatch import DispatchUnavailable
+from core.utils.views import AsyncAPIView, silk_profile_async
 
 from core.utils.tasks import (
-    send_email,
     send_phone_code,
     call_phone_with_code,
 )
 
 from .models import (
     User,
-    PhoneToken,
     EmailVerificationToken,
 )
 
 from core.utils.users import (
     generate_sms_code,
     generate_email_verification_token,
+    normalize_phone_lookup,
 )
 
+from . import export
+from .outbox import enqueue_email
+
 from .schemas.registration import (
     EmailRegistrationSchema,
     PhoneRegistrationSchema,
 )
 
 from .schemas.validation import (
-    EmailLoginSchema,
+    EmailLoginBodySchema,
     SendOTPBodySchema,
     OTPVerifyBodySchema,
     NormalizePhoneSchema,
+    UserExportQuerySchema,
 )
 
 from .schemas.serializers import (
@@ -65,6 +93,54 @@ from .schemas.serializers import (
 
 from allauth.account.models import EmailAddress
 
+users_pagination = KeysetPagination(
+    page_size=settings.USERS_PAGE_SIZE,
+    max_page_size=settings.USERS_MAX_PAGE_SIZE,
+)
+
+users_pages = caches['tiered']
+
+
+def users_etag(request, *args, **kwargs):
+    # changes whenever any user is saved or deleted (see users/signals.py)
+    return f'users-{table_versions.get(User)}'
+
+
+def jwks_etag(request, *args, **kwargs):
+    return token_backend.keyring.jwks_etag()
+
+
+@transaction.atomic
+def register_user(serializer, send_verification_email, **fields):
+    """
+    Save the user with any extra `fields`, and queue its verification email
+    in the same transaction, so the email goes out if and only if the user
+    was created.
+    """
+    user = serializer.save()
+
+    if fields:
+        for field, value in fields.items():
+            setattr(user, field, value)
+
+        user.save(update_fields=list(fields))
+
+    if send_verification_email:
+        email_verification_token = generate_email_verification_token()
+
+        EmailVerificationToken.objects.create(
+            token=email_verification_token,
+            user=user,
+        )
+
+        enqueue_email(
+            subject='Welcome to Reservation App!',
+            html_content=f'<h1>Welcome to Reservation App!</h1><p>Thank you for registering with us!</p> <p>Please verify your email by clicking <a href="{settings.VERIFY_EMAIL_URL}?token={email_verification_token}">here</a>.</p>',
+            recipient_list=[user.email,],
+        )
+
+    return user
+
 
 class GoogleLoginView(SocialLoginView):
     adapter_class = GoogleOAuth2Adapter
@@ -72,14 +148,15 @@ class GoogleLoginView(SocialLoginView):
     client_class = OAuth2Client
 
 
-class EmailRegisterView(APIView):
+class EmailRegisterView(AsyncAPIView):
     serializer_class = EmailRegistrationSchema
     permission_classes = [AllowAny,]
 
-    def post(self, request, *args, **kwargs):
+    @idempotent
+    async def post(self, request, *args, **kwargs):
         serializer = EmailRegistrationSchema(data=request.data)
 
-        is_valid = serializer.is_valid()
+        is_valid = await sync_to_async(serializer.is_valid)()
 
         if not is_valid:
             return generate_error_response({
@@ -88,31 +165,17 @@ class EmailRegisterView(APIView):
                 "message": "Bad request",
             })
         
-        serializer.save()
-
-        # send email verification token
-
-        if (settings.SEND_EMAIL_VERIFICATION):
-
-            email_verification_token = generate_email_verification_token()
-
-            asyncio.run(EmailVerificationToken.objects.acreate(
-                token=email_verification_token,
-                user=serializer.instance,
-            ))
-            
-            send_email(
-                subject='Welcome to Reservation App!',
-                html_content=f'<h1>Welcome to Reservation App!</h1><p>Thank you for registering with us!</p> <p>Please verify your email by clicking <a href="{settings.VERIFY_EMAIL_URL}?token={email_verification_token}">here</a>.</p>',
-                recipient_list=[serializer.instance.email,],
-            )
+        await sync_to_async(register_user)(
+            serializer,
+            send_verification_email=settings.SEND_EMAIL_VERIFICATION,
+        )
 
         if serializer.instance:
             return generate_success_response({
                 "detail": "User created successfully.",
                 "status": 201,
                 "data": {
-                    "user": UserSerializer(serializer.instance).data,
+                    "user": compile_serializer(UserSerializer).from_instance(serializer.instance),
                 }
             })
         
@@ -122,14 +185,13 @@ class EmailRegisterView(APIView):
             "errors": serializer.errors,
         })
     
-class EmailLoginView(APIView):
+class EmailLoginView(AsyncAPIView):
     permission_classes = [AllowAny,]
-    serializer_class = EmailLoginSchema
+    serializer_class = EmailLoginBodySchema
 
-    @silk_profile(name='EmailVerifyView.post')
-    @method_decorator(cache_page(60*60*2))
-    def post(self, request, *args, **kwargs):
-        serializer = EmailLoginSchema(data=request.data)
+    @silk_profile_async(name='EmailVerifyView.post')
+    async def post(self, request, *args, **kwargs):
+        serializer = EmailLoginBodySchema(data=request.data)
         is_valid = serializer.is_valid()
 
         if (not is_valid):
@@ -139,11 +201,11 @@ class EmailLoginView(APIView):
             "detail": "Bad email or password.",
         })
         
-        # the user is authenticated at this point
+        user = await serializer.aget_user()
 
-        if serializer.validated_data['user']:
+        if user:
 
-            refresh = RefreshToken.for_user(serializer.validated_data['user'])
+            refresh = await sync_to_async(RefreshToken.for_user)(user)
             return Response({
                 "detail": {
                     "refresh": str(refresh),
@@ -162,27 +224,74 @@ class GetAllUsers(APIView):
     permission_classes = [AllowAny,]
 
     #@silk_profile(name='GetAllUsers.get')
-    @method_decorator(cache_page(60*60*2))
+    @conditional(users_etag)
     def get(self, request, *args, **kwargs):
+        page_size = users_pagination.get_page_size(request)
+        cursor = request.query_params.get(users_pagination.cursor_param, '')
+
+        # pages are rendered once per users version, then served from the cache
+        key = 'users:page:' + hashlib.sha256(f'{table_versions.get(User)}:{page_size}:{cursor}'.encode()).hexdigest()
+        page = users_pages.get_or_compute(key, lambda: self.render_page(request), settings.USERS_PAGE_CACHE_TIMEOUT)
 
-        users = User.objects.all()
-        serialized_users = UserSerializer(users, many=True)
+        if not isinstance(request.accepted_renderer, CustomJSONRenderer):
+            page = json.loads(page.content)
 
         return generate_success_response({
-            "data": serialized_users.data,
+            "data": page,
             "status": 200,
         })
+
+    def render_page(self, request):
+        # plain dicts with the serializer's fields, a page at a time
+        user_serializer = compile_serializer(UserSerializer)
+        users, next_cursor = users_pagination.paginate(
+            User.objects.values(*user_serializer.fields),
+            request,
+        )
+
+        return fragment({
+            "results": user_serializer.rows(users),
+            "next": next_cursor,
+        })
+
+class ExportUsersView(APIView):
+    """
+    Streams users as NDJSON or CSV (?output=), with optional ?fields= and
+    id_after/id_before and joined_after/joined_before ranges, for data
+    pipelines. Memory use stays flat however many users there are.
+    """
+    permission_classes = [IsAdminUser,]
+
+    def get(self, request, *args, **kwargs):
+        query = UserExportQuerySchema(data=request.query_params)
+        query.is_valid(raise_exception=True)
+
+        params = query.validated_data
+        output = params.pop('output')
+        fields = params.pop('fields', export.FIELDS)
+
+        queryset = export.export_queryset(fields, **params)
+
+        if isinstance(request._request, ASGIRequest):
+            chunks = export.aexport_chunks(queryset, fields, output)
+        else:
+            chunks = export.export_chunks(queryset, fields, output)
+
+        response = StreamingHttpResponse(chunks, content_type=export.FORMATS[output])
+        response['Content-Disposition'] = f'attachment; filename="users.{output}"'
+
+        return response
     
-class PhoneRegisterView(APIView):
+class PhoneRegisterView(AsyncAPIView):
     permission_classes = [AllowAny,]
     serializer_class = PhoneRegistrationSchema
 
     #@silk_profile(name='PhoneRegisterView.post')
-    @method_decorator(cache_page(60*60*2))
-    def post(self, request, *args, **kwargs):
+    @idempotent
+    async def post(self, request, *args, **kwargs):
         serializer = PhoneRegistrationSchema(data=request.data)
 
-        is_valid = serializer.is_valid()
+        is_valid = await sync_to_async(serializer.is_valid)()
 
         if not is_valid:
             return generate_error_response({
@@ -191,28 +300,14 @@ class PhoneRegisterView(APIView):
                 "detail": serializer.errors,
             })
         
-        serializer.save()
-
-        # send email verification token
-
-        email_verification_token = generate_email_verification_token()
-
-        asyncio.run(EmailVerificationToken.objects.acreate(
-            token=email_verification_token,
-            user=serializer.instance,
-        ))
-        
-        send_email(
-            subject='Welcome to Reservation App!',
-            html_content=f'<h1>Welcome to Reservation App!</h1><p>Thank you for registering with us!</p> <p>Please verify your email by clicking <a href="{settings.VERIFY_EMAIL_URL}?token={email_verification_token}">here</a>.</p>',
-            recipient_list=[serializer.instance.email,],
+        await sync_to_async(register_user)(
+            serializer,
+            send_verification_email=True,
+            phone_verified=True,
+            phone_verified_at=timezone.now(),
         )
 
         if serializer.instance:
-            serializer.instance.phone_verified = True
-            serializer.instance.phone_verified_at = timezone.now()
-
-            asyncio.run(serializer.instance.asave())
             return generate_success_response({
                 "detail": "User created successfully.",
                 "status": 201,
@@ -220,19 +315,22 @@ class PhoneRegisterView(APIView):
         
         return Response(None, status=status.HTTP_400_BAD_REQUEST)
     
-class PhoneVerifyView(APIView):
+class PhoneVerifyView(AsyncAPIView):
     permission_classes = [AllowAny,]
     serializer_class = OTPVerifyBodySchema
 
     #@silk_profile(name='PhoneLoginView.post')
-    @method_decorator(cache_page(60*60*2))
-    def post(self, request, *args, **kwargs):
+    async def post(self, request, *args, **kwargs):
         serializer = OTPVerifyBodySchema(data=request.data)
-        serializer.is_valid(raise_exception=True)
+
+        # validating may look the phone number up in the database (see
+        # core/utils/lookups.py), so it runs on the thread whose connections
+        # Django closes at the end of the request
+        await sync_to_async(serializer.is_valid)(raise_exception=True)
 
         # ensure that user exists
 
-        user = User.objects.filter(phone=serializer.data.get('phone')).first()
+        user = await User.objects.filter(phone_normalized=normalize_phone_lookup(serializer.data.get('phone'))).afirst()
 
         if not user:
             return generate_error_response({
@@ -241,46 +339,23 @@ class PhoneVerifyView(APIView):
                 "detail": "User does not exist.",
             })
         
-        phone_token = PhoneToken.objects.filter(
-            phone=serializer.data.get('phone'),
-            expires_at__gte=timezone.now(),
-        ).first()
+        result = await otp_store.averify(serializer.data.get('phone'), serializer.data.get('token'))
 
-        if not phone_token:
+        if result == ATTEMPTS_EXCEEDED:
             return generate_error_response({
-                "error_type": "invalid_token",
+                "error_type": "token_attempts_exceeded",
                 "status": 400,
-                "detail": "The provided token is not valid!",
+                "detail": "The provided token attempts exceeded!",
             })
-        
-        otps_match = phone_token.token == serializer.data.get('token')
-
-        if not otps_match:
-            if (phone_token.attempts + 1) >= settings.SMS_CODE_MAXIMUM_ATTEMPTS:
-                phone_token.delete()
-
-                return generate_error_response({
-                    "error_type": "token_attempts_exceeded",
-                    "status": 400,
-                    "detail": "The provided token attempts exceeded!",
-                })
-            
-            phone_token.attempts += 1
-            phone_token.save()
 
+        if result != VALID:
             return generate_error_response({
                 "error_type": "invalid_token",
                 "status": 400,
                 "detail": "The provided token is not valid!",
             })
 
-        # delete all previous tokens for this phone number
-
-        PhoneToken.objects.filter(
-            phone=serializer.data.get('phone'),
-        ).delete()
-
-        refresh = RefreshToken.for_user(user)
+        refresh = await sync_to_async(RefreshToken.for_user)(user)
 
         return generate_success_response({
             "detail": {
@@ -289,8 +364,9 @@ class PhoneVerifyView(APIView):
             }
         })
         
-class EmailExistsView(APIView):
-    def get(self, request, email=None):
+class EmailExistsView(AsyncAPIView):
+    @conditional(users_etag)
+    async def get(self, request, email=None):
         if not email:
             return generate_error_response({
                 "error_type": "invalid_request",
@@ -301,7 +377,7 @@ class EmailExistsView(APIView):
             })
         
         if email:
-            if User.objects.filter(email=email).exists():
+            if await sync_to_async(existence_index.email_exists)(email):
                 return generate_success_response({
                     "detail": {
                         "exists": True,
@@ -316,9 +392,21 @@ class EmailExistsView(APIView):
         else:
             return Response(None, status=status.HTTP_400_BAD_REQUEST)
     
-class PhoneExistsView(APIView):
-    def post(self, request):
-        serializer = NormalizePhoneSchema(data=request.data)
+class PhoneExistsView(AsyncAPIView):
+    """
+    Whether a phone number is registered: GET with ?phone= (conditional, so
+    pollers can send If-None-Match), or POST with a JSON body.
+    """
+
+    @conditional(users_etag)
+    async def get(self, request):
+        return await self.phone_exists(request.query_params)
+
+    async def post(self, request):
+        return await self.phone_exists(request.data)
+
+    async def phone_exists(self, data):
+        serializer = NormalizePhoneSchema(data=data)
 
         if not serializer.is_valid():
             return generate_error_response({
@@ -329,7 +417,7 @@ class PhoneExistsView(APIView):
         
         phone = serializer.data.get('phone')
 
-        if User.objects.filter(phone=phone).exists():
+        if await sync_to_async(existence_index.phone_exists)(phone):
             return generate_success_response({
                 "detail": {
                     "exists": True,
@@ -342,14 +430,17 @@ class PhoneExistsView(APIView):
                 }
             })
         
-class SendPhoneSMSVerificationView(APIView):
+class SendPhoneSMSVerificationView(AsyncAPIView):
     permission_classes = [AllowAny,]
 
-    @method_decorator(cache_page(60*60*2))
-    def post(self, request):
+    @idempotent
+    async def post(self, request):
         serializer = SendOTPBodySchema(data=request.data)
 
-        if not serializer.is_valid():
+        # validating may look the phone number up in the database (see
+        # core/utils/lookups.py), so it runs on the thread whose connections
+        # Django closes at the end of the request
+        if not await sync_to_async(serializer.is_valid)():
             return generate_error_response({
                 "error_type": "invalid_request",
                 "status": 400,
@@ -358,22 +449,16 @@ class SendPhoneSMSVerificationView(APIView):
         
         code = generate_sms_code()
 
-        # delete all previous tokens for this phone number
-
-        asyncio.run(PhoneToken.objects.filter(
-            phone=serializer.data.get('phone'),
-        ).adelete())
-
-        asyncio.run(PhoneToken.objects.acreate(
-            phone=serializer.data.get('phone'),
-            token=code,
-        ))
+        # replaces any previous code for this phone number
+        await otp_store.aissue(serializer.data.get('phone'), code)
         
         try:
             send_phone_code(
             phone=serializer.data.get('phone'),
             code=code,
         )
+        except DispatchUnavailable:
+            raise
         except:
             return generate_error_response({
                 "error_type": "invalid_request",
@@ -386,43 +471,29 @@ class SendPhoneSMSVerificationView(APIView):
             "detail": "SMS sent successfully.",
         })
     
-class PhoneSMSVerifyView(APIView):
+class PhoneSMSVerifyView(AsyncAPIView):
     permission_classes = [AllowAny,]
 
     #@silk_profile(name='PhoneSMSVerifyView.post')
-    @method_decorator(cache_page(60*60*2))
-    def post(self, request):
+    @idempotent
+    async def post(self, request):
         serializer = OTPVerifyBodySchema(data=request.data)
 
-        serializer.is_valid(raise_exception=True)
+        # validating may look the phone number up in the database (see
+        # core/utils/lookups.py), so it runs on the thread whose connections
+        # Django closes at the end of the request
+        await sync_to_async(serializer.is_valid)(raise_exception=True)
         
-        phone_token = PhoneToken.objects.filter(
-            phone=serializer.data.get('phone'),
-            expires_at__gte=timezone.now(),
-        ).first()
+        result = await otp_store.averify(serializer.data.get('phone'), serializer.data.get('token'))
 
-        if not phone_token:
+        if result == ATTEMPTS_EXCEEDED:
             return generate_error_response({
-                "error_type": "invalid_token",
+                "error_type": "token_attempts_exceeded",
                 "status": 400,
-                "detail": "The provided token is not valid!",
+                "detail": "The provided token attempts exceeded!",
             })
-        
-        otps_match = phone_token.token == serializer.data.get('token')
-
-        if not otps_match:
-            if (phone_token.attempts + 1) >= settings.SMS_CODE_MAXIMUM_ATTEMPTS:
-                phone_token.delete()
-
-                return generate_error_response({
-                    "error_type": "token_attempts_exceeded",
-                    "status": 400,
-                    "detail": "The provided token attempts exceeded!",
-                })
-            
-            phone_token.attempts += 1
-            phone_token.save()
 
+        if result != VALID:
             return generate_error_response({
                 "error_type": "invalid_token",
                 "status": 400,
@@ -433,6 +504,7 @@ class PhoneSMSVerifyView(APIView):
             "detail": "SMS sent successfully.",
         })
     
+# Stays synchronous, transaction.atomic can't be used from async code.
 class VerifyEmailView(APIView):
     def get(self, request):
         token = request.GET.get('token')
@@ -457,70 +529,76 @@ class VerifyEmailView(APIView):
                 "message": "The provided token is not valid!",
             })
         
-        email_verification_token = EmailVerificationToken.objects.filter(
-            token=token,
-            expires_at__gte=timezone.now(),
-        ).first()
-
-        if not email_verification_token:
-            return generate_error_response({
-                "error_type": "invalid_token",
-                "status": 400,
-                "detail": "The provided token is not valid!",
-            })
-        
-        user = email_verification_token.user
-
-        if user.email_verified:
-            return generate_error_response({
-                "error_type": "invalid_request",
-                "status": 400,
-                "detail": "Email is already verified.",
-            })
-
-        user.email_verified = True
-        user.email_verified_at = timezone.now()
+        with transaction.atomic():
+            email_verification_token = EmailVerificationToken.objects.select_related(
+                'user',
+            ).filter(
+                token=token,
+                expires_at__gte=timezone.now(),
+            ).first()
+
+            if not email_verification_token:
+                return generate_error_response({
+                    "error_type": "invalid_token",
+                    "status": 400,
+                    "detail": "The provided token is not valid!",
+                })
 
-        email_address = EmailAddress.objects.filter(
-            email=user.email,
-        ).first()
+            user = email_verification_token.user
 
-        if not email_address:
-            email_address = EmailAddress.objects.create(
-                user=user,
-                email=user.email,
-                verified=True,
-                primary=True,
+            # only one of several concurrent requests gets to verify
+            verified = User.objects.filter(
+                id=user.id,
+                email_verified=False,
+            ).update(
+                email_verified=True,
+                email_verified_at=timezone.now(),
             )
 
-        email_address.verified = True
-        email_address.save()
+            if not verified:
+                return generate_error_response({
+                    "error_type": "invalid_request",
+                    "status": 400,
+                    "detail": "Email is already verified.",
+                })
+
+            # delete all other users with this email, none of them verified it
 
-        # delete all users with this email that are not verified
+            User.objects.exclude(
+                id=user.id,
+            ).filter(
+                email_normalized=user.email_normalized,
+            ).delete()
 
-        user.save()
+            EmailAddress.objects.bulk_create(
+                [EmailAddress(user=user, email=user.email, verified=True, primary=True)],
+                update_conflicts=True,
+                unique_fields=['user', 'email'],
+                update_fields=['verified'],
+            )
 
-        asyncio.run(User.objects.exclude(
-            id=user.id,
-        ).filter(
-            email=user.email,
-        ).adelete())
+            # the user's other pending tokens are of no use anymore either
+            EmailVerificationToken.objects.filter(user=user).delete()
 
-        asyncio.run(email_verification_token.adelete())
+            # update() sends no post_save, so drop cached copies of the user here
+            transaction.on_commit(lambda: bump_auth_version(user.id))
 
         return generate_success_response({
             "message": "Email verified successfully.",
         })
     
-class CallUserWithCodeView(APIView):
+class CallUserWithCodeView(AsyncAPIView):
     permission_classes = [AllowAny,]
 
     #@silk_profile(name='CallUserWithCodeView.post')
-    @method_decorator(cache_page(60*60*2))
-    def post(self, request):
+    @idempotent
+    async def post(self, request):
         serializer = SendOTPBodySchema(data=request.data)
 
-        if not serializer.is_valid():
+        # validating may look the phone number up in the database (see
+        # core/utils/lookups.py), so it runs on the thread whose connections
+        # Django closes at the end of the request
+        if not await sync_to_async(serializer.is_valid)():
             return generate_error_response({
                 "error_type": "invalid_request",
                 "status": 400,
@@ -533,16 +611,8 @@ class CallUserWithCodeView(APIView):
 
         code = generate_sms_code()
 
-        # delete all previous tokens for this phone number
-
-        asyncio.run(PhoneToken.objects.filter(
-            phone=phone,
-        ).adelete())
-
-        asyncio.run(PhoneToken.objects.acreate(
-            phone=phone,
-            token=code,
-        ))
+        # replaces any previous code for this phone number
+        await otp_store.aissue(phone, code)
         
         call_phone_with_code(
             phone=phone,
@@ -551,4 +621,28 @@ class CallUserWithCodeView(APIView):
 
         return generate_success_response({
             "detail": "SMS sent successfully.",
-        })
\ No newline at end of file
+        })
+
+class JWKSView(APIView):
+    authentication_classes = []
+    permission_classes = [AllowAny,]
+
+    @conditional(jwks_etag)
+    def get(self, request):
+        return HttpResponse(token_backend.keyring.jwks(), content_type='application/json')
+
+    def finalize_response(self, request, response, *args, **kwargs):
+        # verifiers refetch on unknown kids, so the key set can be cached for
+        # a while; 304s carry it too, to keep a revalidated copy fresh
+        patch_cache_control(response, public=True, max_age=settings.JWT_JWKS_MAX_AGE)
+
+        return super().finalize_response(request, response, *args, **kwargs)
+
+class MetricsView(APIView):
+    permission_classes = [IsAdminUser,]
+
+    def get(self, request):
+        return generate_success_response({
+            "data": metrics.snapshot(),
+            "status": 200,
+        })
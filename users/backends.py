@@ -1,6 +1,9 @@
 from django.contrib.auth import get_user_model
 from django.contrib.auth.backends import ModelBackend
 
+from core.utils.passwords import verify_password
+from core.utils.users import normalize_email_lookup, normalize_phone_lookup
+
 class EmailBackend(ModelBackend):
     def authenticate(self, request, password=None, email=None, **kwargs):
 
@@ -11,14 +14,10 @@ class EmailBackend(ModelBackend):
         
         UserModel = get_user_model()
         
-        try:
-            user = UserModel.objects.get(email=email)
-        except UserModel.DoesNotExist:
-            return None
-        
-        else:
-            if user.check_password(password):
-                return user
+        user = UserModel.objects.filter(email_normalized=normalize_email_lookup(email)).first()
+
+        if user and verify_password(user, password):
+            return user
         return None
     
     def get_user(self, user_id):
@@ -34,13 +33,10 @@ class PhoneBackend(ModelBackend):
             return None
         
         UserModel = get_user_model()
-        try:
-            user = UserModel.objects.get(phone=phone)
-        except UserModel.DoesNotExist:
-            return None
-        else:
-            if user.check_password(password):
-                return user
+        user = UserModel.objects.filter(phone_normalized=normalize_phone_lookup(phone)).first()
+
+        if user and verify_password(user, password):
+            return user
         return None
     
     def get_user(self, user_id):
@@ -0,0 +1,89 @@
+import csv
+import io
+import json
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+
+from .formats import CSV, FIELDS, FORMATS, NDJSON
+from .models import User
+
+
+def export_queryset(fields=FIELDS, id_after=None, id_before=None, joined_after=None, joined_before=None):
+    users = User.objects.order_by('id')
+
+    if id_after is not None:
+        users = users.filter(id__gt=id_after)
+    if id_before is not None:
+        users = users.filter(id__lt=id_before)
+    if joined_after is not None:
+        users = users.filter(date_joined__gte=joined_after)
+    if joined_before is not None:
+        users = users.filter(date_joined__lt=joined_before)
+
+    return users.values_list(*fields)
+
+
+def _batches(rows, size):
+    batch = []
+
+    for row in rows:
+        batch.append(row)
+
+        if len(batch) == size:
+            yield batch
+            batch = []
+
+    if batch:
+        yield batch
+
+
+def export_chunks(queryset, fields, format, chunk_size=None):
+    """
+    The rows of `queryset` (a values_list of `fields`) encoded as `format`,
+    in chunks of `chunk_size` rows.
+
+    Rows are read through `.iterator()`, a server-side cursor on Postgres, so
+    memory use doesn't grow with the number of rows.
+    """
+    chunk_size = chunk_size or settings.USER_EXPORT_CHUNK_SIZE
+    rows = queryset.iterator(chunk_size=chunk_size)
+
+    if format == CSV:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(fields)
+
+        for batch in _batches(rows, chunk_size):
+            writer.writerows(batch)
+            yield buffer.getvalue().encode()
+
+            buffer.seek(0)
+            buffer.truncate()
+
+        # just the header when there are no rows
+        if buffer.tell():
+            yield buffer.getvalue().encode()
+    else:
+        encoder = DjangoJSONEncoder(separators=(',', ':'))
+
+        for batch in _batches(rows, chunk_size):
+            yield ''.join(encoder.encode(dict(zip(fields, row))) + '\n' for row in batch).encode()
+
+
+async def aexport_chunks(queryset, fields, format, chunk_size=None):
+    """
+    `export_chunks` for ASGI responses, which would otherwise read a sync
+    iterator to the end before sending anything.
+    """
+    chunks = export_chunks(queryset, fields, format, chunk_size)
+    next_chunk = sync_to_async(next)
+
+    while True:
+        chunk = await next_chunk(chunks, None)
+
+        if chunk is None:
+            break
+
+        yield chunk
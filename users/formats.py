@@ -0,0 +1,27 @@
+# The file formats and fields of user exports and imports, shared by
+# users/export.py, users/imports.py and the export query schema.
+
+NDJSON = 'ndjson'
+CSV = 'csv'
+
+FORMATS = {
+    NDJSON: 'application/x-ndjson',
+    CSV: 'text/csv',
+}
+
+# Fields that may be exported, in their default order. Never the password.
+FIELDS = (
+    'id',
+    'email',
+    'phone',
+    'country_code',
+    'first_name',
+    'last_name',
+    'birth_date',
+    'date_joined',
+    'is_active',
+    'email_verified',
+    'email_verified_at',
+    'phone_verified',
+    'phone_verified_at',
+)
@@ -0,0 +1,221 @@
+import csv
+import json
+import os
+
+from allauth.account.models import EmailAddress
+from django.contrib.auth.hashers import make_password
+from django.db import transaction
+from django.utils import timezone
+
+from core.utils.conditional import table_versions
+from core.utils.existence import existence_index
+from core.utils.passwords import hash_passwords
+from core.utils.users import normalize_email_lookup, normalize_phone_lookup
+
+from .formats import CSV, NDJSON
+from .models import User
+from .schemas.validation import UserImportSchema
+
+FORMATS = (NDJSON, CSV)
+
+
+def read_records(file, format):
+    """
+    Records from a text file as dicts, one per NDJSON line or CSV row. Empty
+    values count as missing. Lines that aren't JSON objects are passed on
+    as they are, to be rejected by validation.
+    """
+    rows = csv.DictReader(file) if format == CSV else _json_lines(file)
+
+    for row in rows:
+        if isinstance(row, dict):
+            row = {field: value for field, value in row.items() if value not in ('', None)}
+
+        yield row
+
+
+def _json_lines(file):
+    for line in file:
+        if not line.strip():
+            continue
+
+        try:
+            yield json.loads(line)
+        except ValueError:
+            yield line.rstrip('\n')
+
+
+class Checkpoint:
+    """
+    How many input records an import has finished with, in a JSON file
+    replaced atomically after every committed batch, so a rerun after a
+    crash picks up where the last batch left off. A batch committed just
+    before a crash is found again by the duplicate check and skipped.
+    """
+
+    def __init__(self, path):
+        self.path = path
+
+    def load(self) -> dict:
+        if not self.path or not os.path.exists(self.path):
+            return {'records': 0, 'imported': 0, 'skipped': 0, 'rejected': 0}
+
+        with open(self.path) as file:
+            return json.load(file)
+
+    def save(self, state):
+        if not self.path:
+            return
+
+        with open(f'{self.path}.tmp', 'w') as file:
+            json.dump(state, file)
+
+        os.replace(f'{self.path}.tmp', self.path)
+
+
+class UserImport:
+    """
+    Creates users in bulk from records (see `read_records`).
+
+    Each batch is validated and normalized, deduplicated by normalized email
+    and phone against the database and the records before it, has its
+    passwords hashed across `executor`'s processes, and is written with
+    bulk_create together with its allauth EmailAddress rows in one
+    transaction. bulk_create sends no signals, so the batch is then added to
+    the existence index and the users table version is bumped by hand.
+
+    `rejected` is called with (record number, record, errors) for every
+    record that fails validation.
+    """
+
+    def __init__(self, batch_size=1000, executor=None, checkpoint=None, rejected=None):
+        self.batch_size = batch_size
+        self.executor = executor
+        self.checkpoint = Checkpoint(checkpoint)
+        self.rejected = rejected
+
+        self.emails = set()
+        self.phones = set()
+
+    def run(self, records) -> dict:
+        state = self.checkpoint.load()
+        batch = []
+
+        for number, record in enumerate(records, start=1):
+            # finished by an earlier run
+            if number <= state['records']:
+                continue
+
+            batch.append((number, record))
+
+            if len(batch) == self.batch_size:
+                self.import_batch(batch, state)
+                batch = []
+
+        if batch:
+            self.import_batch(batch, state)
+
+        return state
+
+    def clean(self, batch, state) -> list:
+        cleaned = []
+
+        for number, record in batch:
+            schema = UserImportSchema(data=record)
+
+            if schema.is_valid():
+                cleaned.append(schema.validated_data)
+            else:
+                state['rejected'] += 1
+
+                if self.rejected:
+                    self.rejected(number, record, schema.errors)
+
+        return cleaned
+
+    def deduplicate(self, rows, state) -> list:
+        for row in rows:
+            row['email_normalized'] = normalize_email_lookup(row.get('email'))
+            row['phone_normalized'] = normalize_phone_lookup(row.get('phone'), row['country_code'])
+
+        emails = {row['email_normalized'] for row in rows if row['email_normalized']}
+        phones = {row['phone_normalized'] for row in rows if row['phone_normalized']}
+
+        taken_emails = set(User.objects.filter(email_normalized__in=emails).values_list('email_normalized', flat=True))
+        taken_phones = set(User.objects.filter(phone_normalized__in=phones).values_list('phone_normalized', flat=True))
+
+        unique = []
+
+        for row in rows:
+            email, phone = row['email_normalized'], row['phone_normalized']
+
+            if (
+                email and (email in taken_emails or email in self.emails)
+                or phone and (phone in taken_phones or phone in self.phones)
+            ):
+                state['skipped'] += 1
+                continue
+
+            if email:
+                self.emails.add(email)
+            if phone:
+                self.phones.add(phone)
+
+            unique.append(row)
+
+        return unique
+
+    def build_users(self, rows) -> list:
+        raw_passwords = [row['password'] for row in rows if row.get('password')]
+        hashed = iter(hash_passwords(raw_passwords, self.executor))
+        now = timezone.now()
+        users = []
+
+        for row in rows:
+            if row.get('password'):
+                password = next(hashed)
+            else:
+                # an unusable password unless one was given already hashed
+                password = row.get('password_hash') or make_password(None)
+
+            users.append(User(
+                email=row.get('email'),
+                email_normalized=row['email_normalized'],
+                phone=row.get('phone'),
+                phone_normalized=row['phone_normalized'],
+                country_code=row['country_code'],
+                first_name=row.get('first_name'),
+                last_name=row.get('last_name'),
+                birth_date=row.get('birth_date'),
+                date_joined=row.get('date_joined') or now,
+                is_active=row['is_active'],
+                email_verified=row['email_verified'],
+                email_verified_at=now if row['email_verified'] else None,
+                phone_verified=row['phone_verified'],
+                phone_verified_at=now if row['phone_verified'] else None,
+                password=password,
+            ))
+
+        return users
+
+    def import_batch(self, batch, state):
+        rows = self.deduplicate(self.clean(batch, state), state)
+        users = self.build_users(rows)
+
+        if users:
+            with transaction.atomic():
+                users = User.objects.bulk_create(users)
+
+                EmailAddress.objects.bulk_create([
+                    EmailAddress(user=user, email=user.email, verified=user.email_verified, primary=True)
+                    for user in users
+                    if user.email
+                ])
+
+                transaction.on_commit(lambda: table_versions.bump(User))
+
+            existence_index.add_many([(user.email_normalized, user.phone_normalized) for user in users])
+
+        state['records'] = batch[-1][0]
+        state['imported'] += len(users)
+        self.checkpoint.save(state)
@@ -0,0 +1,117 @@
+import copy
+import math
+import statistics
+import time
+
+from django.conf import settings
+from django.contrib.auth.hashers import get_hashers
+from django.core.management.base import BaseCommand
+
+# The cost parameters of each hasher, in the order they are tuned, with how
+# verify time grows with them and their lowest sensible value. Later
+# parameters are only touched when the earlier ones bottom out.
+cost_parameters = {
+    'argon2': [('time_cost', 'linear', 1), ('memory_cost', 'linear', 8 * 1024)],
+    'pbkdf2_sha256': [('iterations', 'linear', 10000)],
+    'pbkdf2_sha1': [('iterations', 'linear', 10000)],
+    'bcrypt_sha256': [('rounds', 'log2', 4)],
+    'bcrypt': [('rounds', 'log2', 4)],
+    'scrypt': [('work_factor', 'power_of_two', 2 ** 10)],
+}
+
+
+def scale(value, ratio, growth, minimum):
+    if growth == 'linear':
+        value = round(value * ratio)
+    elif growth == 'log2':
+        value = min(31, round(value + math.log2(ratio)))
+    else:
+        value = 2 ** round(math.log2(value * ratio))
+
+    return max(minimum, value)
+
+
+class Command(BaseCommand):
+    help = (
+        'Measure the verify latency of every configured password hasher and propose '
+        'cost parameters that hit a target latency.'
+    )
+
+    password = 'calibration-password'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--target-ms', type=float, default=50, help='Target p50 verify latency.')
+        parser.add_argument('--samples', type=int, default=10, help='Verifications per measurement.')
+        parser.add_argument('--rounds', type=int, default=3, help='Refinement rounds per parameter.')
+
+    def measure(self, hasher, samples) -> float:
+        encoded = hasher.encode(self.password, hasher.salt())
+        timings = []
+
+        for _ in range(samples):
+            start = time.perf_counter()
+            hasher.verify(self.password, encoded)
+            timings.append((time.perf_counter() - start) * 1000)
+
+        return statistics.median(timings)
+
+    def calibrate(self, hasher, latency, options):
+        tuned = copy.copy(hasher)
+        target = options['target_ms']
+
+        for attribute, growth, minimum in cost_parameters[hasher.algorithm]:
+            value = getattr(tuned, attribute)
+
+            for _ in range(options['rounds']):
+                proposed = scale(value, target / latency, growth, minimum)
+
+                if proposed == value:
+                    break
+
+                value = proposed
+                setattr(tuned, attribute, value)
+                latency = self.measure(tuned, options['samples'])
+
+            if value > minimum or latency <= target:
+                break
+
+        return tuned, latency
+
+    def handle(self, *args, **options):
+        self.stdout.write(f'Target p50 verify latency: {options["target_ms"]:.0f} ms\n')
+        self.stdout.write(f'{"hasher":<16}{"current p50 ms":>16}{"proposed p50 ms":>18}  proposed parameters')
+
+        proposals = {}
+
+        for hasher in get_hashers():
+            if hasher.algorithm not in cost_parameters:
+                continue
+
+            if hasher.library:
+                try:
+                    hasher._load_library()
+                except ValueError:
+                    self.stdout.write(f'{hasher.algorithm:<16}skipped, its library is not installed')
+                    continue
+
+            latency = self.measure(hasher, options['samples'])
+            tuned, tuned_latency = self.calibrate(hasher, latency, options)
+            proposals[hasher.algorithm] = tuned
+
+            parameters = ', '.join(
+                f'{attribute}={getattr(tuned, attribute)}'
+                for attribute, _, _ in cost_parameters[hasher.algorithm]
+            )
+
+            self.stdout.write(f'{hasher.algorithm:<16}{latency:>16.1f}{tuned_latency:>18.1f}  {parameters}')
+
+        if 'argon2' in proposals:
+            tuned = proposals['argon2']
+
+            self.stdout.write(
+                '\nTo use the proposed Argon2 profile, set:\n'
+                f'    PASSWORD_ARGON2_TIME_COST={tuned.time_cost}\n'
+                f'    PASSWORD_ARGON2_MEMORY_COST={tuned.memory_cost}\n'
+                f'    PASSWORD_ARGON2_PARALLELISM={tuned.parallelism}\n'
+                'Existing hashes are upgraded to it after each user\'s next login.'
+            )
@@ -0,0 +1,53 @@
+import logging
+import signal
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from users.outbox import dispatch
+
+logger = logging.getLogger(__name__)
+
+
+class Command(BaseCommand):
+    help = (
+        'Send queued outbox messages. Several dispatchers can run side by side, '
+        'each claims its own batches.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, help='Messages claimed at a time, defaults to OUTBOX_BATCH_SIZE.')
+        parser.add_argument('--lease', type=int, help='Seconds a claimed message is held, renewed before it is sent, defaults to OUTBOX_LEASE_SECONDS.')
+        parser.add_argument('--interval', type=float, help='Seconds to wait when there is nothing to send, defaults to OUTBOX_POLL_INTERVAL.')
+        parser.add_argument('--once', action='store_true', help='Exit once there is nothing left to send.')
+
+    def handle(self, *args, **options):
+        interval = options['interval'] or settings.OUTBOX_POLL_INTERVAL
+        self.stopping = False
+
+        # finish the current batch on SIGTERM instead of abandoning it
+        signal.signal(signal.SIGTERM, self.stop)
+
+        while not self.stopping:
+            close_old_connections()
+
+            try:
+                claimed = dispatch(options['batch_size'], options['lease'])
+            except Exception:
+                # e.g. the database going away, the claimed messages are
+                # retried once their leases end
+                logger.exception('Dispatching outbox messages failed')
+                time.sleep(interval)
+                continue
+
+            if claimed:
+                self.stdout.write(f'Dispatched {claimed} messages')
+            elif options['once']:
+                break
+            else:
+                time.sleep(interval)
+
+    def stop(self, signum, frame):
+        self.stopping = True
@@ -0,0 +1,54 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.utils.dateparse import parse_datetime
+
+from users import export
+
+
+def datetime_argument(value):
+    parsed = parse_datetime(value)
+
+    if parsed is None:
+        raise ValueError(value)
+
+    return parsed
+
+
+class Command(BaseCommand):
+    help = 'Stream users as NDJSON or CSV, to a file or stdout.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--format', choices=list(export.FORMATS), default=export.NDJSON)
+        parser.add_argument('--fields', help=f'Comma separated, from: {", ".join(export.FIELDS)}.')
+        parser.add_argument('--id-after', type=int)
+        parser.add_argument('--id-before', type=int)
+        parser.add_argument('--joined-after', type=datetime_argument, help='ISO 8601 date and time.')
+        parser.add_argument('--joined-before', type=datetime_argument, help='ISO 8601 date and time.')
+        parser.add_argument('--chunk-size', type=int, help='Rows per batch, defaults to USER_EXPORT_CHUNK_SIZE.')
+        parser.add_argument('--output', '-o', help='File to write to, defaults to stdout.')
+
+    def handle(self, *args, **options):
+        fields = export.FIELDS
+
+        if options['fields']:
+            fields = tuple(field.strip() for field in options['fields'].split(','))
+            unknown = set(fields) - set(export.FIELDS)
+
+            if unknown:
+                raise CommandError(f'Unknown fields: {", ".join(sorted(unknown))}')
+
+        queryset = export.export_queryset(
+            fields,
+            id_after=options['id_after'],
+            id_before=options['id_before'],
+            joined_after=options['joined_after'],
+            joined_before=options['joined_before'],
+        )
+        chunks = export.export_chunks(queryset, fields, options['format'], options['chunk_size'])
+
+        if options['output']:
+            with open(options['output'], 'wb') as file:
+                for chunk in chunks:
+                    file.write(chunk)
+        else:
+            for chunk in chunks:
+                self.stdout.write(chunk.decode(), ending='')
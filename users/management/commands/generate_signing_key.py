@@ -0,0 +1,44 @@
+import os
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric import ec, ed25519, rsa
+
+key_generators = {
+    'RS256': lambda: rsa.generate_private_key(public_exponent=65537, key_size=2048),
+    'ES256': lambda: ec.generate_private_key(ec.SECP256R1()),
+    'EdDSA': ed25519.Ed25519PrivateKey.generate,
+}
+
+
+class Command(BaseCommand):
+    help = 'Generate a private key for signing JWTs, to be added to JWT_SIGNING_KEYS.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--algorithm', choices=key_generators.keys(), default='EdDSA')
+        parser.add_argument('--kid', help='Key id, defaults to the current date and time.')
+        parser.add_argument('--output-dir', default='.')
+
+    def handle(self, *args, **options):
+        kid = options['kid'] or timezone.now().strftime('%Y%m%d%H%M%S')
+        path = os.path.join(options['output_dir'], f'{kid}.pem')
+
+        private_key = key_generators[options['algorithm']]()
+
+        pem = private_key.private_bytes(
+            encoding=serialization.Encoding.PEM,
+            format=serialization.PrivateFormat.PKCS8,
+            encryption_algorithm=serialization.NoEncryption(),
+        )
+
+        # create the file readable by its owner only
+        with os.fdopen(os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600), 'wb') as file:
+            file.write(pem)
+
+        self.stdout.write(self.style.SUCCESS(f'Wrote {options["algorithm"]} key to {path}'))
+        self.stdout.write(
+            'Prepend it to JWT_SIGNING_KEYS to start signing with it:\n'
+            f'    JWT_SIGNING_KEYS="{kid}={os.path.abspath(path)},..."'
+        )
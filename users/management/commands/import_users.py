@@ -0,0 +1,70 @@
+import json
+import sys
+from contextlib import ExitStack
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.utils.passwords import hashing_executor
+from users import imports
+
+# never written to the rejects file
+SECRET_FIELDS = ('password', 'password_hash')
+
+
+class Command(BaseCommand):
+    help = (
+        'Create users in bulk from NDJSON or CSV, with email, phone, country_code, first_name, '
+        'last_name, birth_date, date_joined, is_active, email_verified, phone_verified and either '
+        'password or password_hash. Rerunning an interrupted import resumes it.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('input', help='File to read, or - for stdin.')
+        parser.add_argument('--format', choices=imports.FORMATS, help='Defaults to csv for .csv files, else ndjson.')
+        parser.add_argument('--batch-size', type=int, help='Users per transaction, defaults to USER_IMPORT_BATCH_SIZE.')
+        parser.add_argument(
+            '--workers', type=int,
+            help='Processes hashing passwords, defaults to PASSWORD_HASHING_WORKERS. 0 hashes inline.',
+        )
+        parser.add_argument('--checkpoint', help='Progress file, defaults to INPUT.checkpoint for files. Remove it to start over.')
+        parser.add_argument('--rejects', help='File to write rejected records to, as NDJSON with their errors.')
+
+    def handle(self, *args, **options):
+        path = options['input']
+        format = options['format'] or (imports.CSV if path.lower().endswith('.csv') else imports.NDJSON)
+        workers = options['workers'] if options['workers'] is not None else settings.PASSWORD_HASHING_WORKERS
+        checkpoint = options['checkpoint'] or (f'{path}.checkpoint' if path != '-' else None)
+
+        with ExitStack() as stack:
+            try:
+                file = sys.stdin if path == '-' else stack.enter_context(open(path, newline=''))
+            except OSError as exc:
+                raise CommandError(exc)
+
+            rejects = stack.enter_context(open(options['rejects'], 'a')) if options['rejects'] else None
+            executor = stack.enter_context(hashing_executor(workers)) if workers else None
+
+            def rejected(number, record, errors):
+                if rejects:
+                    # lines that didn't parse may hold secrets too
+                    if isinstance(record, dict):
+                        record = {field: value for field, value in record.items() if field not in SECRET_FIELDS}
+                    else:
+                        record = None
+
+                    rejects.write(json.dumps({'record': number, 'data': record, 'errors': errors}) + '\n')
+
+            importer = imports.UserImport(
+                batch_size=options['batch_size'] or settings.USER_IMPORT_BATCH_SIZE,
+                executor=executor,
+                checkpoint=checkpoint,
+                rejected=rejected,
+            )
+            state = importer.run(imports.read_records(file, format))
+
+        self.stdout.write(
+            f'{state["records"]} records: {state["imported"]} users imported, '
+            f'{state["skipped"]} skipped as duplicates of registered users or earlier records, '
+            f'{state["rejected"]} rejected.'
+        )
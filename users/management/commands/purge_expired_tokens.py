@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+
+from users.purge import purge_all
+
+
+class Command(BaseCommand):
+    help = 'Delete expired email verification tokens and phone lookups in small batches.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, help='Rows deleted per batch, defaults to TOKEN_PURGE_BATCH_SIZE.')
+        parser.add_argument('--sleep', type=float, help='Seconds to pause between batches, defaults to TOKEN_PURGE_SLEEP.')
+
+    def handle(self, *args, **options):
+        for result in purge_all(batch_size=options['batch_size'], sleep=options['sleep']):
+            self.stdout.write(
+                f'{result["model"]}: deleted {result["deleted"]} rows in {result["seconds"]:.1f}s '
+                f'({result["rows_per_second"]:.0f} rows/s)'
+            )
@@ -1,6 +1,8 @@
 from django.contrib.auth.base_user import BaseUserManager
 from django.utils.translation import gettext_lazy as _
 
+from core.utils.passwords import set_password
+
 class UserManager(BaseUserManager):
     """
     Custom user model manager where email is the unique identifiers
@@ -18,7 +20,7 @@ class UserManager(BaseUserManager):
             raise ValueError(_("The Email must be set"))
         email = self.normalize_email(email)
         user = self.model(email=email, **extra_fields)
-        user.set_password(password)
+        set_password(user, password)
         user.save()
         return user
     
@@ -30,7 +32,7 @@ class UserManager(BaseUserManager):
         if not phone:
             raise ValueError(_("The Phone must be set"))
         user = self.model(phone=phone, **extra_fields)
-        user.set_password(password)
+        set_password(user, password)
         user.save()
         return user
 
@@ -0,0 +1,24 @@
+# Generated by Django 4.2.3 on 2026-10-18 07:56
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_alter_user_is_active'),
+    ]
+
+    operations = [
+        # nullable without a default, so adding them doesn't rewrite the table
+        migrations.AddField(
+            model_name='user',
+            name='email_normalized',
+            field=models.CharField(blank=True, editable=False, max_length=254, null=True),
+        ),
+        migrations.AddField(
+            model_name='user',
+            name='phone_normalized',
+            field=models.CharField(blank=True, editable=False, max_length=20, null=True),
+        ),
+    ]
@@ -0,0 +1,69 @@
+import time
+
+from django.db import migrations, transaction
+
+BATCH_SIZE = 5000
+
+# Pause between batches, to leave room for regular traffic and replication.
+BATCH_DELAY = 0.05
+
+
+# Copies of the functions in core.utils.users as they were when this
+# migration was written, so later changes to them don't change its result.
+
+def normalize_email(email):
+    if not email:
+        return None
+
+    return email.strip().lower() or None
+
+
+def normalize_phone(phone):
+    if not phone:
+        return None
+
+    phone = phone.strip().replace(' ', '').replace('-', '').replace('(', '').replace(')', '')
+
+    return phone or None
+
+
+def backfill(apps, schema_editor):
+    User = apps.get_model('users', 'User')
+
+    last_pk = 0
+
+    # walk the primary key instead of using OFFSET, and commit every batch
+    # on its own so no lock is held for longer than one batch
+    while True:
+        with transaction.atomic():
+            batch = list(
+                User.objects
+                .filter(pk__gt=last_pk)
+                .order_by('pk')
+                .only('pk', 'email', 'phone')[:BATCH_SIZE]
+            )
+
+            if not batch:
+                break
+
+            for user in batch:
+                user.email_normalized = normalize_email(user.email)
+                user.phone_normalized = normalize_phone(user.phone)
+
+            User.objects.bulk_update(batch, ['email_normalized', 'phone_normalized'])
+
+        last_pk = batch[-1].pk
+        time.sleep(BATCH_DELAY)
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('users', '0004_user_email_normalized_user_phone_normalized'),
+    ]
+
+    operations = [
+        migrations.RunPython(backfill, migrations.RunPython.noop, elidable=True),
+    ]
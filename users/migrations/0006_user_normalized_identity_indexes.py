@@ -0,0 +1,23 @@
+from django.db import migrations, models
+
+from core.utils.migrations import AddIndexConcurrently
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('users', '0005_backfill_normalized_identities'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='user',
+            index=models.Index(fields=['email_normalized'], name='users_user_email_norm_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='user',
+            index=models.Index(fields=['phone_normalized'], name='users_user_phone_norm_idx'),
+        ),
+    ]
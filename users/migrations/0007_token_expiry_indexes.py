@@ -0,0 +1,19 @@
+from django.db import migrations, models
+
+from core.utils.migrations import AddIndexConcurrently
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('users', '0006_user_normalized_identity_indexes'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='emailverificationtoken',
+            index=models.Index(fields=['expires_at', 'token'], name='users_emailtoken_expires_idx'),
+        ),
+    ]
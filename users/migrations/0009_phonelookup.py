@@ -0,0 +1,25 @@
+# Generated by Django 4.2.3 on 2026-10-18 08:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0008_outboxmessage'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PhoneLookup',
+            fields=[
+                ('phone', models.CharField(max_length=32, primary_key=True, serialize=False)),
+                ('valid', models.BooleanField()),
+                ('phone_number', models.CharField(blank=True, max_length=32, null=True)),
+                ('expires_at', models.DateTimeField()),
+            ],
+            options={
+                'indexes': [models.Index(fields=['expires_at', 'phone'], name='users_phonelookup_expires_idx')],
+            },
+        ),
+    ]
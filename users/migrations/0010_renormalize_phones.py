@@ -0,0 +1,62 @@
+import time
+
+from django.db import migrations, transaction
+
+from core.utils.phones import InvalidPhoneNumber, to_e164
+
+BATCH_SIZE = 5000
+
+# Pause between batches, to leave room for regular traffic and replication.
+BATCH_DELAY = 0.05
+
+
+# Unlike 0005 this uses the live parser: its tables only ever gain countries,
+# so running it later gives the same result for numbers that parsed earlier.
+
+def renormalize(apps, schema_editor):
+    User = apps.get_model('users', 'User')
+
+    last_pk = 0
+
+    while True:
+        with transaction.atomic():
+            batch = list(
+                User.objects
+                .filter(pk__gt=last_pk, phone__isnull=False)
+                .order_by('pk')
+                .only('pk', 'phone', 'country_code', 'phone_normalized')[:BATCH_SIZE]
+            )
+
+            if not batch:
+                break
+
+            changed = []
+
+            for user in batch:
+                try:
+                    phone_normalized = to_e164(user.phone, user.country_code)
+                except InvalidPhoneNumber:
+                    # left as it is, see normalize_phone_lookup
+                    continue
+
+                if phone_normalized != user.phone_normalized:
+                    user.phone_normalized = phone_normalized
+                    changed.append(user)
+
+            User.objects.bulk_update(changed, ['phone_normalized'])
+
+        last_pk = batch[-1].pk
+        time.sleep(BATCH_DELAY)
+
+
+class Migration(migrations.Migration):
+
+    atomic = False
+
+    dependencies = [
+        ('users', '0009_phonelookup'),
+    ]
+
+    operations = [
+        migrations.RunPython(renormalize, migrations.RunPython.noop, elidable=True),
+    ]
@@ -5,6 +5,8 @@ from django.utils import timezone
 from .managers import UserManager
 from django.conf import settings
 
+from core.utils.users import normalize_email_lookup, normalize_phone_lookup
+
 def sms_code_expires_in():
     return timezone.now() + settings.SMS_CODE_EXPIRY
 
@@ -57,11 +59,42 @@ class User(AbstractUser):
     USERNAME_FIELD='email'
     REQUIRED_FIELDS=[]
 
+    # Lower-cased, trimmed copy of email and E.164 copy of phone that every
+    # lookup filters on, so they can use an index instead of scanning the table.
+    email_normalized=models.CharField(max_length=254, blank=True, null=True, editable=False)
+    phone_normalized=models.CharField(max_length=20, blank=True, null=True, editable=False)
+
     objects=UserManager()
 
+    class Meta(AbstractUser.Meta):
+        indexes = [
+            models.Index(fields=['email_normalized'], name='users_user_email_norm_idx'),
+            models.Index(fields=['phone_normalized'], name='users_user_phone_norm_idx'),
+        ]
+
     def __str__(self):
         return self.email
+
+    def save(self, *args, **kwargs):
+        self.email_normalized = normalize_email_lookup(self.email)
+        self.phone_normalized = normalize_phone_lookup(self.phone, self.country_code)
+
+        update_fields = kwargs.get('update_fields')
+
+        if update_fields is not None:
+            update_fields = set(update_fields)
+
+            if 'email' in update_fields:
+                update_fields.add('email_normalized')
+            if 'phone' in update_fields or 'country_code' in update_fields:
+                update_fields.add('phone_normalized')
+
+            kwargs['update_fields'] = update_fields
+
+        super().save(*args, **kwargs)
     
+# No longer written, codes live in the OTP store (see core/utils/otp.py).
+# Kept until the rows left behind by earlier releases have expired.
 class PhoneToken(models.Model):
     token = models.CharField(primary_key=True, max_length=6, blank=False, null=False)
     phone = models.CharField(max_length=20, blank=False, null=False)
@@ -75,6 +108,67 @@ class EmailVerificationToken(models.Model):
     created_at = models.DateTimeField(auto_now_add=True)
     expires_at = models.DateTimeField(default=get_email_verification_token_expiry)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['expires_at', 'token'], name='users_emailtoken_expires_idx'),
+        ]
+
+
+class OutboxMessage(models.Model):
+    """
+    A notification to send, written in the same transaction as the rows it
+    is about and sent by the dispatch_outbox command (see users/outbox.py).
+    """
+
+    EMAIL = 'email'
+    SMS = 'sms'
+    VOICE = 'voice'
+
+    CHANNEL_CHOICES = [
+        (EMAIL, 'Email'),
+        (SMS, 'SMS'),
+        (VOICE, 'Voice call'),
+    ]
+
+    id = models.BigAutoField(primary_key=True)
+    channel = models.CharField(max_length=10, choices=CHANNEL_CHOICES)
+    payload = models.JSONField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    # when the message may next be claimed, pushed back while a dispatcher
+    # holds it and after every failed attempt
+    available_at = models.DateTimeField(default=timezone.now)
+    attempts = models.IntegerField(default=0)
+    last_error = models.TextField(blank=True, default='')
+
+    sent_at = models.DateTimeField(blank=True, null=True)
+    failed_at = models.DateTimeField(blank=True, null=True)
+
+    class Meta:
+        indexes = [
+            models.Index(
+                fields=['available_at'],
+                name='users_outbox_pending_idx',
+                condition=models.Q(sent_at__isnull=True, failed_at__isnull=True),
+            ),
+        ]
+
+
+class PhoneLookup(models.Model):
+    """
+    A cached Twilio Lookup result (see core/utils/lookups.py).
+    """
+
+    phone = models.CharField(primary_key=True, max_length=32)
+    valid = models.BooleanField()
+    phone_number = models.CharField(max_length=32, blank=True, null=True)
+    expires_at = models.DateTimeField()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['expires_at', 'phone'], name='users_phonelookup_expires_idx'),
+        ]
+
 
 # User create signal
 
@@ -0,0 +1,175 @@
+import logging
+import random
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.mail import get_connection
+from django.db import transaction
+from django.db.models import F
+from django.utils import timezone
+
+from core.utils import tasks
+from core.utils.metrics import metrics
+
+from .models import OutboxMessage
+
+logger = logging.getLogger(__name__)
+
+# Each message is sent at least once: a dispatcher that dies between sending
+# and marking a message sent leaves it to be sent again once its lease ends.
+# Short of that, leases and SKIP LOCKED make sure no two dispatchers ever
+# hold the same message. A batch takes longer to send than one lease, so
+# each message's lease is renewed right before it is sent, and a message
+# whose lease was lost to another dispatcher is left to that one.
+
+
+def enqueue(channel, **payload) -> OutboxMessage:
+    """
+    Queue a message. Call it inside the transaction that writes the rows the
+    message is about, so it is only sent if they are committed.
+    """
+    return OutboxMessage.objects.create(channel=channel, payload=payload)
+
+
+def enqueue_email(subject, html_content, recipient_list) -> OutboxMessage:
+    return enqueue(
+        OutboxMessage.EMAIL,
+        subject=subject,
+        html_content=html_content,
+        recipient_list=recipient_list,
+    )
+
+
+def claim(batch_size=None, lease=None) -> list:
+    """
+    Lease up to `batch_size` due messages to this dispatcher for `lease`
+    seconds. Rows other dispatchers are claiming right now are skipped
+    instead of waited for.
+    """
+    batch_size = batch_size or settings.OUTBOX_BATCH_SIZE
+    lease = lease or settings.OUTBOX_LEASE_SECONDS
+    now = timezone.now()
+
+    with transaction.atomic():
+        ids = list(
+            OutboxMessage.objects
+            .select_for_update(skip_locked=True)
+            .filter(sent_at__isnull=True, failed_at__isnull=True, available_at__lte=now)
+            .order_by('available_at')
+            .values_list('id', flat=True)[:batch_size]
+        )
+
+        OutboxMessage.objects.filter(id__in=ids).update(
+            available_at=now + timedelta(seconds=lease),
+            attempts=F('attempts') + 1,
+        )
+
+    return list(OutboxMessage.objects.filter(id__in=ids).order_by('available_at', 'id'))
+
+
+def backoff(attempts) -> timedelta:
+    delay = min(settings.OUTBOX_BACKOFF_MAX, settings.OUTBOX_BACKOFF_BASE * 2 ** (attempts - 1))
+
+    # spread out retries of messages that failed together
+    return timedelta(seconds=delay * random.uniform(0.5, 1.0))
+
+
+def send(message, connection=None):
+    payload = message.payload
+
+    if message.channel == OutboxMessage.EMAIL:
+        tasks._send_email(connection=connection, **payload)
+    elif message.channel == OutboxMessage.SMS:
+        tasks._send_phone_code(**payload)
+    elif message.channel == OutboxMessage.VOICE:
+        tasks._call_phone_with_code(**payload)
+    else:
+        raise ValueError(f'Unknown channel {message.channel!r}')
+
+
+def renew(message, lease) -> bool:
+    """
+    Extend this dispatcher's lease on `message` by `lease` seconds. False if
+    the lease was lost: the message was claimed again since, or is done.
+    """
+    available_at = timezone.now() + timedelta(seconds=lease)
+
+    renewed = OutboxMessage.objects.filter(
+        id=message.id,
+        available_at=message.available_at,
+        sent_at__isnull=True,
+        failed_at__isnull=True,
+    ).update(available_at=available_at)
+
+    if renewed:
+        message.available_at = available_at
+
+    return bool(renewed)
+
+
+def _leased(message):
+    # the message, as long as this dispatcher still holds it
+    return OutboxMessage.objects.filter(id=message.id, available_at=message.available_at)
+
+
+def dispatch(batch_size=None, lease=None) -> int:
+    """
+    Claim a batch of messages and send them. Returns how many were claimed.
+    """
+    lease = lease or settings.OUTBOX_LEASE_SECONDS
+    messages = claim(batch_size, lease)
+
+    if not messages:
+        return 0
+
+    # one SMTP session for all of the batch's emails, opened for the first
+    # one so that a mail server outage only holds up emails
+    connection = None
+    open_error = None
+
+    try:
+        for message in messages:
+            if not renew(message, lease):
+                logger.warning('Lost the lease on outbox message %s, leaving it to its new dispatcher', message.id)
+                metrics.counter('outbox.lease_lost').inc()
+                continue
+
+            try:
+                if message.channel == OutboxMessage.EMAIL and connection is None:
+                    if open_error is not None:
+                        raise open_error
+
+                    try:
+                        connection = get_connection()
+                        connection.open()
+                    except Exception as exc:
+                        connection, open_error = None, exc
+                        raise
+
+                send(message, connection=connection)
+            except Exception as exc:
+                failed(message, exc)
+            else:
+                if not _leased(message).update(sent_at=timezone.now()):
+                    logger.warning('Sent outbox message %s after losing its lease, it may be sent twice', message.id)
+
+                metrics.counter(f'outbox.{message.channel}.sent').inc()
+    finally:
+        if connection is not None:
+            connection.close()
+
+    return len(messages)
+
+
+def failed(message, exc):
+    logger.warning('Sending outbox message %s failed (attempt %d): %s', message.id, message.attempts, exc)
+
+    if message.attempts >= settings.OUTBOX_MAX_ATTEMPTS:
+        _leased(message).update(failed_at=timezone.now(), last_error=repr(exc))
+        metrics.counter(f'outbox.{message.channel}.failed').inc()
+    else:
+        _leased(message).update(
+            available_at=timezone.now() + backoff(message.attempts),
+            last_error=repr(exc),
+        )
+        metrics.counter(f'outbox.{message.channel}.retried').inc()
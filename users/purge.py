@@ -0,0 +1,103 @@
+import logging
+import time
+from threading import Thread
+
+from django.conf import settings
+from django.db import connections
+from django.db.models import Q
+from django.utils import timezone
+
+from core.utils.metrics import metrics
+
+from .models import EmailVerificationToken, PhoneLookup
+
+logger = logging.getLogger(__name__)
+
+# Tables with an indexed expires_at column whose expired rows can be dropped
+purgeable_models = (EmailVerificationToken, PhoneLookup)
+
+
+def purge_expired(model, batch_size=None, sleep=None, now=None) -> dict:
+    """
+    Delete the rows of `model` that expired before `now`, `batch_size` rows
+    at a time with a pause of `sleep` seconds between batches, so neither
+    locks nor replication lag build up under production load.
+
+    Batches walk the (expires_at, pk) index from where the previous one
+    stopped instead of from its start, which would otherwise mean stepping
+    over the index entries of rows deleted but not yet vacuumed each time.
+    """
+    batch_size = batch_size or settings.TOKEN_PURGE_BATCH_SIZE
+    sleep = settings.TOKEN_PURGE_SLEEP if sleep is None else sleep
+    now = now or timezone.now()
+
+    expired = model.objects.filter(expires_at__lt=now).order_by('expires_at', 'pk')
+    deleted = 0
+    start = time.perf_counter()
+    last = None
+
+    while True:
+        batch = expired
+
+        if last is not None:
+            batch = batch.filter(Q(expires_at__gt=last[0]) | Q(expires_at=last[0], pk__gt=last[1]))
+
+        keys = list(batch.values_list('expires_at', 'pk')[:batch_size])
+
+        if not keys:
+            break
+
+        # delete by primary key, the ORM's delete() on a sliced queryset
+        # would fetch the rows first
+        count, _ = model.objects.filter(pk__in=[pk for _, pk in keys]).delete()
+        deleted += count
+        last = keys[-1]
+
+        if len(keys) < batch_size:
+            break
+
+        time.sleep(sleep)
+
+    seconds = time.perf_counter() - start
+    metrics.counter(f'token_purge.{model._meta.model_name}.deleted').inc(deleted)
+
+    return {
+        'model': model.__name__,
+        'deleted': deleted,
+        'seconds': seconds,
+        'rows_per_second': deleted / seconds if seconds else 0.0,
+    }
+
+
+def purge_all(**kwargs) -> list:
+    return [purge_expired(model, **kwargs) for model in purgeable_models]
+
+
+def _purge_periodically(interval):
+    while True:
+        time.sleep(interval)
+
+        try:
+            for result in purge_all():
+                logger.info(
+                    'Purged %(deleted)d expired %(model)s rows in %(seconds).1fs (%(rows_per_second).0f rows/s)',
+                    result,
+                )
+        except Exception:
+            logger.exception('Purging expired tokens failed')
+        finally:
+            connections.close_all()
+
+
+def start_periodic_purge(interval=None):
+    """
+    Purge expired tokens every `interval` seconds on a daemon thread in this
+    process. For deployments without a scheduler to run the
+    purge_expired_tokens command.
+    """
+    interval = interval or settings.TOKEN_PURGE_INTERVAL
+
+    thread = Thread(target=_purge_periodically, args=(interval,), name='token-purge', daemon=True)
+    thread.start()
+
+    return thread
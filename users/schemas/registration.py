@@ -6,6 +6,8 @@ from users.models import (
 )
 
 from core.utils.users import (
+    normalize_email_lookup,
+    normalize_phone_lookup,
     normalize_phone_number,
 )
 
@@ -86,12 +88,17 @@ class PhoneRegistrationSchema(serializers.Serializer):
 
         data['phone'] = normalize_phone_number(data['phone'])
 
-        if User.objects.filter(phone=data['phone']).exists():
+        if not data['phone']:
+            raise serializers.ValidationError({
+                'phone': _('Phone is invalid.'),
+            })
+
+        if User.objects.filter(phone_normalized=normalize_phone_lookup(data['phone'])).exists():
             raise serializers.ValidationError({
                 'phone': _('Phone already exists.'),
             })
         
-        if User.objects.filter(email=data['email']).exists():
+        if User.objects.filter(email_normalized=normalize_email_lookup(data['email'])).exists():
             raise serializers.ValidationError({
                 'email': _('Email already exists.'),
             })
@@ -114,7 +121,12 @@ class PhoneRegistrationSchema(serializers.Serializer):
 
         validated_data['phone'] = normalize_phone_number(validated_data['phone'])
 
-        if User.objects.filter(phone=validated_data['phone']).exists():
+        if not validated_data['phone']:
+            raise serializers.ValidationError({
+                'phone': _('Phone is invalid.'),
+            })
+
+        if User.objects.filter(phone_normalized=normalize_phone_lookup(validated_data['phone'])).exists():
             raise serializers.ValidationError({
                 'phone': _('Phone already exists.'),
             })
@@ -4,6 +4,8 @@ from users.models import (
     User,
 )
 
+from core.utils.passwords import set_password
+
 class UserSerializer(serializers.ModelSerializer):
     class Meta:
         model = User
@@ -32,6 +34,6 @@ class UserRegistrationSerializer(serializers.ModelSerializer):
 
         if password != password2:
             raise serializers.ValidationError({'password': 'Passwords must match.'})
-        user.set_password(password)
+        set_password(user, password)
         user.save()
         return user
\ No newline at end of file
@@ -1,15 +1,23 @@
 from rest_framework import serializers
+from django.contrib.auth.hashers import identify_hasher
 from django.utils.translation import gettext_lazy as _
 
+from users import formats
 from users.models import (
     User,
 )
 
 from core.utils.users import (
+    normalize_email_lookup,
     normalize_phone_number,
     phone_number_is_valid,
 )
 
+from core.utils.passwords import (
+    averify_password,
+    verify_password,
+)
+
 class EmailLoginSchema(serializers.Serializer):
     email = serializers.EmailField(required=True, allow_null=False)
     password = serializers.CharField(required=True, allow_null=False, write_only=True)
@@ -24,14 +32,14 @@ class EmailLoginSchema(serializers.Serializer):
                 'email': _('Email is required.'),
             })
         
-        user = User.objects.filter(email=data['email']).first()
+        user = User.objects.filter(email_normalized=normalize_email_lookup(data['email'])).first()
 
         if not user:
             raise serializers.ValidationError({
                 'email': _('Bad email or password.'),
             })
 
-        if not user.check_password(data['password']):
+        if not verify_password(user, data['password']):
             raise serializers.ValidationError({
                 'password': _('Bad email or password.'),
             })
@@ -40,6 +48,24 @@ class EmailLoginSchema(serializers.Serializer):
 
         return data
 
+class EmailLoginBodySchema(serializers.Serializer):
+    """
+    EmailLoginSchema for async views: validates the body only, the
+    credentials are checked by `aget_user` without blocking the event loop.
+    """
+    email = serializers.EmailField(required=True, allow_null=False)
+    password = serializers.CharField(required=True, allow_null=False, write_only=True)
+
+    async def aget_user(self):
+        user = await User.objects.filter(
+            email_normalized=normalize_email_lookup(self.validated_data['email']),
+        ).afirst()
+
+        if user and await averify_password(user, self.validated_data['password']):
+            return user
+
+        return None
+
 class SendOTPBodySchema(serializers.Serializer):
     phone = serializers.CharField(required=True, allow_null=False)
 
@@ -58,7 +84,7 @@ class SendOTPBodySchema(serializers.Serializer):
                 'phone': _('Phone is invalid.'),
             })
         
-        data['phone'] = normalize_phone_number(is_valid[1])
+        data['phone'] = is_valid[1]
         
         return data
     
@@ -86,7 +112,7 @@ class OTPVerifyBodySchema(serializers.Serializer):
                 'phone': _('Phone is invalid.'),
             })
         
-        data['phone'] = normalize_phone_number(is_valid[1])
+        data['phone'] = is_valid[1]
         
         return data
     
@@ -102,5 +128,74 @@ class NormalizePhoneSchema(serializers.Serializer):
             })
         
         data['phone'] = normalize_phone_number(data['phone'])
+
+        if not data['phone']:
+            raise serializers.ValidationError({
+                'phone': _('Phone is invalid.'),
+            })
         
-        return data
\ No newline at end of file
+        return data
+
+class UserExportQuerySchema(serializers.Serializer):
+    output = serializers.ChoiceField(choices=list(formats.FORMATS), default=formats.NDJSON)
+    fields = serializers.CharField(required=False)
+    id_after = serializers.IntegerField(required=False)
+    id_before = serializers.IntegerField(required=False)
+    joined_after = serializers.DateTimeField(required=False)
+    joined_before = serializers.DateTimeField(required=False)
+
+    def validate_fields(self, value):
+        fields = tuple(field.strip() for field in value.split(',') if field.strip())
+        unknown = set(fields) - set(formats.FIELDS)
+
+        if not fields or unknown:
+            raise serializers.ValidationError(
+                _('Choose from: %s.') % ', '.join(formats.FIELDS)
+            )
+
+        return fields
+
+class UserImportSchema(serializers.Serializer):
+    """
+    One user record for the import_users command (see users/imports.py).
+    Passwords come either raw or already hashed in a format Django knows.
+    """
+    email = serializers.EmailField(required=False, allow_null=True)
+    phone = serializers.CharField(required=False, allow_null=True)
+    country_code = serializers.CharField(required=False, max_length=20, default='+1')
+    first_name = serializers.CharField(required=False, allow_null=True, allow_blank=True, max_length=20)
+    last_name = serializers.CharField(required=False, allow_null=True, allow_blank=True, max_length=20)
+    birth_date = serializers.DateField(required=False, allow_null=True)
+    date_joined = serializers.DateTimeField(required=False)
+    is_active = serializers.BooleanField(required=False, default=True)
+    email_verified = serializers.BooleanField(required=False, default=False)
+    phone_verified = serializers.BooleanField(required=False, default=False)
+    password = serializers.CharField(required=False, allow_null=True, trim_whitespace=False, write_only=True)
+    password_hash = serializers.CharField(required=False, allow_null=True, write_only=True)
+
+    def validate_password_hash(self, value):
+        if value:
+            try:
+                identify_hasher(value)
+            except ValueError:
+                raise serializers.ValidationError(_('Unknown password hash format.'))
+
+        return value
+
+    def validate(self, data):
+        if not data.get('email') and not data.get('phone'):
+            raise serializers.ValidationError(_('Email or phone is required.'))
+
+        if data.get('password') and data.get('password_hash'):
+            raise serializers.ValidationError(_('Give either password or password_hash, not both.'))
+
+        if data.get('phone'):
+            data['phone'] = normalize_phone_number(data['phone'], data['country_code'])
+
+            if not data['phone']:
+                raise serializers.ValidationError({
+                    'phone': _('Phone is invalid.'),
+                })
+
+        return data
+
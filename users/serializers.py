@@ -1,6 +1,7 @@
 from rest_framework.serializers import ModelSerializer
-from rest_framework_simplejwt.tokens import RefreshToken
-from rest_framework_simplejwt.serializers import TokenObtainPairSerializer
+from rest_framework_simplejwt import serializers as jwt_serializers
+
+from core.utils.tokens import RefreshToken
 
 from django.contrib.auth import get_user_model
 
@@ -35,6 +36,12 @@ class UserPhoneSerializer(UserSerializer):
 
         return super().is_valid()
 
+class TokenObtainPairSerializer(jwt_serializers.TokenObtainPairSerializer):
+    token_class = RefreshToken
+
+class TokenRefreshSerializer(jwt_serializers.TokenRefreshSerializer):
+    token_class = RefreshToken
+
 class PhoneTokenObtainSerializer(TokenObtainPairSerializer):
     username_field = 'phone'
 
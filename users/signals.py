@@ -0,0 +1,61 @@
+from django.core.signals import request_started, request_finished
+from django.db import transaction
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+
+from rest_framework_simplejwt.token_blacklist.models import BlacklistedToken
+
+from core.utils.authentication import bump_auth_version
+from core.utils.conditional import table_versions
+from core.utils.existence import existence_index
+from core.utils.passwords import begin_deferred_rehashes, run_deferred_rehashes
+from core.utils.revocation import revocation_index
+
+from .models import (
+    User,
+)
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def invalidate_cached_user(sender, instance, **kwargs):
+    # covers password changes and is_active flips, which always go through save().
+    # Bumped now for this connection, which already sees the change, and again
+    # on commit, since until then other requests can still load and cache the
+    # old row under the first new version.
+    user_id = instance.pk
+    bump_auth_version(user_id)
+    transaction.on_commit(lambda: bump_auth_version(user_id))
+
+
+@receiver(post_save, sender=User)
+@receiver(post_delete, sender=User)
+def bump_users_version(sender, **kwargs):
+    # validators for user lists and existence checks (see core/utils/conditional.py)
+    table_versions.bump_on_commit(User)
+
+
+@receiver(post_save, sender=User)
+def index_user_identity(sender, instance, created, update_fields=None, **kwargs):
+    # deleted users are dropped on the next rebuild, until then the database
+    # check behind the index still answers correctly
+    # save() adds the normalized fields whenever email, phone or country_code change
+    if created or update_fields is None or {'email_normalized', 'phone_normalized'} & set(update_fields):
+        existence_index.add(instance.email_normalized, instance.phone_normalized)
+
+
+@receiver(post_save, sender=BlacklistedToken)
+def index_blacklisted_token(sender, instance, created, **kwargs):
+    if created:
+        revocation_index.add(instance.token.jti)
+
+
+@receiver(request_started)
+def start_request(sender, **kwargs):
+    begin_deferred_rehashes()
+
+
+@receiver(request_finished)
+def finish_request(sender, **kwargs):
+    # runs once the response has been sent, so this is off the login's critical path
+    run_deferred_rehashes()
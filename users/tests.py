@@ -1,6 +1,82 @@
+from django.apps import apps as django_apps
 from django.test import TestCase
+from django.test.utils import CaptureQueriesContext
 from rest_framework.test import APIRequestFactory, APIClient
 from django.conf import settings
+from django.contrib.auth.hashers import check_password, make_password
+from django.core.cache import cache, caches
+from django.core import mail
+from django.core.exceptions import ImproperlyConfigured
+from django.core.mail import EmailMessage
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.utils import timezone
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from io import StringIO
+from threading import BoundedSemaphore, Event
+from unittest import mock
+from silk.collector import DataCollector
+from silk.models import Profile
+
+import asyncio
+import csv
+import hashlib
+import importlib
+import json
+import smtplib
+import tempfile
+import jwt
+import threading
+import time
+import urllib.error
+import uuid
+from cryptography.hazmat.primitives.asymmetric import ed25519, rsa
+
+from rest_framework_simplejwt.exceptions import AuthenticationFailed, TokenBackendError, TokenError
+from rest_framework_simplejwt.tokens import AccessToken
+from rest_framework import serializers
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.utils.encoders import JSONEncoder
+
+from core.utils.authentication import CachedJWTAuthentication, local_users
+from core.utils.cache import TieredCache
+from core.utils.conditional import table_versions
+from core.utils.dispatch import BLOCK, DROP, REJECT, DispatchUnavailable, Dispatcher
+from core.utils.existence import existence_index
+from core.utils.idempotency import REPLAYED_HEADER, idempotency_store
+from core.utils.jwt_verifier import JWKSVerifier
+from core.utils.keyring import KeyRing, SigningKey
+from core.utils.lookups import PhoneLookupCache
+from core.utils.mail import PooledEmailBackend, SMTPConnectionPool
+from core.utils.metrics import metrics
+from core.utils import otp
+from core.utils.otp import CacheOTPStore, InMemoryOTPStore
+from core.utils.passwords import (
+    begin_deferred_rehashes,
+    hashing_executor,
+    pool,
+    run_deferred_rehashes,
+    verify_password,
+)
+from core.utils.phones import InvalidPhoneNumber, is_valid, parse, to_e164
+from core.utils.renderers import CustomJSONRenderer, Envelope, JSONFragment
+from core.utils.revocation import revocation_index
+from core.utils.serializers import compile_serializer
+from core.utils.tokens import KeyRingTokenBackend, RefreshToken, token_backend
+from core.utils.users import normalize_phone_lookup, phone_number_is_valid
+from core.utils.twilio_gateway import TwilioGateway
+from users.backends import PhoneBackend
+from aiohttp import web
+from allauth.account.models import EmailAddress
+from users import api as users_api
+from users.api import VerifyEmailView
+from users.schemas.serializers import UserSerializer
+from users import imports, outbox
+from users.models import EmailVerificationToken, OutboxMessage, PhoneLookup, User
+from users.outbox import enqueue_email
+from users.purge import purge_all
 
 client = APIClient()
 factory = APIRequestFactory()
@@ -392,3 +468,1749 @@ class UserTests(TestCase):
         # Remove Authorization header, otherwise other tests will fail
         client.credentials()
         self.assertEqual(response.status_code, 200)
+
+
+class CachedJWTAuthenticationTests(TestCase):
+    def setUp(self):
+        DataCollector().clear()
+        cache.clear()
+        local_users.clear()
+
+        self.user = User.objects.create_user(email='cached@gmail.com', password='abc123')
+        self.request = factory.get('/', HTTP_AUTHORIZATION=f'Bearer {AccessToken.for_user(self.user)}')
+
+    def authenticate(self):
+        return CachedJWTAuthentication().authenticate(self.request)
+
+    def test_user_is_cached(self):
+        """
+        Tests that only the first authenticated request hits the database.
+        """
+        with self.assertNumQueries(1):
+            user, _ = self.authenticate()
+
+        with self.assertNumQueries(0):
+            cached_user, _ = self.authenticate()
+
+        self.assertEqual(user.pk, self.user.pk)
+        self.assertEqual(cached_user.pk, self.user.pk)
+        self.assertIsNot(user, cached_user)
+
+    def test_shared_cache_is_used_across_processes(self):
+        """
+        Tests that an empty local cache falls back to the shared cache.
+        """
+        self.authenticate()
+        local_users.clear()
+
+        with self.assertNumQueries(0):
+            self.authenticate()
+
+    def test_save_invalidates_cached_user(self):
+        """
+        Tests that deactivating a user evicts the cached copy.
+        """
+        self.authenticate()
+
+        self.user.is_active = False
+        self.user.save()
+
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+
+    def test_copy_cached_before_commit_is_evicted(self):
+        """
+        Tests that a copy of the old row cached by a concurrent request,
+        between the save and the commit, isn't served after the commit.
+        """
+        stale = User.objects.get(pk=self.user.pk)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            with transaction.atomic():
+                self.user.is_active = False
+                self.user.save()
+
+                # another request still reads the committed, active row
+                with mock.patch.object(CachedJWTAuthentication, 'load_user', return_value=stale):
+                    user, _ = self.authenticate()
+
+                self.assertTrue(user.is_active)
+
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+
+    def test_delete_invalidates_cached_user(self):
+        """
+        Tests that deleting a user evicts the cached copy.
+        """
+        self.authenticate()
+        self.user.delete()
+
+        with self.assertRaises(AuthenticationFailed):
+            self.authenticate()
+
+
+class KeyRingTokenTests(TestCase):
+    jwksUrl = '/users/.well-known/jwks.json'
+
+    payload = {
+        'token_type': 'access',
+        'user_id': 1,
+    }
+
+    def setUp(self):
+        self.old_key = SigningKey('old', private_key=rsa.generate_private_key(public_exponent=65537, key_size=2048))
+        self.new_key = SigningKey('new', private_key=ed25519.Ed25519PrivateKey.generate())
+
+    def test_tokens_are_signed_with_active_key(self):
+        """
+        Tests that tokens carry the kid of the first key in the ring.
+        """
+        backend = KeyRingTokenBackend(KeyRing([self.new_key, self.old_key]))
+        token = backend.encode(self.payload)
+
+        self.assertEqual(jwt.get_unverified_header(token), {'alg': 'EdDSA', 'kid': 'new', 'typ': 'JWT'})
+        self.assertEqual(backend.decode(token), self.payload)
+
+    def test_rotated_key_still_verifies(self):
+        """
+        Tests that tokens signed before a rotation verify while the old key is kept.
+        """
+        token = KeyRingTokenBackend(KeyRing([self.old_key])).encode(self.payload)
+
+        self.assertEqual(KeyRingTokenBackend(KeyRing([self.new_key, self.old_key])).decode(token), self.payload)
+
+        with self.assertRaises(TokenBackendError):
+            KeyRingTokenBackend(KeyRing([self.new_key])).decode(token)
+
+    def test_symmetric_tokens_can_be_rejected(self):
+        """
+        Tests that tokens without a kid are only accepted when allowed.
+        """
+        backend = KeyRingTokenBackend(KeyRing([self.new_key]), accept_fallback=False)
+        token = backend.fallback.encode(self.payload)
+
+        with self.assertRaises(TokenBackendError):
+            backend.decode(token)
+
+    def test_jwks_endpoint(self):
+        """
+        Tests that the JWKS endpoint publishes every key with cache headers.
+        """
+        keyring = KeyRing([self.new_key, self.old_key])
+
+        with mock.patch.object(token_backend, 'keyring', keyring):
+            response = client.get(self.jwksUrl)
+
+            self.assertEqual(response.status_code, 200)
+            self.assertEqual([key['kid'] for key in response.json()['keys']], ['new', 'old'])
+            self.assertIn('max-age', response['Cache-Control'])
+
+            response = client.get(self.jwksUrl, HTTP_IF_NONE_MATCH=response['ETag'])
+            self.assertEqual(response.status_code, 304)
+            self.assertIn('max-age', response['Cache-Control'])
+
+            response = client.get(self.jwksUrl, HTTP_IF_NONE_MATCH='*')
+            self.assertEqual(response.status_code, 304)
+
+    def test_verifier(self):
+        """
+        Tests that the downstream verifier checks tokens against the published keys.
+        """
+        keyring = KeyRing([self.new_key, self.old_key])
+        verifier = JWKSVerifier(jwks=json.loads(keyring.jwks()))
+
+        for key in (self.new_key, self.old_key):
+            token = KeyRingTokenBackend(KeyRing([key])).encode(self.payload)
+            self.assertEqual(verifier.verify(token), self.payload)
+
+        other_key = SigningKey('new', private_key=ed25519.Ed25519PrivateKey.generate())
+        token = KeyRingTokenBackend(KeyRing([other_key])).encode(self.payload)
+
+        with self.assertRaises(jwt.InvalidTokenError):
+            verifier.verify(token)
+
+    def test_verifier_refetches_a_stale_key_set_once(self):
+        """
+        Tests that concurrent verifications of a stale key set share one refetch.
+        """
+        jwks = json.loads(KeyRing([self.new_key]).jwks())
+        token = KeyRingTokenBackend(KeyRing([self.new_key])).encode(self.payload)
+        verifier = JWKSVerifier('https://auth.example.com/users/.well-known/jwks.json')
+        fetches = []
+
+        def fetch():
+            fetches.append(1)
+            time.sleep(0.05)
+            return jwks
+
+        with mock.patch.object(verifier, '_fetch', side_effect=fetch):
+            with ThreadPoolExecutor(8) as executor:
+                results = list(executor.map(lambda _: verifier.verify(token), range(8)))
+
+        self.assertEqual(results, [self.payload] * 8)
+        self.assertEqual(len(fetches), 1)
+
+    def test_verifier_survives_an_unreachable_endpoint(self):
+        """
+        Tests that fetch errors reject tokens as invalid, and that the last keys fetched keep verifying.
+        """
+        jwks = json.loads(KeyRing([self.new_key]).jwks())
+        token = KeyRingTokenBackend(KeyRing([self.new_key])).encode(self.payload)
+        verifier = JWKSVerifier('https://auth.example.com/users/.well-known/jwks.json', min_refresh_interval=0)
+
+        with mock.patch.object(verifier, '_fetch', side_effect=urllib.error.URLError('refused')):
+            with self.assertRaises(jwt.InvalidTokenError):
+                verifier.verify(token)
+
+        with mock.patch.object(verifier, '_fetch', return_value=jwks):
+            verifier.verify(token)
+
+        # stale, and the endpoint answers garbage
+        verifier._fetched_at -= verifier.cache_timeout
+
+        with mock.patch.object(verifier, '_fetch', side_effect=ValueError('not JSON')) as fetch:
+            self.assertEqual(verifier.verify(token), self.payload)
+            fetch.assert_called_once()
+
+
+class RevocationIndexTests(TestCase):
+    refreshUrl = '/users/token/refresh/'
+
+    def setUp(self):
+        # silk keeps the last request of the thread around and would EXPLAIN every query
+        DataCollector().clear()
+        cache.clear()
+
+        self.user = User.objects.create_user(email='revoked@gmail.com', password='abc123')
+        self.refresh = RefreshToken.for_user(self.user)
+
+        revocation_index.build()
+
+    def test_valid_token_check_makes_no_query(self):
+        """
+        Tests that a token that was never blacklisted is accepted without a query.
+        """
+        with self.assertNumQueries(0):
+            RefreshToken(str(self.refresh))
+
+    def test_blacklisted_token_is_rejected(self):
+        """
+        Tests that a blacklisted token is rejected right away.
+        """
+        self.refresh.blacklist()
+
+        with self.assertRaises(TokenError):
+            RefreshToken(str(self.refresh))
+
+    def test_revocations_from_other_processes_are_replayed(self):
+        """
+        Tests that revocations logged by another process reach the index without a full sync.
+        """
+        other_process = type(revocation_index)()
+        other_process.build()
+
+        self.refresh.blacklist()
+
+        with self.assertNumQueries(1):
+            self.assertTrue(other_process.is_revoked(str(self.refresh['jti'])))
+
+    def test_rotated_token_cannot_be_reused(self):
+        """
+        Tests that a refresh token is blacklisted once it has been rotated.
+        """
+        data = {'refresh': str(self.refresh)}
+
+        response = client.post(self.refreshUrl, data, format='json')
+        self.assertEqual(response.status_code, 200)
+
+        response = client.post(self.refreshUrl, data, format='json')
+        self.assertEqual(response.status_code, 401)
+
+
+class PasswordHashingPoolTests(TestCase):
+    loginUrl = '/users/login/email/'
+
+    def setUp(self):
+        self.user = User.objects.create_user(email='pool@gmail.com', password='abc123')
+
+    def test_verify_password(self):
+        """
+        Tests that passwords hashed and checked on the pool round-trip.
+        """
+        hashed = metrics.summary('password_hashing.hash_seconds').count
+
+        self.assertTrue(verify_password(self.user, 'abc123'))
+        self.assertFalse(verify_password(self.user, 'abc1234'))
+        self.assertTrue(self.user.check_password('abc123'))
+
+        self.assertEqual(metrics.summary('password_hashing.hash_seconds').count, hashed + 2)
+
+    def test_outdated_hash_is_upgraded(self):
+        """
+        Tests that a hash made with an older hasher is replaced on login.
+        """
+        self.user.password = make_password('abc123', hasher='pbkdf2_sha1')
+        self.user.save()
+
+        self.assertTrue(verify_password(self.user, 'abc123'))
+
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith('argon2$'))
+
+    def test_upgrade_waits_for_the_response(self):
+        """
+        Tests that hashes are only upgraded once the request has finished.
+        """
+        self.user.password = make_password('abc123', hasher='pbkdf2_sha256')
+        self.user.save()
+
+        begin_deferred_rehashes()
+        self.assertTrue(verify_password(self.user, 'abc123'))
+
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith('pbkdf2_sha256$'))
+
+        run_deferred_rehashes()
+
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.password.startswith('argon2$'))
+        self.assertTrue(self.user.check_password('abc123'))
+
+    def test_saturated_pool_is_rejected(self):
+        """
+        Tests that logins are turned away with a 503 once the queue is full.
+        """
+        slots = BoundedSemaphore(1)
+        slots.acquire()
+
+        with mock.patch.object(pool, '_slots', slots), mock.patch.object(pool, 'workers', 1):
+            response = client.post(self.loginUrl, {'email': 'pool@gmail.com', 'password': 'abc123'}, format='json')
+
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response['Retry-After'], '1')
+
+
+class NormalizedIdentityTests(TestCase):
+    loginUrl = '/users/login/email/'
+
+    def setUp(self):
+        self.user = User.objects.create_user(email='Mixed.Case@Gmail.com', password='abc123', phone='+1 (555) 010-0000')
+
+    def test_normalized_columns_are_kept_in_sync(self):
+        """
+        Tests that saving a user fills in the normalized email and phone.
+        """
+        self.assertEqual(self.user.email_normalized, 'mixed.case@gmail.com')
+        self.assertEqual(self.user.phone_normalized, '+15550100000')
+
+        self.user.email = ' Other@Gmail.com '
+        self.user.save(update_fields=['email'])
+
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.email_normalized, 'other@gmail.com')
+
+    def test_lookups_ignore_case(self):
+        """
+        Tests that logins match regardless of case and phone formatting.
+        """
+        response = client.post(self.loginUrl, {'email': 'MIXED.case@gmail.com', 'password': 'abc123'}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+        self.assertEqual(PhoneBackend().authenticate(None, phone='+1 555-010-0000', password='abc123'), self.user)
+
+    def test_backfill(self):
+        """
+        Tests that the backfill migration fills in rows saved without the normalized columns.
+        """
+        User.objects.filter(pk=self.user.pk).update(email_normalized=None, phone_normalized=None)
+
+        migration = importlib.import_module('users.migrations.0005_backfill_normalized_identities')
+
+        with mock.patch.object(migration, 'BATCH_DELAY', 0):
+            migration.backfill(django_apps, None)
+
+        self.user.refresh_from_db()
+        self.assertEqual(self.user.email_normalized, 'mixed.case@gmail.com')
+        self.assertEqual(self.user.phone_normalized, '+15550100000')
+
+
+class ExistenceIndexTests(TestCase):
+    def setUp(self):
+        # silk keeps the last request of the thread around and would EXPLAIN every query
+        DataCollector().clear()
+        cache.clear()
+
+        self.user = User.objects.create_user(email='exists@gmail.com', password='abc123', phone='+15550100001')
+
+        existence_index.build()
+
+    def test_unknown_identity_check_makes_no_query(self):
+        """
+        Tests that unregistered emails and phones are answered without a query.
+        """
+        with self.assertNumQueries(0):
+            self.assertFalse(existence_index.email_exists('nobody@gmail.com'))
+            self.assertFalse(existence_index.phone_exists('+15550100002'))
+
+    def test_registered_identity_exists(self):
+        """
+        Tests that registered emails and phones are found, regardless of case and formatting.
+        """
+        self.assertTrue(existence_index.email_exists('Exists@Gmail.com'))
+        self.assertTrue(existence_index.phone_exists('+1 555 010 0001'))
+
+    def test_users_from_other_processes_are_replayed(self):
+        """
+        Tests that users saved by another process reach the index without a rebuild.
+        """
+        other_process = type(existence_index)()
+        other_process.build()
+
+        self.user.email = 'changed@gmail.com'
+        self.user.save()
+
+        with self.assertNumQueries(1):
+            self.assertTrue(other_process.email_exists('changed@gmail.com'))
+
+    def test_country_code_change_is_indexed(self):
+        """
+        Tests that a phone renormalized by a country_code-only save is found.
+        """
+        user = User.objects.create_user(email='london@gmail.com', password='abc123', phone='02079460958')
+        existence_index.build()
+
+        user.country_code = '+44'
+        user.save(update_fields=['country_code'])
+
+        self.assertEqual(user.phone_normalized, '+442079460958')
+        self.assertTrue(existence_index.phone_exists('+442079460958'))
+
+    def test_metrics(self):
+        """
+        Tests that the index reports its size and rebuild time.
+        """
+        snapshot = metrics.snapshot()
+
+        self.assertGreaterEqual(snapshot['existence_index']['items'], 2)
+        self.assertGreater(snapshot['existence_index']['size_bytes'], 0)
+        self.assertGreater(snapshot['existence_index.rebuild_seconds']['count'], 0)
+
+
+class OTPStoreTests(TestCase):
+    stores = (
+        lambda: CacheOTPStore(max_attempts=3),
+        lambda: InMemoryOTPStore(max_attempts=3),
+    )
+
+    def setUp(self):
+        cache.clear()
+
+    def test_code_is_single_use(self):
+        """
+        Tests that a code verifies once, and only for its own phone.
+        """
+        for make_store in self.stores:
+            store = make_store()
+            store.issue('+15550100003', '123456')
+
+            self.assertEqual(store.verify('+15550100004', '123456'), otp.INVALID)
+            self.assertEqual(store.verify('+15550100003', '123456'), otp.VALID)
+            self.assertEqual(store.verify('+15550100003', '123456'), otp.INVALID)
+
+    def test_attempts_are_limited(self):
+        """
+        Tests that a code is discarded after too many wrong attempts.
+        """
+        for make_store in self.stores:
+            store = make_store()
+            store.issue('+15550100003', '123456')
+
+            self.assertEqual(store.verify('+15550100003', '000000'), otp.INVALID)
+            self.assertEqual(store.verify('+15550100003', '000000'), otp.INVALID)
+            self.assertEqual(store.verify('+15550100003', '000000'), otp.ATTEMPTS_EXCEEDED)
+            self.assertEqual(store.verify('+15550100003', '123456'), otp.INVALID)
+
+    def test_new_code_replaces_the_old_one(self):
+        """
+        Tests that issuing a code invalidates the previous one and resets the attempts.
+        """
+        for make_store in self.stores:
+            store = make_store()
+            store.issue('+15550100003', '123456')
+            store.verify('+15550100003', '000000')
+            store.verify('+15550100003', '000000')
+
+            store.issue('+15550100003', '654321')
+
+            self.assertEqual(store.verify('+15550100003', '123456'), otp.INVALID)
+            self.assertEqual(store.verify('+15550100003', '654321'), otp.VALID)
+
+    def test_code_expires(self):
+        """
+        Tests that a code can't be used once it has expired.
+        """
+        store = InMemoryOTPStore(timeout=-1)
+        store.issue('+15550100003', '123456')
+
+        self.assertEqual(store.verify('+15550100003', '123456'), otp.INVALID)
+
+
+class PurgeExpiredTokensTests(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email='purge@gmail.com', password='abc123')
+
+        expired = timezone.now() - timedelta(minutes=1)
+
+        for n in range(5):
+            EmailVerificationToken.objects.create(token=uuid.uuid4(), user=self.user, expires_at=expired)
+
+        EmailVerificationToken.objects.create(token=uuid.uuid4(), user=self.user)
+
+    def test_only_expired_rows_are_deleted(self):
+        """
+        Tests that expired tokens are deleted across several batches and live ones are kept.
+        """
+        results = purge_all(batch_size=2, sleep=0)
+
+        self.assertEqual([result['deleted'] for result in results], [5, 0])
+        self.assertEqual(EmailVerificationToken.objects.count(), 1)
+
+    def test_command_reports_throughput(self):
+        """
+        Tests that the command reports how many rows it deleted and how fast.
+        """
+        out = StringIO()
+        call_command('purge_expired_tokens', '--sleep', '0', stdout=out)
+
+        self.assertIn('EmailVerificationToken: deleted 5 rows', out.getvalue())
+        self.assertIn('rows/s', out.getvalue())
+
+
+class VerifyEmailViewTests(TestCase):
+    def setUp(self):
+        # silk keeps the last request of the thread around and would EXPLAIN every query
+        DataCollector().clear()
+
+        self.user = User.objects.create_user(email='verify@gmail.com', password='abc123')
+        self.token = EmailVerificationToken.objects.create(token=uuid.uuid4(), user=self.user)
+
+    def verify(self, token):
+        request = APIRequestFactory().get('/users/email/verify/', {'token': str(token)})
+
+        return VerifyEmailView.as_view()(request)
+
+    def test_verify_email(self):
+        """
+        Tests that verifying an email marks it verified and uses up the user's tokens.
+        """
+        EmailVerificationToken.objects.create(token=uuid.uuid4(), user=self.user)
+        duplicate = User.objects.create_user(email='Verify@gmail.com', password='abc123')
+
+        response = self.verify(self.token.token)
+        self.assertEqual(response.status_code, 200)
+
+        self.user.refresh_from_db()
+        self.assertTrue(self.user.email_verified)
+        self.assertIsNotNone(self.user.email_verified_at)
+        self.assertTrue(EmailAddress.objects.get(user=self.user, email='verify@gmail.com').verified)
+        self.assertFalse(EmailVerificationToken.objects.filter(user=self.user).exists())
+        self.assertFalse(User.objects.filter(pk=duplicate.pk).exists())
+
+    def test_existing_email_address_is_verified(self):
+        """
+        Tests that an existing unverified EmailAddress row is updated instead of duplicated.
+        """
+        EmailAddress.objects.create(user=self.user, email='verify@gmail.com', verified=False, primary=True)
+
+        self.assertEqual(self.verify(self.token.token).status_code, 200)
+        self.assertEqual(EmailAddress.objects.filter(user=self.user).count(), 1)
+        self.assertTrue(EmailAddress.objects.get(user=self.user).verified)
+
+    def test_query_budget(self):
+        """
+        Tests that verifying takes a fixed, small number of queries.
+        """
+        # token + user, conditional update, duplicate lookup, upsert, token
+        # delete, and the savepoint pair of the transaction
+        with self.assertNumQueries(7):
+            response = self.verify(self.token.token)
+
+        self.assertEqual(response.status_code, 200)
+
+    def test_token_is_single_use(self):
+        """
+        Tests that a token can't be used twice.
+        """
+        self.assertEqual(self.verify(self.token.token).status_code, 200)
+        self.assertEqual(self.verify(self.token.token).status_code, 400)
+
+
+class AsyncViewTests(TestCase):
+    loginUrl = '/users/login/email/'
+    sendOtpUrl = '/users/otp/send/'
+    verifyOtpUrl = '/users/otp/verify/'
+
+    def setUp(self):
+        self.user = User.objects.create_user(email='async@gmail.com', password='abc123')
+
+    async def test_login(self):
+        """
+        Tests that logging in works through the ASGI handler.
+        """
+        response = await self.async_client.post(
+            self.loginUrl,
+            {'email': 'async@gmail.com', 'password': 'abc123'},
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 200)
+
+        response = await self.async_client.post(
+            self.loginUrl,
+            {'email': 'async@gmail.com', 'password': 'abc1234'},
+            content_type='application/json',
+        )
+        self.assertEqual(response.status_code, 400)
+
+    async def test_phone_validation_runs_on_the_sync_thread(self):
+        """
+        Tests that phone validation, which may use the database, doesn't run
+        on an executor thread whose connections are never closed.
+        """
+        phone = '+15550100006'
+        threads = []
+
+        def phone_number_is_valid(*args):
+            threads.append(threading.current_thread())
+            return (True, phone)
+
+        with mock.patch('users.schemas.validation.phone_number_is_valid', side_effect=phone_number_is_valid), \
+                mock.patch('users.api.send_phone_code'):
+            await self.async_client.post(self.sendOtpUrl, {'phone': phone}, content_type='application/json')
+
+        self.assertEqual(threads, [threading.main_thread()])
+
+    async def test_otp_round_trip(self):
+        """
+        Tests that a code sent through the ASGI handler can be verified through it.
+        """
+        phone = '+15550100006'
+
+        with mock.patch('users.schemas.validation.phone_number_is_valid', return_value=(True, phone)), \
+                mock.patch('users.api.generate_sms_code', return_value='123456'), \
+                mock.patch('users.api.send_phone_code'):
+            response = await self.async_client.post(self.sendOtpUrl, {'phone': phone}, content_type='application/json')
+            self.assertEqual(response.status_code, 200)
+
+            response = await self.async_client.post(
+                self.verifyOtpUrl,
+                {'phone': phone, 'token': '123456'},
+                content_type='application/json',
+            )
+            self.assertEqual(response.status_code, 200)
+
+    def test_sync_client(self):
+        """
+        Tests that the async views still serve requests from WSGI.
+        """
+        response = client.post(self.loginUrl, {'email': 'async@gmail.com', 'password': 'abc123'}, format='json')
+        self.assertEqual(response.status_code, 200)
+
+    def test_login_is_profiled(self):
+        """
+        Tests that silk records the profile of the async login view.
+        """
+        client.post(self.loginUrl, {'email': 'async@gmail.com', 'password': 'abc123'}, format='json')
+
+        profile = Profile.objects.get(name='EmailVerifyView.post')
+        self.assertFalse(profile.exception_raised)
+        self.assertGreater(profile.end_time, profile.start_time)
+
+
+class DispatcherTests(TestCase):
+    def test_channel_limit(self):
+        """
+        Tests that a channel never runs more sends at once than its limit, while others go ahead.
+        """
+        dispatcher = Dispatcher(workers=4, max_queue=10, channel_limits={'voice': 1})
+        release = Event()
+        running = []
+        sms_sent = Event()
+
+        def call():
+            running.append(1)
+            release.wait(5)
+
+        dispatcher.submit('voice', call)
+        dispatcher.submit('voice', call)
+        dispatcher.submit('sms', sms_sent.set)
+
+        self.assertTrue(sms_sent.wait(5))
+        self.assertEqual(dispatcher.snapshot()['running']['voice'], 1)
+        self.assertEqual(dispatcher.snapshot()['queued']['voice'], 1)
+
+        release.set()
+        dispatcher.shutdown(timeout=5)
+        self.assertEqual(len(running), 2)
+
+    def test_queue_full_policies(self):
+        """
+        Tests that a full queue drops, rejects or blocks as configured.
+        """
+        release = Event()
+
+        for policy in (DROP, REJECT, BLOCK):
+            dispatcher = Dispatcher(workers=1, max_queue=1, policy=policy, block_timeout=0.05)
+            dispatcher.submit('email', release.wait, 5)
+
+            # wait for the worker to pick up the first send, then fill the queue
+            while dispatcher.snapshot()['queue_depth']:
+                time.sleep(0.01)
+            dispatcher.submit('email', lambda: None)
+
+            if policy == DROP:
+                self.assertFalse(dispatcher.submit('email', lambda: None))
+            else:
+                with self.assertRaises(DispatchUnavailable):
+                    dispatcher.submit('email', lambda: None)
+
+            release.set()
+            dispatcher.shutdown(timeout=5)
+            release.clear()
+
+    def test_shutdown_drains_the_queue(self):
+        """
+        Tests that queued sends still run when the dispatcher shuts down.
+        """
+        dispatcher = Dispatcher(workers=1, max_queue=100)
+        sent = []
+
+        for n in range(20):
+            dispatcher.submit('email', sent.append, n)
+
+        dispatcher.shutdown(timeout=5)
+
+        self.assertEqual(sent, list(range(20)))
+
+
+class OutboxTests(TestCase):
+    def setUp(self):
+        self.message = enqueue_email('Subject', '<p>Hello</p>', ['outbox@gmail.com'])
+
+    def test_dispatch_sends_and_marks_messages(self):
+        """
+        Tests that dispatching sends queued emails once and marks them sent.
+        """
+        self.assertEqual(outbox.dispatch(), 1)
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(mail.outbox[0].to, ['outbox@gmail.com'])
+
+        self.message.refresh_from_db()
+        self.assertIsNotNone(self.message.sent_at)
+
+        self.assertEqual(outbox.dispatch(), 0)
+        self.assertEqual(len(mail.outbox), 1)
+
+    def test_claimed_messages_are_leased(self):
+        """
+        Tests that a claimed message isn't handed to another dispatcher while its lease lasts.
+        """
+        self.assertEqual(len(outbox.claim()), 1)
+        self.assertEqual(outbox.claim(), [])
+
+    def test_failed_sends_back_off(self):
+        """
+        Tests that failed sends are retried later, and given up on after too many attempts.
+        """
+        with mock.patch('users.outbox.send', side_effect=ConnectionError('down')):
+            self.assertEqual(outbox.dispatch(), 1)
+
+        self.message.refresh_from_db()
+        self.assertIsNone(self.message.sent_at)
+        self.assertGreater(self.message.available_at, timezone.now())
+        self.assertIn('down', self.message.last_error)
+
+        OutboxMessage.objects.filter(pk=self.message.pk).update(
+            available_at=timezone.now(),
+            attempts=settings.OUTBOX_MAX_ATTEMPTS - 1,
+        )
+
+        with mock.patch('users.outbox.send', side_effect=ConnectionError('down')):
+            outbox.dispatch()
+
+        self.message.refresh_from_db()
+        self.assertIsNotNone(self.message.failed_at)
+
+    def test_messages_are_not_sent_after_losing_the_lease(self):
+        """
+        Tests that a message claimed again by another dispatcher is left to it.
+        """
+        messages = outbox.claim()
+        lease = messages[0].available_at
+
+        self.assertTrue(outbox.renew(messages[0], 60))
+        self.assertGreater(messages[0].available_at, lease)
+
+        # a second dispatcher claimed it after the lease ran out
+        OutboxMessage.objects.filter(pk=self.message.pk).update(available_at=timezone.now() + timedelta(minutes=5))
+
+        with mock.patch('users.outbox.claim', return_value=messages):
+            self.assertEqual(outbox.dispatch(), 1)
+
+        self.assertEqual(mail.outbox, [])
+        self.message.refresh_from_db()
+        self.assertIsNone(self.message.sent_at)
+
+    def test_dispatcher_survives_errors(self):
+        """
+        Tests that the dispatch_outbox command logs a failed dispatch and retries after its interval.
+        """
+        with mock.patch('users.management.commands.dispatch_outbox.dispatch', side_effect=[RuntimeError('db'), 1, 0]) as dispatch, \
+                mock.patch('users.management.commands.dispatch_outbox.time.sleep') as sleep, \
+                self.assertLogs('users.management.commands.dispatch_outbox', 'ERROR'):
+            call_command('dispatch_outbox', '--once', '--interval', '2', stdout=StringIO())
+
+        self.assertEqual(dispatch.call_count, 3)
+        sleep.assert_called_once_with(2)
+
+    def test_mail_server_outage_only_holds_up_emails(self):
+        """
+        Tests that an SMTP connection that can't be opened fails the batch's emails, not its texts.
+        """
+        sms = outbox.enqueue(OutboxMessage.SMS, phone='+14155552671', code='123456')
+        connection = mock.Mock(**{'open.side_effect': ConnectionRefusedError('refused')})
+
+        with mock.patch('users.outbox.get_connection', return_value=connection), \
+                mock.patch('core.utils.tasks._send_phone_code') as send_phone_code:
+            self.assertEqual(outbox.dispatch(), 2)
+
+        send_phone_code.assert_called_once_with(phone='+14155552671', code='123456')
+
+        sms.refresh_from_db()
+        self.assertIsNotNone(sms.sent_at)
+
+        self.message.refresh_from_db()
+        self.assertIsNone(self.message.sent_at)
+        self.assertIn('refused', self.message.last_error)
+        self.assertGreater(self.message.available_at, timezone.now())
+
+    def test_registration_queues_the_verification_email(self):
+        """
+        Tests that registering queues the verification email with the new user.
+        """
+        with self.settings(SEND_EMAIL_VERIFICATION=True):
+            response = client.post('/users/register/email/', {
+                'email': 'register@gmail.com',
+                'password': 'abc123',
+                'first_name': 'First',
+                'last_name': 'Last',
+            }, format='json')
+
+        self.assertEqual(response.status_code, 200)
+
+        message = OutboxMessage.objects.latest('id')
+        self.assertEqual(message.payload['recipient_list'], ['register@gmail.com'])
+        self.assertTrue(EmailVerificationToken.objects.filter(user__email='register@gmail.com').exists())
+
+    def test_rolled_back_messages_are_never_sent(self):
+        """
+        Tests that messages queued in a transaction that rolls back are discarded with it.
+        """
+        with self.assertRaises(RuntimeError), transaction.atomic():
+            enqueue_email('Subject', '<p>Hello</p>', ['rollback@gmail.com'])
+            raise RuntimeError()
+
+        self.assertEqual(OutboxMessage.objects.count(), 1)
+
+class FakeSMTP:
+    instances = []
+
+    def __init__(self, host, port, **kwargs):
+        self.sent = []
+        self.alive = True
+        self.refused = set()
+        self.instances.append(self)
+
+    def starttls(self, **kwargs):
+        pass
+
+    def login(self, user, password):
+        pass
+
+    def sendmail(self, from_email, recipients, message):
+        if not self.alive:
+            raise smtplib.SMTPServerDisconnected('Connection unexpectedly closed')
+
+        if self.refused.intersection(recipients):
+            raise smtplib.SMTPRecipientsRefused({recipient: (550, b'No such user') for recipient in recipients})
+
+        self.sent.append(recipients)
+
+    def noop(self):
+        if not self.alive:
+            raise smtplib.SMTPServerDisconnected('Connection unexpectedly closed')
+
+        return (250, b'OK')
+
+    def quit(self):
+        self.alive = False
+
+    def close(self):
+        self.alive = False
+
+class SMTPConnectionPoolTests(TestCase):
+    """Tests that emails reuse pooled SMTP connections and survive dropped ones."""
+
+    def setUp(self):
+        FakeSMTP.instances = []
+        patcher = mock.patch('smtplib.SMTP', FakeSMTP)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+        self.pool = SMTPConnectionPool(
+            size=2,
+            max_idle=30,
+            max_messages=3,
+            backend='django.core.mail.backends.smtp.EmailBackend',
+            timeout=1,
+        )
+        self.addCleanup(self.pool.close)
+
+    def message(self, to='user@example.com'):
+        return EmailMessage('Subject', 'Body', 'from@example.com', [to])
+
+    def test_connection_is_reused(self):
+        for _ in range(2):
+            self.assertEqual(self.pool.send_messages([self.message()]), 1)
+
+        self.assertEqual(len(FakeSMTP.instances), 1)
+        self.assertEqual(len(FakeSMTP.instances[0].sent), 2)
+
+    def test_connection_is_replaced_after_max_messages(self):
+        self.assertEqual(self.pool.send_messages([self.message() for _ in range(5)]), 5)
+
+        self.assertEqual([len(smtp.sent) for smtp in FakeSMTP.instances], [3, 2])
+
+    def test_dropped_connection_is_reopened(self):
+        self.pool.send_messages([self.message()])
+        FakeSMTP.instances[0].alive = False
+
+        self.assertEqual(self.pool.send_messages([self.message()]), 1)
+        self.assertEqual(len(FakeSMTP.instances), 2)
+        self.assertEqual(len(FakeSMTP.instances[1].sent), 1)
+
+    def test_idle_connection_is_checked_before_reuse(self):
+        self.pool.send_messages([self.message()])
+        FakeSMTP.instances[0].alive = False
+
+        with mock.patch.object(self.pool, 'max_idle', 0):
+            connection = self.pool.acquire()
+
+        self.assertIs(connection.backend.connection, FakeSMTP.instances[1])
+        self.pool.release(connection)
+
+    def test_refused_message_keeps_the_connection(self):
+        self.pool.send_messages([self.message()])
+        FakeSMTP.instances[0].refused.add('unknown@example.com')
+
+        with self.assertRaises(smtplib.SMTPRecipientsRefused):
+            self.pool.send_messages([self.message('unknown@example.com')])
+
+        with mock.patch('core.utils.mail.pool', self.pool):
+            with PooledEmailBackend() as backend:
+                with self.assertRaises(smtplib.SMTPRecipientsRefused):
+                    backend.send_messages([self.message('unknown@example.com')])
+
+                backend.send_messages([self.message()])
+
+        self.assertEqual(len(FakeSMTP.instances), 1)
+        self.assertEqual(FakeSMTP.instances[0].sent, [['user@example.com'], ['user@example.com']])
+
+    def test_backend_holds_one_connection_between_open_and_close(self):
+        with mock.patch('core.utils.mail.pool', self.pool):
+            with PooledEmailBackend() as backend:
+                backend.send_messages([self.message('a@example.com')])
+                backend.send_messages([self.message('b@example.com')])
+
+                self.assertEqual(self.pool.in_use.value, 1)
+
+        self.assertEqual(len(FakeSMTP.instances), 1)
+        self.assertEqual(FakeSMTP.instances[0].sent, [['a@example.com'], ['b@example.com']])
+
+class TwilioGatewayTests(TestCase):
+    """Tests that Twilio calls share one loop, retry safely and respect their timeouts."""
+
+    def setUp(self):
+        self.gateway = TwilioGateway(
+            account_sid='AC123',
+            auth_token='token',
+            connect_timeout=1,
+            read_timeout=0.2,
+            max_retries=2,
+            pool_size=4,
+            keepalive=30,
+            deadline=1,
+        )
+        self.requests = []
+
+        async def handler(request):
+            self.requests.append(request.method)
+
+            if request.path == '/unavailable' and len(self.requests) < 3:
+                return web.Response(status=503)
+
+            if request.path == '/slow':
+                await asyncio.sleep(1)
+
+            return web.json_response({'method': request.method})
+
+        async def start():
+            app = web.Application()
+            app.router.add_route('*', '/{path}', handler)
+            runner = web.AppRunner(app)
+            await runner.setup()
+            site = web.TCPSite(runner, '127.0.0.1', 0)
+            await site.start()
+
+            return runner, runner.addresses[0][1]
+
+        self.runner, port = self.gateway.run('setup', lambda client: start())
+        self.url = f'http://127.0.0.1:{port}'
+
+    def tearDown(self):
+        self.gateway.run('teardown', lambda client: self.runner.cleanup())
+        self.gateway.close()
+
+    def request(self, method, path):
+        return self.gateway.run('request', lambda client: client.http_client.request(method, self.url + path))
+
+    def test_sync_and_async_callers_share_the_client(self):
+        async def client_of(client):
+            return client
+
+        self.assertIs(self.gateway.run('test', client_of), asyncio.run(self.gateway.arun('test', client_of)))
+
+    def test_async_sends_run_on_the_gateway_loop(self):
+        calls = []
+
+        async def send(client, *args):
+            calls.append((client, args, threading.current_thread().name))
+            return 'sent'
+
+        with mock.patch('core.utils.twilio_gateway._send_sms', send), \
+                mock.patch('core.utils.twilio_gateway._place_call', send), \
+                mock.patch('core.utils.twilio_gateway._lookup', send):
+            async def main():
+                return await asyncio.gather(
+                    self.gateway.asend_sms('+14155552671', 'Your code is 123456'),
+                    self.gateway.aplace_call('+14155552671', '<Response/>'),
+                    self.gateway.alookup('+14155552671'),
+                )
+
+            self.assertEqual(asyncio.run(main()), ['sent'] * 3)
+
+        self.assertEqual(calls, [
+            (self.gateway.client, ('+14155552671', 'Your code is 123456'), 'twilio-gateway'),
+            (self.gateway.client, ('+14155552671', '<Response/>'), 'twilio-gateway'),
+            (self.gateway.client, ('+14155552671',), 'twilio-gateway'),
+        ])
+
+    def test_http_client_settings(self):
+        http_client = self.gateway.client.http_client
+
+        self.assertTrue(http_client.is_async)
+        self.assertEqual(http_client.timeout, 0.2)
+        self.assertEqual(http_client._client_timeout(http_client.timeout).connect, 1)
+
+    def test_lookups_are_retried(self):
+        response = self.request('GET', '/unavailable')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.requests, ['GET', 'GET', 'GET'])
+
+    def test_sends_are_not_retried_after_timing_out(self):
+        with self.assertRaises(asyncio.TimeoutError):
+            self.request('POST', '/slow')
+
+        self.assertEqual(self.requests, ['POST'])
+
+    def test_deadline(self):
+        async def stuck(client):
+            await asyncio.sleep(5)
+
+        start = time.monotonic()
+
+        with self.assertRaises(asyncio.TimeoutError):
+            self.gateway.run('stuck', stuck)
+
+        self.assertLess(time.monotonic() - start, 2)
+
+class PhoneLookupCacheTests(TestCase):
+    """Tests that Twilio Lookup results are cached per validity and fetched once per number."""
+
+    def setUp(self):
+        cache.clear()
+        self.lookups = PhoneLookupCache(valid_timeout=60, invalid_timeout=5, model='users.PhoneLookup')
+        self.calls = []
+
+        def lookup(phone):
+            self.calls.append(phone)
+            time.sleep(0.05)
+
+            return mock.Mock(valid=phone.endswith('0'), phone_number=phone)
+
+        patcher = mock.patch('core.utils.lookups.gateway.lookup', side_effect=lookup)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_results_are_cached_in_every_tier(self):
+        self.assertEqual(self.lookups.lookup('+1 555-010-0000'), (True, '+15550100000'))
+        self.assertEqual(self.lookups.lookup('+15550100000'), (True, '+15550100000'))
+        self.assertEqual(self.calls, ['+15550100000'])
+
+        # another process: the shared cache, then the table, answer without Twilio
+        self.lookups.local.clear()
+        self.assertEqual(self.lookups.lookup('+15550100000'), (True, '+15550100000'))
+
+        self.lookups.local.clear()
+        cache.clear()
+        self.assertEqual(self.lookups.lookup('+15550100000'), (True, '+15550100000'))
+
+        self.assertEqual(len(self.calls), 1)
+
+    def test_invalid_results_expire_sooner(self):
+        self.lookups.lookup('+15550100000')
+        self.lookups.lookup('+15550100001')
+
+        valid, invalid = PhoneLookup.objects.order_by('phone')
+
+        self.assertFalse(invalid.valid)
+        self.assertLess(invalid.expires_at, valid.expires_at)
+
+    def test_concurrent_lookups_share_one_call(self):
+        # rows written from other threads would outlive the test's transaction
+        self.lookups.model = None
+
+        with ThreadPoolExecutor(8) as executor:
+            results = list(executor.map(lambda _: self.lookups.lookup('+15550100000'), range(8)))
+
+        self.assertEqual(results, [(True, '+15550100000')] * 8)
+        self.assertEqual(self.calls, ['+15550100000'])
+
+class PhoneParsingTests(TestCase):
+    """Tests that phone numbers are parsed to E.164 offline."""
+
+    def test_formats(self):
+        for phone in ('+1 (415) 555-2671', '415.555.2671', '1 415 555 2671', '+14155552671', '001 415 555 2671'):
+            self.assertEqual(to_e164(phone), '+14155552671')
+
+        self.assertEqual(to_e164('+44 20 7946 0958'), '+442079460958')
+        self.assertEqual(parse('+44 20 7946 0958').region, 'GB')
+
+    def test_national_numbers_use_the_country_code(self):
+        self.assertEqual(to_e164('020 7946 0958', '+44'), '+442079460958')
+        self.assertEqual(to_e164('07911 123456', '44'), '+447911123456')
+
+        with self.assertRaises(InvalidPhoneNumber):
+            to_e164('020 7946 0958')
+
+    def test_invalid_numbers(self):
+        for phone in ('', 'not a phone', '+1 415 555 267', '+1 015 555 2671', '+999 1234567', '+1415555267112345'):
+            self.assertFalse(is_valid(phone), phone)
+
+    def test_countries_without_a_table(self):
+        for phone in ('+421912345678', '+37251234567', '+359888123456', '+97455123456', '+8801712345678', '+94771234567'):
+            self.assertEqual(to_e164(phone), phone)
+
+        self.assertIsNone(parse('+421 912 345 678').region)
+        self.assertEqual(to_e164('0912 345 678', '+421'), '+421912345678')
+
+        for phone in ('+421 12', '+421 1234567890123'):
+            self.assertFalse(is_valid(phone), phone)
+
+        with mock.patch('core.utils.lookups.phone_lookups.lookup', return_value=(True, '+421912345678')) as lookup:
+            with self.settings(PHONE_LOOKUP_VERIFY=True):
+                self.assertEqual(phone_number_is_valid('+421 912 345 678'), (True, '+421912345678'))
+
+            lookup.assert_called_once_with('+421912345678')
+
+    def test_user_country_code_is_honored(self):
+        user = User.objects.create_user(email='uk@example.com', phone='07911 123456', country_code='+44')
+
+        self.assertEqual(user.phone_normalized, '+447911123456')
+        self.assertTrue(User.objects.filter(phone_normalized=normalize_phone_lookup('+44 7911 123456')).exists())
+
+    def test_twilio_is_only_a_second_check(self):
+        with mock.patch('core.utils.lookups.phone_lookups.lookup') as lookup:
+            self.assertEqual(phone_number_is_valid('(415) 555-2671'), (True, '+14155552671'))
+            self.assertEqual(phone_number_is_valid('555'), (False, None))
+            lookup.assert_not_called()
+
+            with self.settings(PHONE_LOOKUP_VERIFY=True):
+                lookup.return_value = (False, None)
+                self.assertEqual(phone_number_is_valid('(415) 555-2671'), (False, None))
+                lookup.assert_called_once_with('+14155552671')
+
+class IdempotencyTests(TestCase):
+    """Tests that retried POSTs with the same Idempotency-Key get the stored response."""
+
+    sendOtpUrl = '/users/otp/send/'
+    loginUrl = '/users/login/email/'
+    phone = '+14155552671'
+
+    def setUp(self):
+        cache.clear()
+
+        for patcher in (
+            mock.patch('users.schemas.validation.phone_number_is_valid', return_value=(True, self.phone)),
+            mock.patch('users.api.send_phone_code'),
+        ):
+            patcher.start()
+            self.addCleanup(patcher.stop)
+
+    def send(self, key=None, phone=None):
+        headers = {'HTTP_IDEMPOTENCY_KEY': key} if key else {}
+        return client.post(self.sendOtpUrl, {'phone': phone or self.phone}, format='json', **headers)
+
+    def test_retry_is_replayed(self):
+        first = self.send('key-1')
+        second = self.send('key-1')
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second[REPLAYED_HEADER], 'true')
+        users_api.send_phone_code.assert_called_once()
+
+    def test_requests_without_a_key_always_run(self):
+        self.send()
+        self.send()
+
+        self.assertEqual(users_api.send_phone_code.call_count, 2)
+
+    def test_key_reused_for_another_body(self):
+        self.send('key-2')
+
+        self.assertEqual(self.send('key-2', phone='+14155552672').status_code, 422)
+
+    def test_key_in_progress(self):
+        with mock.patch.object(idempotency_store, 'request_key', return_value='idempotency:test'):
+            cache.add('idempotency:test:lock', True)
+
+            self.assertEqual(self.send('key-3').status_code, 409)
+            users_api.send_phone_code.assert_not_called()
+
+    def test_code_verification_is_replayed(self):
+        with mock.patch('users.api.generate_sms_code', return_value='123456'):
+            self.send()
+
+        data = {'phone': self.phone, 'token': '123456'}
+        first = client.post('/users/otp/verify/', data, format='json', HTTP_IDEMPOTENCY_KEY='verify-1')
+        second = client.post('/users/otp/verify/', data, format='json', HTTP_IDEMPOTENCY_KEY='verify-1')
+
+        self.assertEqual(first.status_code, 200)
+        self.assertEqual(second.status_code, 200)
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(second[REPLAYED_HEADER], 'true')
+
+    def test_logins_are_not_replayed(self):
+        User.objects.create_user(email='idempotent@gmail.com', password='abc123')
+        data = {'email': 'idempotent@gmail.com', 'password': 'abc123'}
+
+        first = client.post(self.loginUrl, data, format='json', HTTP_IDEMPOTENCY_KEY='login-1')
+        second = client.post(self.loginUrl, data, format='json', HTTP_IDEMPOTENCY_KEY='login-1')
+
+        self.assertEqual(second.status_code, first.status_code)
+        self.assertFalse(second.has_header(REPLAYED_HEADER))
+        key = idempotency_store.request_key(Request(factory.post(self.loginUrl, HTTP_IDEMPOTENCY_KEY='login-1')))
+        self.assertIsNone(cache.get(key))
+
+    def test_fingerprint_is_keyed(self):
+        request = mock.Mock(data={'password': 'abc123'})
+        body = json.dumps(request.data, sort_keys=True, default=str)
+        fingerprint = idempotency_store.fingerprint(request)
+
+        self.assertNotEqual(fingerprint, hashlib.sha256(body.encode()).hexdigest())
+
+        with self.settings(SECRET_KEY='another-secret-key-for-the-fingerprint-test'):
+            self.assertNotEqual(idempotency_store.fingerprint(request), fingerprint)
+
+class TieredCacheTests(TestCase):
+    """Tests that the tiered cache reads through its LRU and computes each key once."""
+
+    def setUp(self):
+        self.cache = caches['tiered']
+        self.cache.clear()
+
+    def test_reads_go_through_the_local_tier(self):
+        self.cache.set('tiered:key', 'value')
+        caches['default'].delete('tiered:key')
+
+        # still in this process's LRU
+        self.assertEqual(self.cache.get('tiered:key'), 'value')
+
+        self.cache.local.clear()
+        self.assertIsNone(self.cache.get('tiered:key'))
+
+    def test_writes_reach_the_shared_tier(self):
+        self.cache.set('tiered:key', 'value')
+        self.assertEqual(caches['default'].get('tiered:key'), 'value')
+
+        self.cache.delete('tiered:key')
+        self.assertIsNone(caches['default'].get('tiered:key'))
+
+    def test_concurrent_misses_compute_once(self):
+        calls = []
+
+        def compute():
+            calls.append(1)
+            time.sleep(0.05)
+            return 'value'
+
+        with ThreadPoolExecutor(8) as executor:
+            results = list(executor.map(lambda _: self.cache.get_or_compute('tiered:computed', compute, 60), range(8)))
+
+        self.assertEqual(results, ['value'] * 8)
+        self.assertEqual(len(calls), 1)
+
+    def test_waiting_does_not_hold_up_other_keys(self):
+        stripe = lambda key: hash(self.cache.make_and_validate_key(key)) % TieredCache.LOCK_STRIPES
+        other = next(f'tiered:other:{n}' for n in range(10000) if stripe(f'tiered:other:{n}') == stripe('tiered:waited'))
+        waiting, release = threading.Event(), threading.Event()
+
+        def wait(cache, key, version):
+            waiting.set()
+            release.wait(5)
+
+        # another process is computing the key
+        caches['default'].add('tiered:waited:compute', 'other process', 60)
+
+        with mock.patch.object(TieredCache, '_wait', wait), ThreadPoolExecutor(1) as executor:
+            waited = executor.submit(lambda: caches['tiered'].get_or_compute('tiered:waited', lambda: 'waited', 60))
+            self.assertTrue(waiting.wait(5))
+
+            self.assertEqual(self.cache.get_or_compute(other, lambda: 'other', 60), 'other')
+
+            release.set()
+            self.assertEqual(waited.result(5), 'waited')
+
+        # computing after the wait timed out leaves the other process's lock alone
+        self.assertEqual(caches['default'].get('tiered:waited:compute'), 'other process')
+
+    def test_entries_are_refreshed_before_they_expire(self):
+        self.cache.get_or_compute('tiered:early', lambda: 'old', 60)
+
+        # an entry about to expire is all but certain to be recomputed
+        key = self.cache.make_and_validate_key('tiered:early')
+        value = self.cache.local.get(key)[0]
+        self.cache.local.set(key, (value, 1.0, time.time() + 0.001))
+
+        self.assertEqual(self.cache.get_or_compute('tiered:early', lambda: 'new', 60), 'new')
+
+    def test_entries_far_from_expiry_are_kept(self):
+        self.cache.get_or_compute('tiered:fresh', lambda: 'old', 3600)
+
+        self.assertEqual(self.cache.get_or_compute('tiered:fresh', lambda: 'new', 3600), 'old')
+
+class UserPaginationTests(TestCase):
+    """Tests that GetAllUsers pages through users by id with opaque cursors."""
+
+    url = '/users/users/'
+
+    def setUp(self):
+        cache.clear()
+        User.objects.bulk_create([User(email=f'page{n}@example.com', password='!') for n in range(5)])
+
+    def get(self, **params):
+        response = client.get(self.url, params)
+        return response, json.loads(response.content)['data']
+
+    def test_pages_cover_every_user_once(self):
+        ids = []
+        params = {'page_size': 2}
+
+        while True:
+            response, data = self.get(**params)
+            self.assertEqual(response.status_code, 200)
+            ids += [user['id'] for user in data['results']]
+
+            if not data['next']:
+                break
+
+            params['cursor'] = data['next']
+
+        self.assertEqual(ids, list(User.objects.order_by('id').values_list('id', flat=True)))
+
+    def test_rows_match_the_serializer(self):
+        _, data = self.get()
+
+        expected = json.loads(json.dumps(UserSerializer(User.objects.order_by('id'), many=True).data, cls=JSONEncoder))
+        self.assertEqual(data['results'], expected)
+
+    def test_page_size_is_capped(self):
+        with mock.patch.object(users_api.users_pagination, 'max_page_size', 3):
+            _, data = self.get(page_size=100)
+
+        self.assertEqual(len(data['results']), 3)
+
+    def test_invalid_cursor(self):
+        for cursor in ('not a cursor', users_api.users_pagination.encode_cursor('abc')):
+            response, _ = self.get(cursor=cursor)
+            self.assertEqual(response.status_code, 400)
+
+class UserExportTests(TestCase):
+    """Tests that users are streamed as NDJSON or CSV with field selection and ranges."""
+
+    url = '/users/export/'
+
+    def setUp(self):
+        self.admin = User.objects.create_user(email='admin@example.com', password='!', is_staff=True)
+        User.objects.bulk_create([User(email=f'export{n}@example.com', password='!') for n in range(5)])
+
+    def export(self, **params):
+        api_client = APIClient()
+        api_client.force_authenticate(self.admin)
+        response = api_client.get(self.url, params)
+
+        return response, b''.join(response.streaming_content).decode() if response.streaming else None
+
+    def test_ndjson(self):
+        response, body = self.export(fields='id,email', id_after=self.admin.id)
+
+        self.assertEqual(response['Content-Type'], 'application/x-ndjson')
+        self.assertEqual(
+            [json.loads(line) for line in body.splitlines()],
+            [{'id': user.id, 'email': user.email} for user in User.objects.filter(id__gt=self.admin.id).order_by('id')],
+        )
+
+    def test_csv(self):
+        ids = sorted(user.id for user in User.objects.filter(email__startswith='export'))
+        response, body = self.export(output='csv', fields='id,email', id_after=ids[0], id_before=ids[-1])
+
+        rows = list(csv.reader(StringIO(body)))
+
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        self.assertEqual(rows[0], ['id', 'email'])
+        self.assertEqual([int(row[0]) for row in rows[1:]], ids[1:-1])
+
+    def test_unknown_fields_are_refused(self):
+        response, _ = self.export(fields='id,password')
+        self.assertEqual(response.status_code, 400)
+
+    def test_admins_only(self):
+        response = APIClient().get(self.url)
+        self.assertEqual(response.status_code, 401)
+
+    async def test_asgi_response_is_streamed(self):
+        response = await self.async_client.get(
+            self.url,
+            {'fields': 'email'},
+            headers={'Authorization': f'Bearer {AccessToken.for_user(self.admin)}'},
+        )
+        lines = [line async for chunk in response.streaming_content for line in chunk.decode().splitlines()]
+
+        self.assertEqual(len(lines), 6)
+
+    def test_command(self):
+        out = StringIO()
+
+        call_command('export_users', '--fields', 'email', '--chunk-size', '2', stdout=out)
+
+        self.assertEqual(
+            [json.loads(line)['email'] for line in out.getvalue().splitlines()],
+            list(User.objects.order_by('id').values_list('email', flat=True)),
+        )
+
+
+class EnvelopeRendererTests(TestCase):
+    """Tests that the envelope renderer writes the same bytes as JSONRenderer did."""
+
+    def setUp(self):
+        self.renderer = CustomJSONRenderer()
+
+    def legacy(self, data):
+        return JSONRenderer().render({
+            'data': data.get('data') if data.get('data') is not None else {},
+            'status': data.get('status') if data.get('status') is not None else 500,
+            'errors': data.get('errors') if data.get('errors') is not None else [],
+            'message': data.get('message') if data.get('message') is not None else '',
+        })
+
+    def test_matches_json_renderer(self):
+        bodies = [
+            Envelope(data={'user': {'id': 1, 'email': 'a@example.com'}}, status=200, errors=[], message='ok'),
+            Envelope(status=400, errors=['invalid_email'], message='Nope'),
+            {'detail': 'Not found.'},
+            {'data': [{
+                'id': uuid.UUID(int=1),
+                'joined': timezone.now(),
+                'birthday': timezone.now().date(),
+                'name': 'Zoë \u2028 "quoted"',
+                1: None,
+            }], 'status': 200},
+        ]
+
+        for body in bodies:
+            with self.subTest(body=body):
+                self.assertEqual(self.renderer.render(body), self.legacy(body))
+
+    def test_json_fallback(self):
+        body = Envelope(data={'big': 2 ** 80, 'name': 'Zoë'}, status=200)
+
+        self.assertEqual(self.renderer.render(body), self.legacy(body))
+
+        with mock.patch('core.utils.renderers.orjson', None):
+            self.assertEqual(self.renderer.render(body), self.legacy(body))
+
+    def test_fragments_are_written_verbatim(self):
+        body = Envelope(data=JSONFragment('{"users":[1,2]}'), status=200)
+
+        self.assertEqual(self.renderer.render(body), b'{"data":{"users":[1,2]},"status":200,"errors":[],"message":""}')
+        self.assertEqual(
+            json.loads(self.renderer.render(body, 'application/json; indent=2')),
+            {'data': {'users': [1, 2]}, 'status': 200, 'errors': [], 'message': ''},
+        )
+
+    def test_views_return_envelopes(self):
+        response = APIClient().get('/users/exists/email/envelope@example.com')
+
+        self.assertIsInstance(response.data, Envelope)
+        self.assertEqual(response.content, self.legacy(response.data))
+
+
+class CompiledSerializerTests(TestCase):
+    """Tests that compiled serializers render exactly what the DRF serializers do."""
+
+    def setUp(self):
+        self.renderer = CustomJSONRenderer()
+        self.compiled = compile_serializer(UserSerializer)
+
+        User.objects.create_user(email='compiled@example.com', password='!', first_name='Zoë', last_name='O\'Brien')
+        User.objects.create_user(email='blank@example.com', password='!')
+        User.objects.filter(email='blank@example.com').update(first_name='', date_joined=timezone.now().replace(microsecond=0))
+
+    def render(self, data):
+        return self.renderer.render(Envelope(data=data, status=200))
+
+    def test_rows_match_drf(self):
+        users = User.objects.order_by('id')
+        expected = self.render(UserSerializer(users, many=True).data)
+
+        self.assertEqual(self.render(self.compiled.rows(users.values(*self.compiled.fields))), expected)
+        self.assertEqual(self.render(self.compiled.instances(users)), expected)
+
+    def test_instances_match_drf_in_other_timezones(self):
+        user = User.objects.get(email='compiled@example.com')
+
+        with timezone.override('America/New_York'):
+            self.assertEqual(self.render(self.compiled.from_instance(user)), self.render(UserSerializer(user).data))
+
+    def test_none_is_kept(self):
+        user = User(id=None, email='unsaved@example.com', first_name=None)
+
+        self.assertEqual(self.compiled.from_instance(user), dict(UserSerializer(user).data))
+
+    def test_compiled_once_per_class(self):
+        self.assertIs(compile_serializer(UserSerializer), self.compiled)
+
+    def test_nested_serializers_are_refused(self):
+        class NestedSerializer(serializers.Serializer):
+            user = UserSerializer()
+
+        with self.assertRaises(ImproperlyConfigured):
+            compile_serializer(NestedSerializer)
+
+    def test_registration_response(self):
+        response = client.post('/users/register/email/', {
+            'email': 'registered@example.com',
+            'password': 'Sup3r-secret-pw!',
+            'password2': 'Sup3r-secret-pw!',
+        }, format='json')
+        user = User.objects.get(email='registered@example.com')
+
+        self.assertEqual(response.content, self.renderer.render(Envelope(
+            data={'user': UserSerializer(user).data}, status=201, errors=[],
+        )))
+
+
+class ConditionalGetTests(TestCase):
+    """Tests that polled endpoints answer If-None-Match with 304 until users change."""
+
+    def setUp(self):
+        cache.clear()
+        caches['tiered'].clear()
+        User.objects.create_user(email='polled@example.com', password='!', phone='+15005550006')
+
+    def get(self, url, etag=None, **params):
+        headers = {'If-None-Match': etag} if etag else {}
+        return APIClient().get(url, params, headers=headers)
+
+    def create_user(self, email):
+        with self.captureOnCommitCallbacks(execute=True):
+            User.objects.create_user(email=email, password='!')
+
+    def user_queries(self, queries):
+        # silk logs every request to the database too, so only count reads of users
+        return [query for query in queries if query['sql'].startswith('SELECT') and 'FROM "users_user"' in query['sql']]
+
+    def test_users_list(self):
+        response = self.get('/users/users/')
+        etag = response['ETag']
+
+        with CaptureQueriesContext(connection) as queries:
+            not_modified = self.get('/users/users/', etag)
+
+        self.assertEqual(self.user_queries(queries), [])
+        self.assertEqual(not_modified.status_code, 304)
+        self.assertEqual(not_modified['ETag'], etag)
+        self.assertEqual(not_modified.content, b'')
+
+        self.create_user('new@example.com')
+        response = self.get('/users/users/', etag)
+
+        self.assertEqual(response.status_code, 200)
+        self.assertNotEqual(response['ETag'], etag)
+        self.assertIn('new@example.com', [user['email'] for user in json.loads(response.content)['data']['results']])
+
+    def test_unchanged_pages_skip_the_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            first = self.get('/users/users/', page_size=1)
+
+        self.assertEqual(len(self.user_queries(queries)), 1)
+
+        with CaptureQueriesContext(connection) as queries:
+            second = self.get('/users/users/', page_size=1)
+
+        self.assertEqual(self.user_queries(queries), [])
+        self.assertEqual(second.content, first.content)
+        self.assertEqual(len(json.loads(second.content)['data']['results']), 1)
+
+    def test_bulk_writes_bump_explicitly(self):
+        etag = self.get('/users/users/')['ETag']
+
+        User.objects.bulk_create([User(email='bulk@example.com', password='!')])
+        self.assertEqual(self.get('/users/users/', etag).status_code, 304)
+
+        table_versions.bump(User)
+        self.assertEqual(self.get('/users/users/', etag).status_code, 200)
+
+    def test_email_exists(self):
+        url = '/users/exists/email/polled@example.com'
+        response = self.get(url)
+
+        self.assertTrue(json.loads(response.content)['data'] is not None)
+        self.assertEqual(self.get(url, response['ETag']).status_code, 304)
+
+        self.create_user('other@example.com')
+        self.assertEqual(self.get(url, response['ETag']).status_code, 200)
+
+    def test_phone_exists(self):
+        response = self.get('/users/exists/phone/', phone='+15005550006')
+
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get('/users/exists/phone/', response['ETag'], phone='+15005550006').status_code, 304)
+
+        # errors carry no validator
+        self.assertFalse(self.get('/users/exists/phone/').has_header('ETag'))
+
+
+class ImportUsersTests(TestCase):
+    """Tests that import_users creates users in batches, skipping bad and duplicate records."""
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.addCleanup(self.directory.cleanup)
+
+        User.objects.create_user(email='taken@example.com', password='!')
+
+    def path(self, name, content):
+        path = f'{self.directory.name}/{name}'
+
+        with open(path, 'w') as file:
+            file.write(content)
+
+        return path
+
+    def import_users(self, path, *args):
+        out = StringIO()
+        call_command('import_users', path, '--workers', '0', '--batch-size', '2', *args, stdout=out)
+
+        return out.getvalue()
+
+    def test_ndjson(self):
+        records = [
+            {'email': ' Ada@Example.com ', 'password': 'correct horse', 'first_name': 'Ada', 'email_verified': True},
+            {'phone': '(500) 555-0006', 'password_hash': make_password('battery staple')},
+            {'email': 'TAKEN@example.com'},
+            {'email': 'ada@example.com'},
+            {'email': 'not an email', 'password': 'hunter2'},
+            {'first_name': 'Nobody'},
+        ]
+        path = self.path('users.ndjson', '\n'.join(json.dumps(record) for record in records) + '\nnot json\n')
+        rejects = f'{self.directory.name}/rejects.ndjson'
+
+        out = self.import_users(path, '--rejects', rejects)
+
+        self.assertIn('7 records: 2 users imported, 2 skipped as duplicates of registered users or earlier records, 3 rejected.', out)
+
+        ada = User.objects.get(email_normalized='ada@example.com')
+        self.assertEqual(ada.email, 'Ada@Example.com')
+        self.assertTrue(check_password('correct horse', ada.password))
+        self.assertTrue(ada.email_verified)
+        self.assertTrue(EmailAddress.objects.filter(user=ada, email=ada.email, verified=True, primary=True).exists())
+
+        phone_user = User.objects.get(phone='+15005550006')
+        self.assertEqual(phone_user.phone_normalized, '+15005550006')
+        self.assertTrue(check_password('battery staple', phone_user.password))
+
+        with open(rejects) as file:
+            rejected = [json.loads(line) for line in file]
+
+        self.assertEqual([reject['record'] for reject in rejected], [5, 6, 7])
+        self.assertEqual(rejected[0]['data'], {'email': 'not an email'})
+        self.assertIsNone(rejected[2]['data'])
+
+    def test_csv(self):
+        path = self.path('users.csv', 'email,phone,first_name,birth_date\ncsv@example.com,,Csv,1990-01-02\n,+15005550007,,\n')
+
+        self.import_users(path)
+
+        self.assertEqual(str(User.objects.get(email='csv@example.com').birth_date), '1990-01-02')
+        self.assertFalse(User.objects.get(phone='+15005550007').has_usable_password())
+
+    def test_resumes_from_the_checkpoint(self):
+        path = self.path('users.ndjson', '\n'.join(json.dumps({'email': f'resume{n}@example.com'}) for n in range(5)))
+
+        with open(f'{path}.checkpoint', 'w') as file:
+            json.dump({'records': 2, 'imported': 2, 'skipped': 0, 'rejected': 0}, file)
+
+        out = self.import_users(path)
+
+        self.assertIn('5 records: 5 users imported', out)
+        self.assertEqual(
+            sorted(User.objects.filter(email__startswith='resume').values_list('email', flat=True)),
+            ['resume2@example.com', 'resume3@example.com', 'resume4@example.com'],
+        )
+
+        with open(f'{path}.checkpoint') as file:
+            self.assertEqual(json.load(file)['records'], 5)
+
+    def test_new_users_are_in_the_existence_index(self):
+        path = self.path('users.ndjson', json.dumps({'email': 'indexed@example.com', 'phone': '+15005550008'}))
+
+        existence_index.build()
+        self.import_users(path)
+
+        self.assertTrue(existence_index.email_exists('indexed@example.com'))
+        self.assertTrue(existence_index.phone_exists('+15005550008'))
+
+    def test_passwords_are_hashed_in_worker_processes(self):
+        records = [{'email': f'pool{n}@example.com', 'password': f'password {n}'} for n in range(5)]
+
+        with hashing_executor(2) as executor:
+            state = imports.UserImport(batch_size=3, executor=executor).run(records)
+
+        self.assertEqual(state['imported'], 5)
+
+        for n in range(5):
+            self.assertTrue(check_password(f'password {n}', User.objects.get(email=f'pool{n}@example.com').password))
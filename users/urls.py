@@ -17,6 +17,10 @@ from .api import (
 
     VerifyEmailView,
 
+    JWKSView,
+    MetricsView,
+    ExportUsersView,
+
     # Benchmark routes
     GetAllUsers,
 )
@@ -40,6 +44,10 @@ urlpatterns = [
     
     path('email/verify/', VerifyEmailView.as_view(), name='user_verify_email_token'),
     path('token/refresh/', TokenRefreshView.as_view(), name='token_refresh'),
+    path('.well-known/jwks.json', JWKSView.as_view(), name='jwks'),
+
+    path('metrics/', MetricsView.as_view(), name='metrics'),
+    path('export/', ExportUsersView.as_view(), name='export_users'),
 
     path('exists/phone/', PhoneExistsView.as_view(), name='user_exists_phone'),
     path('exists/email/<str:email>', EmailExistsView.as_view(), name='user_exists_email'),
@@ -20,9 +20,7 @@ from allauth.account.models import (
 )
 
 from email_validator import validate_email as email_valid, EmailNotValidError
-from twilio.rest import Client
-
-TWILIO_CLIENT = Client(settings.TWILIO_ACCOUNT_SID, settings.TWILIO_AUTH_TOKEN)
+from core.utils.twilio_gateway import gateway
 
 response_types = TypedDict(
     'response_types',
@@ -76,11 +74,7 @@ def generate_success_response(info: response_types):
     }, status=HTTP_200_OK)
 
 def send_sms(phone: str, message: str):
-    return TWILIO_CLIENT.messages.create(
-        body=message,
-        from_=settings.TWILIO_PHONE_NUMBER,
-        to=phone
-    )
+    return gateway.send_sms(to=phone, body=message)
 
 def generate_sms_token():
     rand = randint(100000, 999999)
@@ -106,7 +100,7 @@ def validate_phone_number(phone: str) -> bool:
     if not phone:
         return False
 
-    phone_number = TWILIO_CLIENT.lookups.v2.phone_numbers(phone).fetch()
+    phone_number = gateway.lookup(phone)
 
     if not phone_number.valid:
         return False